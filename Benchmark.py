@@ -0,0 +1,208 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+default_sizes = [10000, 100000, 1000000]
+
+preload_modules = ['Definitions', 'FlatIndex', 'HistogramEngine', 'HierarchyValidationFunc', 'PFPValidationFunc', 'StreamingLoader', 'TrackValidationFunc', 'ValidationFunc']
+
+load_tree_branches = {'EventTree' : ['Run', 'Subrun', 'Event', 'MCInt_IsCC', 'MCNu_PDG'],
+                      'PFPTree' : ['MCP_TruePDG', 'MCP_HasMatch', 'MCP_NMCHits2D', 'BM_IsTrack', 'BM_IsShower', 'BM_Completeness'],
+                      'HierarchyTree' : ['MC_HierarchyTier', 'MC_ParentIndex', 'BM_HierarchyTier', 'BM_ParentIndex'],
+                      'TrackTree' : ['MCP_HasTargetMichel', 'BM_IsMichelRecod', 'BM_MichelIndex']}
+
+##############################################################################################
+##############################################################################################
+
+def LoadTrees(input_name) :
+
+    import uproot
+    import SyntheticData
+
+    if os.path.isdir(input_name) :
+        return SyntheticData.ReadSyntheticParquet(input_name, load_tree_branches)
+
+    with uproot.open(input_name) as file :
+        return {tree_name : file[tree_name].arrays(branches, library="ak") for tree_name, branches in load_tree_branches.items()}
+
+##############################################################################################
+##############################################################################################
+
+def GetMasks(trees) :
+
+    import Definitions
+
+    int_masks = Definitions.GetIntMasks(trees['EventTree'], trees['PFPTree'])
+    pdg_masks = Definitions.GetPDGMasks(trees['PFPTree'])
+    tier_masks = Definitions.GetTierMasks(trees['HierarchyTree'])
+
+    return int_masks, tier_masks, pdg_masks
+
+##############################################################################################
+##############################################################################################
+
+def BenchGetIntMasks(trees, output_dir) :
+    GetMasks(trees)
+
+def BenchCreateHierarchyTableMetrics(trees, output_dir) :
+    import HierarchyValidationFunc
+    int_masks, tier_masks, pdg_masks = GetMasks(trees)
+    HierarchyValidationFunc.CreateHierarchyTableMetrics(int_masks, tier_masks, pdg_masks, trees['HierarchyTree'], trees['PFPTree'], True, True, output_dir)
+
+def BenchCreateAllHierarchyTableMetrics(trees, output_dir) :
+    import HierarchyValidationFunc
+    int_masks, tier_masks, pdg_masks = GetMasks(trees)
+    HierarchyValidationFunc.CreateAllHierarchyTableMetrics(int_masks, tier_masks, pdg_masks, trees['HierarchyTree'], trees['PFPTree'], plot_dir=output_dir)
+
+def BenchRecoEfficiency(trees, output_dir) :
+    # Histogram and figure data only, rendering is timed separately by FigureRendering users
+    import HistogramEngine
+    import PFPValidationFunc
+    import ValidationFunc
+    int_masks, tier_masks, pdg_masks = GetMasks(trees)
+    plot_var = ValidationFunc.n_mc_hits_2d_var
+    engine = PFPValidationFunc.FillHistograms(int_masks, tier_masks, pdg_masks, trees['PFPTree'], [plot_var])
+    PFPValidationFunc.BuildRecoEfficiencyFigures(engine.hists[HistogramEngine.GetVarKey(plot_var)], plot_var)
+
+def BenchCalculateHierarchyMetrics(trees, output_dir) :
+    # The same parents and links as the Michel topology TrackValidationFunc validates
+    import FlatIndex
+    import TrackValidationFunc
+    import ValidationFunc
+    topology = TrackValidationFunc.michel_topology
+    int_masks, tier_masks, pdg_masks = GetMasks(trees)
+    track_branches = trees['TrackTree']
+    hierarchy_branches = FlatIndex.FlatBranches(trees['HierarchyTree'])
+    for int_type in int_masks :
+        for tier in tier_masks :
+            target_parent_mask = tier_masks[tier] & int_masks[int_type] & pdg_masks[topology.parent_pdg] & (trees['PFPTree']['MCP_HasMatch'] == 1) & \
+                                 (track_branches[topology.target_branch] == 1)
+            reco_michel_indices = track_branches[topology.index_branch][target_parent_mask & (track_branches[topology.recod_branch] == 1)]
+            ValidationFunc.CalculateHierarchyMetrics(hierarchy_branches, reco_michel_indices)
+
+def BenchRunStreaming(input_name, output_dir) :
+    import HistogramEngine
+    import HierarchyValidationFunc
+    import StreamingLoader
+    import ValidationFunc
+    StreamingLoader.RunStreaming(input_name, [HistogramEngine.FillEngine([ValidationFunc.n_mc_hits_2d_var, ValidationFunc.completeness_var]),
+                                              HierarchyValidationFunc.HierarchyTableAccumulator()])
+
+# Entry point name -> (function, whether it reads the file itself rather than loaded trees)
+entry_points = {
+    'GetIntMasks'                    : (BenchGetIntMasks, False),
+    'CreateHierarchyTableMetrics'    : (BenchCreateHierarchyTableMetrics, False),
+    'CreateAllHierarchyTableMetrics' : (BenchCreateAllHierarchyTableMetrics, False),
+    'RecoEfficiency'                 : (BenchRecoEfficiency, False),
+    'CalculateHierarchyMetrics'      : (BenchCalculateHierarchyMetrics, False),
+    'RunStreaming'                   : (BenchRunStreaming, True)
+}
+
+##############################################################################################
+##############################################################################################
+
+def RunEntryPoint(entry_point, input_name, output_dir) :
+
+    # Runs in a fresh process, so the peak RSS belongs to this entry point alone
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    # Import everything up front, so module import time isn't counted
+    for module_name in preload_modules :
+        __import__(module_name)
+
+    function, reads_file = entry_points[entry_point]
+    trees = None if reads_file else LoadTrees(input_name)
+
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    function(input_name if reads_file else trees, output_dir)
+
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    return {'entry_point' : entry_point, 'wall_s' : wall_time, 'cpu_s' : cpu_time,
+            'peak_traced_bytes' : peak_traced, 'max_rss_bytes' : max_rss}
+
+##############################################################################################
+##############################################################################################
+
+def RunBenchmarks(sizes=default_sizes, selected=None, mean_pfps=10, max_depth=4, file_format='root', work_dir=None, seed=0) :
+
+    import Profiling
+    import SyntheticData
+
+    selected = list(entry_points) if selected is None else selected
+    work_dir = work_dir or tempfile.mkdtemp(prefix='PandoraMetricsBench_')
+    output_dir = os.path.join(work_dir, 'output') + os.sep
+    os.makedirs(output_dir, exist_ok=True)
+
+    report = {'commit' : Profiling.GetGitCommit(),
+              'timestamp' : datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              'host' : platform.node(),
+              'versions' : Profiling.GetVersions(),
+              'config' : {'mean_pfps' : mean_pfps, 'max_depth' : max_depth, 'format' : file_format, 'seed' : seed},
+              'results' : []}
+
+    spawn_context = multiprocessing.get_context('spawn')
+
+    for n_events in sizes :
+
+        if file_format == 'parquet' :
+            input_name = SyntheticData.WriteSyntheticParquet(os.path.join(work_dir, f'synthetic_{n_events}'), n_events, mean_pfps, max_depth, seed)
+        else :
+            input_name = SyntheticData.WriteSyntheticFile(os.path.join(work_dir, f'synthetic_{n_events}.root'), n_events, mean_pfps, max_depth, seed)
+
+        for entry_point in selected :
+
+            # Streaming needs a ROOT file
+            if entry_points[entry_point][1] and file_format == 'parquet' :
+                continue
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor :
+                result = executor.submit(RunEntryPoint, entry_point, input_name, output_dir).result()
+
+            result['n_events'] = n_events
+            report['results'].append(result)
+            print(f"{entry_point:<32} {n_events:>9} events  {result['wall_s']:8.3f} s  {result['peak_traced_bytes'] / 1e6:9.1f} MB traced  {result['max_rss_bytes'] / 1e6:9.1f} MB RSS")
+
+    return report
+
+##############################################################################################
+##############################################################################################
+
+def main() :
+
+    parser = argparse.ArgumentParser(description='Time the validation entry points on synthetic Pandora-like trees')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='Numbers of events to generate')
+    parser.add_argument('--entry-points', nargs='+', choices=list(entry_points), default=None)
+    parser.add_argument('--mean-pfps', type=float, default=10, help='Mean number of MCParticles per event')
+    parser.add_argument('--max-depth', type=int, default=4, help='Deepest hierarchy tier')
+    parser.add_argument('--format', choices=['root', 'parquet'], default='root')
+    parser.add_argument('--work-dir', default=None, help='Where synthetic files are written (default: a temporary directory)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_report.json', help='Machine-readable report')
+    args = parser.parse_args()
+
+    report = RunBenchmarks(args.sizes, args.entry_points, args.mean_pfps, args.max_depth, args.format, args.work_dir, args.seed)
+
+    with open(args.output, 'w') as f :
+        json.dump(report, f, indent=1)
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,156 @@
+import awkward as ak
+import hashlib
+import math
+import numpy as np
+import os
+
+# Event-level Poisson bootstrap: every replica gives each event a Poisson(1) weight, and a count is
+# the weighted sum over the events it comes from, so particles of one event move together.
+# The weights are a hash of (Run, Subrun, Event, seed), so they don't depend on how the events are split
+# into chunks or workers, and replicas filled separately merge like any other counts. Streamed chunks also mix
+# in a hash of their file's path, so events of different files that share IDs get independent weights
+
+event_id_branches = ['Run', 'Subrun', 'Event']
+
+default_n_replicas = 200
+default_seed = 0
+
+# Most entries a single batched bincount fills (n_replicas x n_entries), replicas are split into blocks above it
+max_block_entries = 2 ** 24
+
+poisson_cdf = np.cumsum([math.exp(-1.0) / math.factorial(k) for k in range(20)])
+
+##############################################################################################
+##############################################################################################
+
+def SplitMix64(x) :
+
+    with np.errstate(over='ignore') :
+        z = x + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+
+    return z ^ (z >> np.uint64(31))
+
+##############################################################################################
+##############################################################################################
+
+def GetFileKey(file_name) :
+    # 64 bits of a hash of the file's absolute path, 0 for arrays that don't say which file they're from
+    if file_name is None :
+        return np.uint64(0)
+    return np.uint64(int.from_bytes(hashlib.sha1(os.path.abspath(file_name).encode()).digest()[:8], 'little'))
+
+##############################################################################################
+##############################################################################################
+
+def GetEventKeys(event_branches, seed=default_seed) :
+
+    # A 64 bit hash of each event's (Run, Subrun, Event), its file (StreamingLoader.LazyTreeBranches) and the seed
+    event_key = np.full(len(event_branches[event_id_branches[0]]), seed, dtype=np.uint64) ^ GetFileKey(getattr(event_branches, 'file_name', None))
+
+    for branch in event_id_branches :
+        event_key = SplitMix64(event_key ^ ak.to_numpy(event_branches[branch]).astype(np.int64).astype(np.uint64))
+
+    return event_key
+
+##############################################################################################
+##############################################################################################
+
+def GetEventWeights(event_branches, n_replicas=default_n_replicas, seed=default_seed) :
+
+    # (n_replicas, n_events) Poisson(1) weights
+    event_key = GetEventKeys(event_branches, seed)
+
+    with np.errstate(over='ignore') :
+        counters = event_key[np.newaxis, :] + np.arange(1, n_replicas + 1, dtype=np.uint64)[:, np.newaxis] * np.uint64(0x632BE59BD9B4E019)
+
+    uniform = (SplitMix64(counters) >> np.uint64(11)).astype(np.float64) * (2.0 ** -53)
+
+    return np.searchsorted(poisson_cdf, uniform, side='right').astype(np.uint8)
+
+##############################################################################################
+##############################################################################################
+
+def GetEntryEvents(jagged) :
+    # Event index of each entry of a jagged array, in flattened order
+    return np.repeat(np.arange(len(jagged)), ak.to_numpy(ak.num(jagged)))
+
+##############################################################################################
+##############################################################################################
+
+def FillReplicas(replicas, key, entry_events, event_weights) :
+
+    # replicas : (n_replicas, ...) counts, key : flat index into one replica for each entry
+    n_replicas = replicas.shape[0]
+    flat_replicas = replicas.reshape(n_replicas, -1)
+    n_keys = flat_replicas.shape[1]
+
+    # All replicas in one bincount, each in its own block of the index space
+    block_size = max(1, max_block_entries // max(len(key), 1))
+
+    for start in range(0, n_replicas, block_size) :
+        stop = min(start + block_size, n_replicas)
+        replica_key = np.arange(stop - start)[:, np.newaxis] * n_keys + key[np.newaxis, :]
+        filled = np.bincount(replica_key.ravel(), weights=event_weights[start:stop, entry_events].ravel(), minlength=(stop - start) * n_keys)
+        flat_replicas[start:stop] += np.rint(filled).astype(np.int64).reshape(stop - start, n_keys)
+
+    return replicas
+
+##############################################################################################
+##############################################################################################
+
+def GetReplicaCounts(mask, event_weights) :
+    # (n_replicas,) weighted count of a jagged mask
+    return event_weights.astype(np.int64) @ ak.to_numpy(ak.sum(mask, axis=1)).astype(np.int64)
+
+##############################################################################################
+##############################################################################################
+
+def GetReplicaEntryCounts(entry_mask, entry_events, event_weights) :
+    # (n_replicas,) weighted count of the flat entries in entry_mask
+    return event_weights.astype(np.int64) @ np.bincount(entry_events[entry_mask], minlength=event_weights.shape[1])
+
+##############################################################################################
+##############################################################################################
+
+def GetReplicaHistogram(bin_indices, n_slots, entry_events, event_weights) :
+    # (n_replicas, n_slots) weighted histogram of flat entries, bin_indices as from HistogramEngine.GetBinIndices
+    return FillReplicas(np.zeros((event_weights.shape[0], n_slots), dtype=np.int64), bin_indices, entry_events, event_weights)
+
+##############################################################################################
+##############################################################################################
+
+def GetRatioUncertainty(replica_pass, replica_total) :
+
+    # Spread of pass/total over the replicas (axis 0), leaving out replicas with nothing in total
+    # nan where fewer than two replicas are left
+    replica_pass = np.asarray(replica_pass, dtype=np.float64)
+    replica_total = np.asarray(replica_total, dtype=np.float64)
+
+    is_valid = replica_total > 0
+    ratio = np.divide(replica_pass, replica_total, out=np.zeros_like(replica_pass), where=is_valid)
+    n_valid = is_valid.sum(axis=0)
+
+    mean = np.divide(ratio.sum(axis=0), n_valid, out=np.zeros(n_valid.shape), where=n_valid > 0)
+    sum_squares = np.where(is_valid, (ratio - mean) ** 2, 0.0).sum(axis=0)
+
+    return np.sqrt(np.divide(sum_squares, n_valid - 1, out=np.full(n_valid.shape, np.nan), where=n_valid > 1))
+
+##############################################################################################
+##############################################################################################
+
+def AddBootstrapUncertainties(records, counts_holder, get_record_counts) :
+
+    # get_record_counts : counts -> (n_pass, n_total) of each record, in the order of records, along the last axes
+    #   for counts with any leading axes, so every replica's come from one call on the (n_replicas, ...) replicas
+    if counts_holder.replicas is None :
+        return records
+
+    n_replicas = counts_holder.replicas.shape[0]
+    replica_pass, replica_total = [np.reshape(counts, (n_replicas, -1)) for counts in get_record_counts(counts_holder.replicas)]
+
+    for record, uncertainty in zip(records, GetRatioUncertainty(replica_pass, replica_total)) :
+        record['bootstrap_uncertainty'] = float(uncertainty)
+
+    return records
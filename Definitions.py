@@ -1,156 +1,221 @@
 import awkward as ak
+import collections.abc
+import json
+import numpy as np
+import os
+import Profiling
 
 ##############################################################################################
 ##############################################################################################
 
-ints = [0, 1, 2]
+# The interaction, PDG and tier categories: which branches select them, and their labels and styles
+#   Each category has one selection per branch of its axis: a list of values, a {"min", "max"} range
+#   (max excluded, either can be left out) or null for any value. Where selections overlap the first category wins
+category_file = os.environ.get('PANDORA_METRICS_CATEGORIES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Categories.json'))
 
-int_strings = {
-    0: "CC \u03BD\u03BC",
-    1: "CC \u03BDe",
-    2: "NC"
-}
+#   A category's key only names it (in records, tables and selections), counts and figure panels are laid out by its position in the list
+with open(category_file, encoding='utf-8') as f :
+    category_registry = json.load(f)
 
-pdgs = [13, 2212, 211, 22, 11]
+for axis_name, axis in category_registry.items() :
+    keys = [category['key'] for category in axis['categories']]
+    if len(set(keys)) != len(keys) :
+        raise ValueError(f'{category_file}: the {axis_name} category keys must be unique, not {keys}')
 
-pdg_strings = {
-    13   : "Muon",
-    2212 : "Proton",
-    211  : "ChPion", 
-    22   : "Photon",
-    11   : "Electron"
-}
+ints = [category['key'] for category in category_registry['int']['categories']]
 
-pdg_color = {
-    13   : "Blue",
-    2212 : "tab:green",
-    211  : "tab:pink", 
-    22   : "tab:orange",
-    11   : "Red"
-}
+int_strings = {category['key'] : category['label'] for category in category_registry['int']['categories']}
 
-tiers = [0, 1, 2]
+pdgs = [category['key'] for category in category_registry['pdg']['categories']]
 
-tier_strings = {
-    0  : "Primary",
-    1  : "Secondary",
-    2  : "Other"
-}
+pdg_strings = {category['key'] : category['label'] for category in category_registry['pdg']['categories']}
 
-tier_style = {
-    0  : "solid",
-    1  : "dashed",
-    2  : "dotted"
-}
+pdg_color = {category['key'] : category['color'] for category in category_registry['pdg']['categories']}
 
+tiers = [category['key'] for category in category_registry['tier']['categories']]
+
+tier_strings = {category['key'] : category['label'] for category in category_registry['tier']['categories']}
+
+tier_style = {category['key'] : category['style'] for category in category_registry['tier']['categories']}
+
+# Branches read by GetIntMasks, GetPDGMasks and GetTierMasks (event-level categories are broadcast to MCP_TruePDG)
+mask_tree_branches = {}
+
+for axis in list(category_registry.values()) + [{'tree' : 'PFPTree', 'branches' : ['MCP_TruePDG']}] :
+    tree_branches = mask_tree_branches.setdefault(axis['tree'], [])
+    tree_branches += [branch for branch in axis['branches'] if branch not in tree_branches]
+
+# Axis name -> (per-branch interval edges, table of category indices), built on first use
+category_lookups = {}
+
+##############################################################################################
+##############################################################################################
+
+def GetCodeDtype(n_categories) :
+    # Category codes run up to n_categories (none of them), int8 unless a registry has more than 127 categories on an axis
+    return np.int8 if n_categories < 128 else np.int16
 
 ##############################################################################################
 ##############################################################################################
 
+def BuildCategoryLookup(axis) :
+
+    # Cut each branch's values into the intervals that the selections' values and ranges bound
+    edges = []
+
+    for branch_index in range(len(axis['branches'])) :
+        branch_edges = []
+        for category in axis['categories'] :
+            selection = category['select'][branch_index]
+            if isinstance(selection, dict) :
+                branch_edges += [selection[bound] for bound in ['min', 'max'] if bound in selection]
+            elif selection is not None :
+                branch_edges += [float(value) for value in selection] + [np.nextafter(float(value), np.inf) for value in selection]
+        edges.append(np.unique(np.array(branch_edges, dtype=np.float64)))
+
+    # Then each combination of intervals (one per branch) maps to a category index, len(categories) for none
+    n_categories = len(axis['categories'])
+    table = np.full([len(branch_edges) + 1 for branch_edges in edges], n_categories, dtype=GetCodeDtype(n_categories))
+
+    for index in reversed(range(n_categories)) :
+        intervals = []
+        for selection, branch_edges in zip(axis['categories'][index]['select'], edges) :
+            if selection is None :
+                intervals.append(np.arange(len(branch_edges) + 1))
+            elif isinstance(selection, dict) :
+                start = np.searchsorted(branch_edges, selection['min'], side='right') if 'min' in selection else 0
+                stop = np.searchsorted(branch_edges, selection['max'], side='right') if 'max' in selection else len(branch_edges) + 1
+                intervals.append(np.arange(start, stop))
+            else :
+                intervals.append(np.searchsorted(branch_edges, np.array(selection, dtype=np.float64), side='right'))
+        table[np.ix_(*intervals)] = index
+
+    return edges, table
+
+##############################################################################################
+##############################################################################################
+
+def GetCategoryCodes(axis_name, branches) :
+
+    axis = category_registry[axis_name]
+
+    if axis_name not in category_lookups :
+        category_lookups[axis_name] = BuildCategoryLookup(axis)
+
+    edges, table = category_lookups[axis_name]
+    intervals = []
+
+    for branch, branch_edges, take_abs in zip(axis['branches'], edges, axis['abs']) :
+        values = branches[branch]
+        values = ak.to_numpy(ak.flatten(values) if axis['level'] == 'particle' else values).astype(np.float64)
+        intervals.append(np.searchsorted(branch_edges, np.abs(values) if take_abs else values, side='right'))
+
+    # One code per entry of the axis' tree, whatever the number of categories
+    return table[tuple(intervals)]
+
+##############################################################################################
+##############################################################################################
+
+class CategoryMasks(collections.abc.Mapping) :
+    # {category : jagged mask} for one axis, made from the flat (int8) codes each time a mask is asked for,
+    # so only the codes and one offsets buffer stay in memory rather than a full-size mask per category.
+    # Code that groups by category (e.g. HistogramEngine) uses the codes directly
+    def __init__(self, codes, counts, categories) :
+        self.codes = codes
+        self.counts = counts
+        self.category_indices = {category : index for index, category in enumerate(categories)}
+
+        # Every mask shares the one offsets buffer
+        self.offsets = ak.index.Index64(np.concatenate([[0], np.cumsum(counts)]))
+
+    def __getitem__(self, category) :
+        index = self.category_indices[category]
+        return ak.Array(ak.contents.ListOffsetArray(self.offsets, ak.contents.NumpyArray(self.codes == index)))
+
+    def __iter__(self) :
+        return iter(self.category_indices)
+
+    def __len__(self) :
+        return len(self.category_indices)
+
+##############################################################################################
+##############################################################################################
+
+@Profiling.Profiled('masks:int')
 def GetIntMasks(event_branches, pfp_branches) :
 
-    mc_pdg = pfp_branches['MCP_TruePDG']
-    
     # Match PFP jagged array
-    mc_iscc = ak.broadcast_arrays(event_branches['MCInt_IsCC'], mc_pdg)[0]
-    mc_nupdg = ak.broadcast_arrays(event_branches['MCNu_PDG'], mc_pdg)[0]
-    
-    int_masks = {0 : (mc_iscc == 1) & (abs(mc_nupdg) == 14),
-                 1 : (mc_iscc == 1) & (abs(mc_nupdg) == 12),
-                 2 : (mc_iscc == 0)}
-
-    #(int_mask_broadcast, _) = ak.broadcast_arrays(int_mask, pfp_branches['MCP_TruePDG'])
+    counts = ak.to_numpy(ak.num(pfp_branches['MCP_TruePDG']))
+    codes = np.repeat(GetCategoryCodes('int', event_branches), counts)
 
-    return int_masks
+    return CategoryMasks(codes, counts, ints)
 
 ##############################################################################################
 ##############################################################################################
 
+@Profiling.Profiled('masks:pdg')
 def GetPDGMasks(pfp_branches) :
 
-    mc_pdg = abs(pfp_branches['MCP_TruePDG'])
-    
-    pfp_masks = {
-        13   : (mc_pdg == 13),
-        2212 : (mc_pdg == 2212),
-        211  : (mc_pdg == 211), 
-        22   : (mc_pdg == 22),
-        11   : (mc_pdg == 11)
-    }
+    counts = ak.to_numpy(ak.num(pfp_branches['MCP_TruePDG']))
 
-    return pfp_masks
+    return CategoryMasks(GetCategoryCodes('pdg', pfp_branches), counts, pdgs)
 
 ##############################################################################################
 ##############################################################################################
 
+@Profiling.Profiled('masks:tier')
 def GetTierMasks(hierarchy_branches) :
 
-    mc_tier = hierarchy_branches['MC_HierarchyTier']
-    
-    tier_masks = {
-        0  : (mc_tier == 1),
-        1  : (mc_tier == 2),
-        2  : (mc_tier > 2)
-    }
+    counts = ak.to_numpy(ak.num(hierarchy_branches['MC_HierarchyTier']))
 
-    return tier_masks    
-    
+    return CategoryMasks(GetCategoryCodes('tier', hierarchy_branches), counts, tiers)
 
 ##############################################################################################
 ##############################################################################################
 
-def PrintEventSummary(int_masks, hierarchy_branches, pfp_branches) :
+@Profiling.Profiled('table:event_summary')
+def PrintEventSummary(int_masks, hierarchy_branches, pfp_branches, count_scales=None) :
 
-    mc_tier = hierarchy_branches['MC_HierarchyTier']
-    mc_pdg = abs(pfp_branches['MCP_TruePDG'])
-    mc_has_match = pfp_branches['MCP_HasMatch']
+    import HistogramEngine
+    import MetricRecords
 
+    # Rendered from the same records as the efficiency tables
+    engine = HistogramEngine.FillEngine(fill_reco_class=False)
+    engine.Fill({'PFPTree' : pfp_branches}, int_masks, GetTierMasks(hierarchy_branches), GetPDGMasks(pfp_branches))
+    records = MetricRecords.GetEfficiencyRecords(engine.category_counts, count_scales=count_scales)
+    indexed_records = MetricRecords.IndexRecords(records)
 
-    # CC numu [0], CC nue [1], NC [2]
-    for int_type in [0, 1, 2] :
+    def CountString(int_type, pdg, tier) :
+        record = indexed_records[('efficiency', int_type, pdg, tier, '', 'Reco')]
+        return f" MC: {record['n_total']}, BM: {record['n_pass']}"
 
+    # One column per tier, as many as the registry has
+    column_width = 21
+    line = '-' * (10 + (column_width + 1) * len(tiers) + 1)
 
-        print('--------------------------------------------------------------------------')
-        print(int_strings[int_type] + str(' '* (10 - len(int_strings[int_type]))) + '|         1         |          2          |          3+        |')
-        print('--------------------------------------------------------------------------')
+    for int_type in ints :
 
-        int_mask = int_masks[int_type]
-        (int_mask_broadcast, _) = ak.broadcast_arrays(int_mask, mc_pdg)
-        target_mask_1 = int_mask & (mc_tier == 1)
-        target_mask_2 = int_mask & (mc_tier == 2)
-        target_mask_3 = int_mask & (mc_tier > 2)
-        reco_mask = int_mask & (mc_has_match == 1)
-        reco_mask_1 = reco_mask & (mc_tier == 1)
-        reco_mask_2 = reco_mask & (mc_tier == 2)
-        reco_mask_3 = reco_mask & (mc_tier > 2)        
+
+        print(line)
+        print(int_strings[int_type] + str(' '* (10 - len(int_strings[int_type]))) + \
+              ''.join('|' + f'{tier_strings[tier]:^{column_width}}' for tier in tiers) + '|')
+        print(line)
 
         for pdg in pdgs :
 
-            pdg_mask = mc_pdg == pdg
-            
-            string_1 = f" MC: {ak.sum(target_mask_1 & pdg_mask)}, BM: {ak.sum(reco_mask_1 & pdg_mask)}"
-            string_2 = f" MC: {ak.sum(target_mask_2 & pdg_mask)}, BM: {ak.sum(reco_mask_2 & pdg_mask)}"
-            string_3 = f" MC: {ak.sum(target_mask_3 & pdg_mask)}, BM: {ak.sum(reco_mask_3 & pdg_mask)}"
+            count_strings = [CountString(int_type, pdg, tier) for tier in tiers]
 
             print(str(pdg) + str(' '* (10 - len(str(pdg)))) + \
-                                    '|' + string_1 + str(' '* (19 - len(string_1))) + \
-                                    '|' + string_2 + str(' '* (21 - len(string_2))) + \
-                                    '|' + string_3 + str(' '* (20 - len(string_3))) + \
-                                    '|')
-        print('--------------------------------------------------------------------------')
+                  ''.join('|' + count_string + str(' '* (column_width - len(count_string))) for count_string in count_strings) + '|')
+        print(line)
 
 
-        tot_string_1 = f" MC: {ak.sum(target_mask_1)}, BM: {ak.sum(reco_mask_1)}"
-        tot_string_2 = f" MC: {ak.sum(target_mask_2)}, BM: {ak.sum(reco_mask_2)}"
-        tot_string_3 = f" MC: {ak.sum(target_mask_3)}, BM: {ak.sum(reco_mask_3)}"
+        tot_strings = [CountString(int_type, -1, tier) for tier in tiers]
 
         print('          ' + \
-                       '|' + tot_string_1 + str(' '* (19 - len(tot_string_1))) + \
-                       '|' + tot_string_2 + str(' '* (21 - len(tot_string_2))) + \
-                       '|' + tot_string_3 + str(' '* (20 - len(tot_string_3))) + \
-                       '|')
+              ''.join('|' + tot_string + str(' '* (column_width - len(tot_string))) for tot_string in tot_strings) + '|')
 
-        print('--------------------------------------------------------------------------')
+        print(line)
 
         # print('------------------------------------------------------------')
         # print(('TRACK' if isTrack else 'SHOWER'))
@@ -187,6 +252,8 @@ def PrintEventSummary(int_masks, hierarchy_branches, pfp_branches) :
         # print('------------------------------------------------------------')
         # print('')
 
+    return records
+
 
 
 
@@ -0,0 +1,239 @@
+import awkward as ak
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import Definitions
+import HistogramEngine
+import StreamingLoader
+
+default_cache_dir = os.environ.get('PANDORA_METRICS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'PandoraMetrics'))
+max_cache_bytes = 20 * 1024 ** 3
+
+# Bump when the meaning of the stored codes changes
+cache_version = 3
+
+code_names = ['int', 'pdg', 'tier', 'has_match', 'reco_class']
+
+# Branches the category codes are derived from
+code_tree_branches = StreamingLoader.MergeTreeBranches(Definitions.mask_tree_branches, HistogramEngine.FillEngine().tree_branches)
+
+##############################################################################################
+##############################################################################################
+
+class CachedColumns :
+    def __init__(self, path) :
+        with open(os.path.join(path, 'meta.json')) as f :
+            self.meta = json.load(f)
+
+        # Memory mapped, so nothing is read until it's used
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.columns = {name : LoadColumn(path, column) for name, column in self.meta['columns'].items()}
+
+    def Codes(self) :
+        return {name : self.columns[name] for name in code_names}
+
+    def VarValues(self, var_keys) :
+        return {var_key : self.columns[f'var:{var_key}'] for var_key in var_keys}
+
+    def Jagged(self, name) :
+        content = ak.contents.NumpyArray(self.columns[name])
+        return ak.Array(ak.contents.ListOffsetArray(ak.index.Index64(self.offsets), content))
+
+##############################################################################################
+##############################################################################################
+
+def LoadColumn(path, column) :
+
+    # Empty files can't be memory mapped
+    if column['length'] == 0 :
+        return np.zeros(0, dtype=column['dtype'])
+
+    return np.memmap(os.path.join(path, column['file']), dtype=column['dtype'], mode='r', shape=(column['length'],))
+
+##############################################################################################
+##############################################################################################
+
+def GetCacheKey(file_name, tree_branches, var_keys=()) :
+
+    # The columns are stored per var key, so e.g. a diff var and the two plain vars of its branches need their own entries
+    stat = os.stat(file_name)
+    key = {'file' : os.path.abspath(file_name),
+           'size' : stat.st_size,
+           'mtime' : stat.st_mtime_ns,
+           'branches' : {tree_name : sorted(branches) for tree_name, branches in sorted(tree_branches.items())},
+           'vars' : sorted(var_keys),
+           'categories' : Definitions.category_registry,
+           'version' : cache_version}
+
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+##############################################################################################
+##############################################################################################
+
+def GetCacheSize(path) :
+    return sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+
+##############################################################################################
+##############################################################################################
+
+def EvictCache(max_bytes=None, cache_dir=default_cache_dir) :
+
+    max_bytes = max_cache_bytes if max_bytes is None else max_bytes
+
+    if not os.path.isdir(cache_dir) :
+        return
+
+    entries = []
+
+    for key in os.listdir(cache_dir) :
+        path = os.path.join(cache_dir, key)
+        if os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json')) :
+            entries.append((os.path.getmtime(path), GetCacheSize(path), path))
+
+    # Least recently used first
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+
+    for _, size, path in entries :
+        if total_bytes <= max_bytes :
+            break
+
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+
+##############################################################################################
+##############################################################################################
+
+def LoadColumns(key, cache_dir=default_cache_dir) :
+
+    path = os.path.join(cache_dir, key)
+
+    if not os.path.exists(os.path.join(path, 'meta.json')) :
+        return None
+
+    # Mark as recently used for the eviction
+    os.utime(path)
+
+    return CachedColumns(path)
+
+##############################################################################################
+##############################################################################################
+
+def BuildColumns(file_name, key, plot_vars, step_size, cache_dir=default_cache_dir) :
+
+    engine = HistogramEngine.FillEngine(plot_vars)
+    tree_branches = StreamingLoader.MergeTreeBranches(code_tree_branches, engine.tree_branches)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = os.path.join(cache_dir, f'{key}.tmp-{os.getpid()}')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = {}
+    files = {}
+    counts = []
+
+    try :
+        for chunk in StreamingLoader.IterateChunks(file_name, tree_branches, step_size) :
+
+            int_masks = Definitions.GetIntMasks(chunk['EventTree'], chunk['PFPTree'])
+            pdg_masks = Definitions.GetPDGMasks(chunk['PFPTree'])
+            tier_masks = Definitions.GetTierMasks(chunk['HierarchyTree'])
+
+            codes = HistogramEngine.GetCategoryCodes(int_masks, tier_masks, pdg_masks, chunk['PFPTree'])
+            # As they come, int16 where a registry axis has more than 127 categories
+            chunk_columns = {name : np.asarray(codes[name]) for name in code_names}
+
+            for var_key, plot_var in engine.plot_vars.items() :
+                chunk_columns[f'var:{var_key}'] = HistogramEngine.GetVarValues(chunk['PFPTree'], plot_var)
+
+            # Append each column as raw bytes, so only one chunk is ever in memory
+            for name, values in chunk_columns.items() :
+                if name not in files :
+                    file = f'column_{len(files)}.bin'
+                    files[name] = open(os.path.join(tmp_path, file), 'wb')
+                    columns[name] = {'file' : file, 'dtype' : values.dtype.str, 'length' : 0}
+                files[name].write(np.ascontiguousarray(values).tobytes())
+                columns[name]['length'] += len(values)
+
+            counts.append(ak.to_numpy(ak.num(chunk['PFPTree']['MCP_HasMatch'])))
+    finally :
+        for file in files.values() :
+            file.close()
+
+    counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+    np.save(os.path.join(tmp_path, 'offsets.npy'), np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f :
+        json.dump({'file' : os.path.abspath(file_name), 'columns' : columns}, f)
+
+    # Make room before adding the new entry, so it can't be the one that's evicted
+    EvictCache(cache_dir=cache_dir)
+
+    # Another process may have got there first, in which case keep theirs
+    path = os.path.join(cache_dir, key)
+
+    try :
+        os.rename(tmp_path, path)
+    except OSError :
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return CachedColumns(path)
+
+##############################################################################################
+##############################################################################################
+
+def GetCachedColumns(file_name, plot_vars=(), step_size=StreamingLoader.default_step_size, cache_dir=default_cache_dir) :
+
+    var_branches = [branch for plot_var in plot_vars for branch in HistogramEngine.GetVarBranches(plot_var)]
+    key = GetCacheKey(file_name, StreamingLoader.MergeTreeBranches(code_tree_branches, {'PFPTree' : var_branches}),
+                      [HistogramEngine.GetVarKey(plot_var) for plot_var in plot_vars])
+    cached = LoadColumns(key, cache_dir)
+
+    if cached is None :
+        cached = BuildColumns(file_name, key, plot_vars, step_size, cache_dir)
+
+    return cached
+
+##############################################################################################
+##############################################################################################
+
+def FillFromCache(file_name, engine, step_size=StreamingLoader.default_step_size, cache_dir=default_cache_dir) :
+
+    if not isinstance(engine, HistogramEngine.FillEngine) :
+        raise ValueError(f'Only HistogramEngine.FillEngine can be filled from the cache, not {type(engine).__name__}')
+
+    # The cached codes don't keep which event each PFP came from
+    if engine.n_replicas > 0 :
+        raise ValueError('Bootstrap replicas need the event of each PFP, fill them with StreamingLoader.RunStreaming instead')
+
+    cached = GetCachedColumns(file_name, list(engine.plot_vars.values()), step_size, cache_dir)
+    codes = cached.Codes()
+    var_values = cached.VarValues(engine.plot_vars.keys())
+    n_events = len(cached.offsets) - 1
+
+    # step_size events at a time, so only the pages of one slice are read and memory doesn't grow with the file
+    for event_start in range(0, n_events, step_size) :
+        start, stop = int(cached.offsets[event_start]), int(cached.offsets[min(event_start + step_size, n_events)])
+        engine.FillCodes({name : column[start:stop] for name, column in codes.items()},
+                         {var_key : values[start:stop] for var_key, values in var_values.items()})
+
+    return engine
+
+##############################################################################################
+##############################################################################################
+
+def GetCachedMasks(file_name, step_size=StreamingLoader.default_step_size, cache_dir=default_cache_dir) :
+
+    cached = GetCachedColumns(file_name, (), step_size, cache_dir)
+    masks = []
+
+    for name, categories in [('int', Definitions.ints), ('tier', Definitions.tiers), ('pdg', Definitions.pdgs)] :
+        masks.append(Definitions.CategoryMasks(np.asarray(cached.columns[name]), np.diff(cached.offsets), categories))
+
+    # Same order as the validation functions take them
+    int_masks, tier_masks, pdg_masks = masks
+
+    return int_masks, tier_masks, pdg_masks
@@ -0,0 +1,194 @@
+import awkward as ak
+import numpy as np
+import os
+import uproot
+import StreamingLoader
+
+# (Run, Subrun, Event) -> entry number in each tree, built once and kept next to the file as <file>.eventindex.npz
+#   <tree>_ids    Run/Subrun/Event of every entry, in entry order
+#   <tree>_order  the entries sorted by (Run, Subrun, Event), what the lookups search
+# Trees without Run/Subrun/Event are addressed by the EventTree entry, as everywhere else
+# The stored index is rebuilt when the file's size or modification time no longer match
+
+# Bump when the stored layout changes
+index_version = 1
+
+event_id_dtype = np.dtype([(branch, np.int64) for branch in StreamingLoader.event_id_branches])
+
+##############################################################################################
+##############################################################################################
+
+def GetIndexPath(file_name) :
+    return f'{file_name}.eventindex.npz'
+
+##############################################################################################
+##############################################################################################
+
+def GetFileStat(file_name) :
+    stat = os.stat(file_name)
+    return np.array([index_version, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+##############################################################################################
+##############################################################################################
+
+class EventIndex :
+
+    def __init__(self, file_name, ids, order=None) :
+        self.file_name = file_name
+        self.ids = ids
+        self.order = order if order is not None else \
+                     {tree_name : np.lexsort([tree_ids[branch] for branch in reversed(StreamingLoader.event_id_branches)]) for tree_name, tree_ids in ids.items()}
+        self.sorted_ids = {tree_name : tree_ids[self.order[tree_name]] for tree_name, tree_ids in ids.items()}
+
+    def __len__(self) :
+        return len(self.ids['EventTree'])
+
+    def GetEntries(self, run, subrun, event, tree_name='EventTree') :
+
+        # All entries of the tree with this (Run, Subrun, Event), in entry order, more than one if it is duplicated
+        if tree_name not in self.ids :
+            tree_name = 'EventTree'
+
+        key = np.array([(run, subrun, event)], dtype=event_id_dtype)
+        start = np.searchsorted(self.sorted_ids[tree_name], key, side='left')[0]
+        stop = np.searchsorted(self.sorted_ids[tree_name], key, side='right')[0]
+
+        return np.sort(self.order[tree_name][start:stop])
+
+    def GetEntry(self, run, subrun, event, tree_name='EventTree') :
+
+        entries = self.GetEntries(run, subrun, event, tree_name)
+
+        if len(entries) == 0 :
+            raise KeyError(f'Run {run}, Subrun {subrun}, Event {event} is not in the {tree_name} of {self.file_name}')
+
+        return int(entries[0])
+
+    def GetEventID(self, entry, tree_name='EventTree') :
+        return tuple(int(value) for value in self.ids[tree_name][entry])
+
+    def GetMisalignedEntries(self) :
+
+        # Entries whose Run/Subrun/Event differ from the EventTree's at the same entry number
+        ref_ids = self.ids['EventTree']
+        misaligned = {}
+
+        for tree_name, tree_ids in self.ids.items() :
+            n_common = min(len(tree_ids), len(ref_ids))
+            is_misaligned = tree_ids[:n_common] != ref_ids[:n_common]
+            misaligned[tree_name] = np.concatenate([np.flatnonzero(is_misaligned), np.arange(n_common, max(len(tree_ids), len(ref_ids)))])
+
+        return misaligned
+
+    def GetDuplicateEntries(self, tree_name='EventTree') :
+
+        # Entries sharing their (Run, Subrun, Event) with another entry
+        sorted_ids = self.sorted_ids[tree_name]
+        is_repeat = np.zeros(len(sorted_ids), dtype=bool)
+        is_repeat[1:] = sorted_ids[1:] == sorted_ids[:-1]
+        is_repeat[:-1] |= is_repeat[1:]
+
+        return np.sort(self.order[tree_name][is_repeat])
+
+    def CheckAlignment(self) :
+
+        for tree_name, entries in self.GetMisalignedEntries().items() :
+            if len(entries) > 0 :
+                raise ValueError(f'{tree_name} is not aligned with EventTree at {len(entries)} entries, the first is entry {entries[0]}')
+
+    def Save(self, path=None) :
+
+        path = GetIndexPath(self.file_name) if path is None else path
+        arrays = {'file_stat' : GetFileStat(self.file_name)}
+
+        for tree_name, tree_ids in self.ids.items() :
+            arrays[f'{tree_name}_ids'] = tree_ids
+            arrays[f'{tree_name}_order'] = self.order[tree_name]
+
+        # Written under another name first, so a half written index is never read
+        with open(f'{path}.tmp', 'wb') as f :
+            np.savez(f, **arrays)
+
+        os.replace(f'{path}.tmp', path)
+
+        return path
+
+##############################################################################################
+##############################################################################################
+
+def ReadEventIDs(tree) :
+
+    branches = tree.arrays(StreamingLoader.event_id_branches, library='np')
+    ids = np.zeros(tree.num_entries, dtype=event_id_dtype)
+
+    for branch in StreamingLoader.event_id_branches :
+        ids[branch] = branches[branch]
+
+    return ids
+
+##############################################################################################
+##############################################################################################
+
+def BuildEventIndex(file_name) :
+
+    with uproot.open(file_name) as file :
+        trees = {tree_name : file[tree_name] for tree_name in StreamingLoader.tree_names if tree_name in file}
+        ids = {tree_name : ReadEventIDs(tree) for tree_name, tree in trees.items() \
+               if all(branch in tree.keys() for branch in StreamingLoader.event_id_branches)}
+
+    if 'EventTree' not in ids :
+        raise ValueError(f'{file_name} has no EventTree with {StreamingLoader.event_id_branches}')
+
+    return EventIndex(file_name, ids)
+
+##############################################################################################
+##############################################################################################
+
+def LoadEventIndex(file_name, rebuild=False) :
+
+    path = GetIndexPath(file_name)
+
+    if (not rebuild) and os.path.exists(path) :
+        with np.load(path) as stored :
+            if np.array_equal(stored['file_stat'], GetFileStat(file_name)) :
+                ids = {key[:-len('_ids')] : stored[key] for key in stored.files if key.endswith('_ids')}
+                return EventIndex(file_name, ids, {tree_name : stored[f'{tree_name}_order'] for tree_name in ids})
+
+    event_index = BuildEventIndex(file_name)
+
+    # Read-only directories just don't keep it
+    try :
+        event_index.Save(path)
+    except OSError :
+        pass
+
+    return event_index
+
+##############################################################################################
+##############################################################################################
+
+def ReadEvent(file_name, run, subrun, event, tree_branches=None, event_index=None) :
+
+    # One event's records from each tree (all branches unless tree_branches says otherwise), read straight from its entry
+    event_index = LoadEventIndex(file_name) if event_index is None else event_index
+    tree_branches = {tree_name : None for tree_name in StreamingLoader.tree_names} if tree_branches is None else tree_branches
+    records = {}
+
+    with uproot.open(file_name) as file :
+        for tree_name, branches in tree_branches.items() :
+            if tree_name not in file :
+                continue
+            entry = event_index.GetEntry(run, subrun, event, tree_name)
+            records[tree_name] = file[tree_name].arrays(branches, entry_start=entry, entry_stop=entry + 1, library='ak')[0]
+
+    return records
+
+##############################################################################################
+##############################################################################################
+
+def PrintEvent(records) :
+
+    for tree_name, record in records.items() :
+        print(tree_name)
+        for branch in record.fields :
+            print(f'  {branch:<30} {ak.to_list(record[branch])}')
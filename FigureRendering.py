@@ -0,0 +1,223 @@
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import numpy as np
+import os
+import pickle
+import Profiling
+
+# Figures are plain dicts of histogram data, so they can be built while computing and
+# rendered later, in another process:
+#   {'renderer' : 'grid' | 'confusion' | 'map', 'file_name' : ..., 'nrows' : ..., 'ncols' : ..., 'figsize' : ..., 'panels' : [...]}
+
+manifest_name = 'render_manifest.json'
+
+##############################################################################################
+##############################################################################################
+
+def GetFigureHash(figure) :
+    return hashlib.sha1(pickle.dumps(figure, protocol=4)).hexdigest()
+
+##############################################################################################
+##############################################################################################
+
+def DrawGridPanel(ax, panel) :
+
+    for series in panel['series'] :
+        if series['type'] == 'errorbar' :
+            ax.errorbar(series['x'], series['y'], yerr=series['yerr'], **series['kwargs'])
+        elif series['type'] == 'hist' :
+            ax.hist(series['edges'][:-1], bins=series['edges'], weights=series['weights'], **series['kwargs'])
+
+    if panel.get('legend', True) and len(panel['series']) > 0 :
+        ax.legend()
+
+    ax.set_ylim(*panel.get('ylim', (0.0, 1.0)))
+    ax.set_xlabel(panel.get('xlabel', ''))
+    ax.set_ylabel(panel.get('ylabel', ''))
+    ax.set_title(panel.get('title', ''))
+    ax.tick_params(**panel.get('tick_params', {}))
+    ax.grid(True)
+
+##############################################################################################
+##############################################################################################
+
+def DrawConfusionPanel(fig, ax, panel) :
+
+    matrix = panel['matrix']
+
+    # Draw confusion
+    im = ax.imshow(matrix, cmap='Blues')
+
+    # Axis ticks
+    ax.set_xticks(range(len(panel['xticklabels'])))
+    ax.set_xticklabels(panel['xticklabels'])
+    ax.set_yticks(range(len(panel['yticklabels'])))
+    ax.set_yticklabels(panel['yticklabels'])
+
+    # Axis labels and title
+    ax.set_xlabel(panel['xlabel'])
+    ax.set_ylabel(panel['ylabel'])
+    ax.set_title(panel['title'])
+
+    # Colorbar
+    cbar = fig.colorbar(im, ax=ax)
+    cbar.set_label(panel['colorbar_label'])
+
+    # Add text inside cells, with the uncertainty below if there is one
+    for i in range(matrix.shape[0]):
+        for j in range(matrix.shape[1]):
+            text = matrix[i, j] if 'errors' not in panel else f'{matrix[i, j]}\n\u00B1 {panel["errors"][i, j]}'
+            ax.text(j, i, text, ha="center", va="center", color="black")
+
+##############################################################################################
+##############################################################################################
+
+def DrawMapPanel(fig, ax, panel) :
+
+    # matrix[i, j] is drawn at (x_edges[i], y_edges[j]), e.g. a value for every pair of thresholds
+    im = ax.pcolormesh(panel['x_edges'], panel['y_edges'], np.transpose(panel['matrix']), cmap=panel.get('cmap', 'viridis'),
+                       vmin=panel.get('vmin', 0.0), vmax=panel.get('vmax', 1.0), shading='flat', rasterized=True)
+
+    if len(panel.get('levels', [])) > 0 :
+        x_centers = 0.5 * (panel['x_edges'][1:] + panel['x_edges'][:-1])
+        y_centers = 0.5 * (panel['y_edges'][1:] + panel['y_edges'][:-1])
+        contours = ax.contour(x_centers, y_centers, np.transpose(panel['matrix']), levels=panel['levels'], colors='white', linewidths=1)
+        ax.clabel(contours, fmt='%.2f', fontsize=8)
+
+    ax.set_xlabel(panel.get('xlabel', ''))
+    ax.set_ylabel(panel.get('ylabel', ''))
+    ax.set_title(panel.get('title', ''))
+    ax.tick_params(**panel.get('tick_params', {}))
+
+    cbar = fig.colorbar(im, ax=ax)
+    cbar.set_label(panel.get('colorbar_label', ''))
+
+##############################################################################################
+##############################################################################################
+
+@Profiling.Profiled('figure')
+def RenderFigure(figure) :
+
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(nrows=figure['nrows'], ncols=figure['ncols'], figsize=figure['figsize'], squeeze=False)
+
+    for panel in figure['panels'] :
+        ax = axes[panel['row']][panel['col']]
+        if figure['renderer'] == 'confusion' :
+            DrawConfusionPanel(fig, ax, panel)
+        elif figure['renderer'] == 'map' :
+            DrawMapPanel(fig, ax, panel)
+        else :
+            DrawGridPanel(ax, panel)
+
+    # Lay out once, after every panel is drawn
+    fig.tight_layout(**figure.get('tight_layout', {}))
+
+    if 'subplots_adjust' in figure :
+        fig.subplots_adjust(**figure['subplots_adjust'])
+
+    with Profiling.Stage('figure:savefig', file_name=os.path.basename(figure['file_name'])) :
+        fig.savefig(figure['file_name'], bbox_inches='tight')
+
+    return fig
+
+##############################################################################################
+##############################################################################################
+
+def RenderFigureInWorker(figure, profile_settings=None) :
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    Profiling.StartWorker(profile_settings)
+    plt.close(RenderFigure(figure))
+
+    return figure['file_name'], Profiling.TakeEvents()
+
+##############################################################################################
+##############################################################################################
+
+def LoadManifest(output_dir) :
+
+    manifest_path = os.path.join(output_dir, manifest_name)
+
+    if not os.path.exists(manifest_path) :
+        return {}
+
+    with open(manifest_path) as f :
+        return json.load(f)
+
+##############################################################################################
+##############################################################################################
+
+def SaveManifest(output_dir, manifest) :
+
+    manifest_path = os.path.join(output_dir, manifest_name)
+
+    with open(f'{manifest_path}.tmp', 'w') as f :
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+##############################################################################################
+##############################################################################################
+
+def UseBatchBackend() :
+
+    # Batch runs draw straight to file, never to a window or a notebook
+    import matplotlib
+    matplotlib.use('Agg')
+
+##############################################################################################
+##############################################################################################
+
+def RenderFigures(figures, n_workers=1, skip_unchanged=False, keep_open=False) :
+
+    # keep_open : leave the figures drawn in this process open, so notebooks display them
+
+    # Only figures whose input data changed since the last run need drawing
+    to_render = []
+    figure_hashes = {}
+    manifests = {}
+
+    for figure in figures :
+        output_dir = os.path.dirname(figure['file_name']) or '.'
+        manifest = manifests.setdefault(output_dir, LoadManifest(output_dir))
+        figure_hash = GetFigureHash(figure)
+        figure_hashes[figure['file_name']] = figure_hash
+
+        if skip_unchanged and os.path.exists(figure['file_name']) and (manifest.get(os.path.basename(figure['file_name'])) == figure_hash) :
+            continue
+
+        to_render.append(figure)
+
+    # Figures can be drawn before any table is written to their directory, e.g. by the Draw* functions
+    for output_dir in {os.path.dirname(figure['file_name']) for figure in to_render} - {''} :
+        os.makedirs(output_dir, exist_ok=True)
+
+    if n_workers == 1 :
+        # In process, with whatever backend the caller is using
+        import matplotlib.pyplot as plt
+
+        for figure in to_render :
+            fig = RenderFigure(figure)
+            if not keep_open :
+                plt.close(fig)
+    elif len(to_render) > 0 :
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor :
+            for file_name, worker_events in executor.map(RenderFigureInWorker, to_render, itertools.repeat(Profiling.GetSettings())) :
+                Profiling.AddEvents(worker_events)
+
+    for figure in to_render :
+        output_dir = os.path.dirname(figure['file_name']) or '.'
+        manifests[output_dir][os.path.basename(figure['file_name'])] = figure_hashes[figure['file_name']]
+
+    for output_dir, manifest in manifests.items() :
+        if os.path.isdir(output_dir) :
+            SaveManifest(output_dir, manifest)
+
+    return [figure['file_name'] for figure in to_render]
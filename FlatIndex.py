@@ -0,0 +1,90 @@
+import awkward as ak
+import numpy as np
+import Kernels
+
+# Branches holding the event-local index of another particle in the same event, -1 if there isn't one
+index_branches = ['MC_ParentIndex', 'BM_ParentIndex', 'BM_MichelIndex']
+
+##############################################################################################
+##############################################################################################
+
+def GetEventOffsets(jagged) :
+    n_particles = ak.to_numpy(ak.num(jagged))
+    return np.cumsum(n_particles) - n_particles
+
+##############################################################################################
+##############################################################################################
+
+def ToFlatIndex(local_index, event_offsets) :
+
+    # Event-local index -> index into the flattened branches, -1 is kept as -1
+    if Kernels.UseKernels() :
+        return Kernels.ResolveLinks(local_index, event_offsets)
+
+    n_indices = ak.to_numpy(ak.num(local_index))
+    flat_local = ak.to_numpy(ak.flatten(local_index)).astype(np.int64)
+    index_offsets = np.repeat(event_offsets, n_indices)
+
+    return np.where(flat_local >= 0, index_offsets + flat_local, -1)
+
+##############################################################################################
+##############################################################################################
+
+def Take(flat_values, flat_index, fill=None) :
+
+    # Plain NumPy take on the contiguous buffer, -1 entries are dropped (or filled)
+    is_valid = flat_index >= 0
+
+    if fill is None :
+        return np.take(flat_values, flat_index[is_valid])
+
+    taken = np.full(len(flat_index), fill, dtype=flat_values.dtype)
+    taken[is_valid] = np.take(flat_values, flat_index[is_valid])
+
+    return taken
+
+##############################################################################################
+##############################################################################################
+
+class FlatBranches :
+    # One tree's particle branches, each flattened once, with the index branches as flat indices
+    def __init__(self, branches) :
+        self.branches = branches
+        self.arrays = {}
+        self.event_offsets = None
+
+    def __getitem__(self, branch) :
+        if branch not in self.arrays :
+            if branch in index_branches :
+                self.arrays[branch] = ToFlatIndex(self.branches[branch], self.GetEventOffsets(branch))
+            else :
+                self.arrays[branch] = ak.to_numpy(ak.flatten(self.branches[branch]))
+
+        return self.arrays[branch]
+
+    def GetEventOffsets(self, branch) :
+        # Every particle branch of a tree has the same number of entries per event
+        if self.event_offsets is None :
+            self.event_offsets = GetEventOffsets(self.branches[branch])
+        return self.event_offsets
+
+    def FlatIndex(self, local_index, branch) :
+        return ToFlatIndex(local_index, self.GetEventOffsets(branch))
+
+    def Take(self, branch, index, fill=None) :
+        # index is either event-local (jagged) or already flat
+        flat_index = index if isinstance(index, np.ndarray) else self.FlatIndex(index, branch)
+        return Take(self[branch], flat_index, fill)
+
+##############################################################################################
+##############################################################################################
+
+def GetFlatBranches(branches) :
+    # So that callers can flatten a file's branches once and pass them to every function
+    return branches if isinstance(branches, FlatBranches) else FlatBranches(branches)
+
+##############################################################################################
+##############################################################################################
+
+def GetJaggedBranches(branches) :
+    return branches.branches if isinstance(branches, FlatBranches) else branches
@@ -1,87 +1,423 @@
-import awkward as ak
 import numpy as np
-import matplotlib.pyplot as plt
+import os
+import Bootstrap
 import Definitions
+import FlatIndex
+import HistogramEngine
+import Kernels
+import MetricRecords
+import Profiling
+import ValidationFunc
 
-plot_dir = '/Users/isobel/Desktop/DUNE/2026/PandoraValidation/HierarchyValPlots/'
+# Relative to the working directory, batch runs pass their own (PandoraMetrics.py run --output)
+default_plot_dir = os.path.join('plots', 'hierarchy', '')
 
 ##############################################################################################
 ##############################################################################################
 
-def CreateHierarchyTableMetrics(int_masks, tier_masks, pdg_masks, hierarchy_branches, pfp_branches, demand_parent_has_match, split_by_pdg) :
+# Outcome of each reconstructed particle's parent-child link
+outcomes = [0, 1, 2, 3]
+
+outcome_strings = {
+    0 : "Correct Parent",
+    1 : "False Primary",
+    2 : "Wrong Parent",
+    3 : "Parent Not Best Match"
+}
+
+##############################################################################################
+##############################################################################################
+
+def ClassifyHierarchyOutcomes(hierarchy_branches, pfp_branches) :
+
+    # One pass over each event's buffers instead, when the kernels are on (see Kernels)
+    if Kernels.UseKernels() :
+        return Kernels.ClassifyHierarchyOutcomes(FlatIndex.GetJaggedBranches(hierarchy_branches), FlatIndex.GetJaggedBranches(pfp_branches))
+
+    # Flatten to NumPy once, parent indices index the flat arrays
+    hierarchy_flat = FlatIndex.GetFlatBranches(hierarchy_branches)
+    bm_tier      = hierarchy_flat['BM_HierarchyTier']
+    mc_tier      = hierarchy_flat['MC_HierarchyTier']
+    mc_parent    = hierarchy_flat['MC_ParentIndex']
+    bm_parent    = hierarchy_flat['BM_ParentIndex']
+    mc_has_match = FlatIndex.GetFlatBranches(pfp_branches)['MCP_HasMatch'] == 1
+    parent_has_match = FlatIndex.Take(mc_has_match, mc_parent, fill=False)
+
+    # True primaries are only asked whether they were reconstructed as primary
+    is_true_primary = (mc_tier == 1)
+    outcome = np.select([is_true_primary & (bm_tier == 1), is_true_primary,
+                         bm_tier == 1, bm_parent == -1, bm_parent == mc_parent],
+                        [0, 2, 1, 3, 0], default=2)
+
+    return outcome, mc_has_match, parent_has_match
+
+##############################################################################################
+##############################################################################################
+
+class HierarchyTableAccumulator :
+    def __init__(self, n_replicas=0, seed=Bootstrap.default_seed) :
+        self.tree_branches = {'PFPTree' : ['MCP_HasMatch'],
+                              'HierarchyTree' : ['MC_HierarchyTier', 'BM_HierarchyTier', 'MC_ParentIndex', 'BM_ParentIndex']}
+        # (int, pdg, tier, outcome, parent_has_match) for reconstructed particles, the last int/pdg/tier index is 'none of them'
+        self.counts = np.zeros((len(Definitions.ints) + 1, len(Definitions.pdgs) + 1, len(Definitions.tiers) + 1, len(outcomes), 2), dtype=np.int64)
+
+        # Bootstrap replicas of counts, (n_replicas, ...)
+        self.seed = seed
+        self.replicas = np.zeros((n_replicas,) + self.counts.shape, dtype=np.int64) if n_replicas > 0 else None
+
+        if n_replicas > 0 :
+            self.tree_branches['EventTree'] = list(Bootstrap.event_id_branches)
+
+    def Fill(self, chunk, int_masks, tier_masks, pdg_masks) :
+        codes = HistogramEngine.GetAxisCodes(int_masks, tier_masks, pdg_masks)
+        outcome, mc_has_match, parent_has_match = ClassifyHierarchyOutcomes(chunk['HierarchyTree'], chunk['PFPTree'])
+
+        key = np.ravel_multi_index((codes['int'][mc_has_match], codes['pdg'][mc_has_match], codes['tier'][mc_has_match],
+                                    outcome[mc_has_match], parent_has_match[mc_has_match].astype(np.int64)), self.counts.shape)
+        self.counts += np.bincount(key, minlength=self.counts.size).reshape(self.counts.shape)
+
+        if self.replicas is not None :
+            event_weights = Bootstrap.GetEventWeights(chunk['EventTree'], self.replicas.shape[0], self.seed)
+            entry_events = Bootstrap.GetEntryEvents(chunk['HierarchyTree']['MC_HierarchyTier'])
+            Bootstrap.FillReplicas(self.replicas, key, entry_events[mc_has_match], event_weights)
+
+    def Merge(self, other) :
+        self.counts += other.counts
+        if self.replicas is not None :
+            self.replicas += other.replicas
+        return self
+
+    def Subtract(self, other) :
+        self.counts -= other.counts
+        if self.replicas is not None :
+            self.replicas -= other.replicas
+        return self
+
+    def GetTableCounts(self, demand_parent_has_match, split_by_pdg) :
+
+        outcome_counts = GetOutcomeCounts(self.counts, demand_parent_has_match, split_by_pdg)
+        table_counts = {}
+
+        for int_index, int_type in enumerate(Definitions.ints) :
+            for pdg_index, pdg in enumerate(Definitions.pdgs if split_by_pdg else [-1]) :
+                for tier_index, tier in enumerate(Definitions.tiers) :
+                    # [n_correct_parent, n_false_primary, n_false_parent, n_not_best_match, n_total]
+                    table_counts[(int_type, pdg, tier)] = outcome_counts[int_index, pdg_index, tier_index]
+
+        return table_counts
+
+    def GetRecordCounts(self, counts) :
+
+        # (n_pass, n_total) of each record, in the order of GetRecords, for counts with any leading axes
+        n_pass, n_total = [], []
+
+        for demand_parent_has_match in [True, False] :
+            for split_by_pdg in [True, False] :
+                outcome_counts = GetOutcomeCounts(counts, demand_parent_has_match, split_by_pdg)
+                record_shape = outcome_counts.shape[:-4] + (-1,)
+                n_pass.append(outcome_counts[..., :-1].reshape(record_shape))
+                n_total.append(np.broadcast_to(outcome_counts[..., -1:], outcome_counts[..., :-1].shape).reshape(record_shape))
+
+        return np.concatenate(n_pass, axis=-1), np.concatenate(n_total, axis=-1)
+
+    def GetRecords(self, count_scales=None) :
+
+        records = []
+
+        for demand_parent_has_match in [True, False] :
+            for split_by_pdg in [True, False] :
+                for (int_type, pdg, tier), table_counts in self.GetTableCounts(demand_parent_has_match, split_by_pdg).items() :
+                    for outcome in outcomes :
+                        records.append(MetricRecords.MakeRecord('hierarchy', int_type, pdg, tier, outcome_strings[outcome], table_counts[outcome], table_counts[-1],
+                                                                GetHierarchyOption(demand_parent_has_match), count_scales=count_scales))
+
+        return records
+
+##############################################################################################
+##############################################################################################
+
+def GetOutcomeCounts(counts, demand_parent_has_match, split_by_pdg) :
+
+    # (..., int, pdg, tier, outcome then total) from HierarchyTableAccumulator counts with any leading axes (e.g. the replicas)
+    # If we're looking at the correctness of parent-child links,
+    # do we want to demand that the parent is reconstructed?
+    outcome_counts = counts.sum(axis=-1)
+
+    # (False primaries and true primaries don't depend on the parent)
+    if demand_parent_has_match :
+        linked = [outcome for outcome in outcomes if outcome != 1]
+        outcome_counts[..., 1:len(Definitions.tiers), linked] = counts[..., 1:len(Definitions.tiers), linked, 1]
+
+    outcome_counts = outcome_counts[..., :len(Definitions.ints), :, :len(Definitions.tiers), :]
+    outcome_counts = outcome_counts[..., :len(Definitions.pdgs), :, :] if split_by_pdg else outcome_counts.sum(axis=-3, keepdims=True)
+
+    return np.concatenate([outcome_counts, outcome_counts.sum(axis=-1, keepdims=True)], axis=-1)
+
+##############################################################################################
+##############################################################################################
+
+def GetHierarchyOption(demand_parent_has_match) :
+    return 'YesDemandParentRecod' if demand_parent_has_match else 'NotDemandParentRecod'
+
+##############################################################################################
+##############################################################################################
+
+def HierarchyMetricsFromRecords(records, int_type, pdg, tier, option) :
+
+    # The dict the text table printers take
+    fractions = {outcome : records[('hierarchy', int_type, pdg, tier, option, outcome_strings[outcome])]['fraction'] for outcome in outcomes}
+
+    hierarchy_metrics = {}
+    hierarchy_metrics['frac_correct_parent'] = round(fractions[0], 2)
+    hierarchy_metrics['frac_false_primary'] = round(fractions[1], 2)
+    hierarchy_metrics['frac_false_parent'] = round(fractions[2], 2)
+    hierarchy_metrics['frac_not_best_match'] = round(fractions[3], 2)
+    return hierarchy_metrics
+
+##############################################################################################
+##############################################################################################
+
+def CreateHierarchyTableMetrics(int_masks, tier_masks, pdg_masks, hierarchy_branches, pfp_branches, demand_parent_has_match, split_by_pdg, plot_dir=default_plot_dir) :
+
+    accumulator = HierarchyTableAccumulator()
+    accumulator.Fill({'HierarchyTree' : hierarchy_branches, 'PFPTree' : pfp_branches}, int_masks, tier_masks, pdg_masks)
+    WriteHierarchyTableMetrics(accumulator, demand_parent_has_match, split_by_pdg, plot_dir=plot_dir)
+
+##############################################################################################
+##############################################################################################
+
+def CreateAllHierarchyTableMetrics(int_masks, tier_masks, pdg_masks, hierarchy_branches, pfp_branches, count_scales=None, plot_dir=default_plot_dir) :
+
+    # One pass fills every DEMAND_PARENT_HAS_MATCH x SPLIT_BY_PDG table
+    accumulator = HierarchyTableAccumulator()
+    accumulator.Fill({'HierarchyTree' : hierarchy_branches, 'PFPTree' : pfp_branches}, int_masks, tier_masks, pdg_masks)
+
+    return WriteAllHierarchyTableMetrics(accumulator, count_scales, plot_dir)
+
+##############################################################################################
+##############################################################################################
+
+@Profiling.Profiled('table:hierarchy')
+def WriteAllHierarchyTableMetrics(accumulator, count_scales=None, plot_dir=default_plot_dir) :
+
+    records = Bootstrap.AddBootstrapUncertainties(accumulator.GetRecords(count_scales), accumulator, accumulator.GetRecordCounts)
+
+    for demand_parent_has_match in [True, False] :
+        for split_by_pdg in [True, False] :
+            WriteHierarchyTableMetrics(accumulator, demand_parent_has_match, split_by_pdg, records, plot_dir)
+
+    MetricRecords.WriteRecords(records, f'{plot_dir}HierarchyMetrics')
+
+    return records
+
+##############################################################################################
+##############################################################################################
+
+def WriteHierarchyTableMetrics(accumulator, demand_parent_has_match, split_by_pdg, records=None, plot_dir=default_plot_dir) :
+
+    # The text tables are rendered from the same records that are written out
+    records = MetricRecords.IndexRecords(accumulator.GetRecords() if records is None else records)
+    option = GetHierarchyOption(demand_parent_has_match)
+    os.makedirs(plot_dir, exist_ok=True)
 
-    # Cache awkward arrays locally
-    mc_tier      = hierarchy_branches['MC_HierarchyTier']
-    bm_tier      = hierarchy_branches['BM_HierarchyTier']
-    mc_parent    = hierarchy_branches['MC_ParentIndex']
-    bm_parent    = hierarchy_branches['BM_ParentIndex']
-    mc_has_match = pfp_branches['MCP_HasMatch']
-    
     for int_type in Definitions.ints :
-    
-        file_name = f'HierarchyMetricTables_{Definitions.ints[int_type]}' + ('_PDG' if split_by_pdg else '') + ('_YesDemandParentRecod' if demand_parent_has_match else 'NotDemandParentRecod')
-        
+
+        file_name = f'HierarchyMetricTables_{int_type}' + ('_PDG' if split_by_pdg else '') + ('_YesDemandParentRecod' if demand_parent_has_match else 'NotDemandParentRecod')
+
         with open(f'{plot_dir}{file_name}.txt', "w") as f:
-        
+
             print("DEMAND_PARENT_HAS_MATCH =", demand_parent_has_match, file=f)
             print("SPLIT_BY_PDG =", split_by_pdg, file=f)
             print("", file=f)
-        
+
             # PDG
             pdgs = Definitions.pdgs if split_by_pdg else [-1]
-        
+
             for pdg in pdgs :
-        
-                pdg_mask = pdg_masks[pdg] if split_by_pdg else ak.ones_like(int_masks[int_type])
+
                 pdg_string = Definitions.pdg_strings[pdg] if split_by_pdg else 'All PDG'
-            
+
                 print(f'{Definitions.int_strings[int_type]} - {pdg_string}', file=f)
                 print('------------------------------------------------------------------------------------', file=f)
                 print('           | Correct Parent | False Primary | Wrong Parent | Parent Not Best Match |', file=f)
-                print('------------------------------------------------------------------------------------', file=f)    
-            
-                for tier in Definitions.tiers :
-                    target_mask = (mc_has_match == 1) & tier_masks[tier] & int_masks[int_type] & pdg_mask
-                    primary_reco_mask = target_mask & (bm_tier == 1)
-                    other_reco_mask = target_mask & (bm_tier != 1)
-                
-                    # If we're looking at the correctness of parent-child links,
-                    # do we want to demand that the parent is reconstructed?
-                    if ((tier != 0) & demand_parent_has_match) :
-                        other_reco_mask = other_reco_mask & (mc_has_match[mc_parent] == 1)
-                        
-                    n_other = ak.sum(other_reco_mask) + ak.sum(primary_reco_mask)
-                
-                    # Correct non-nu parent-child links?
-                    bm_tier_o   = bm_tier[other_reco_mask]
-                    bm_parent_o = bm_parent[other_reco_mask]
-                    mc_parent_o = mc_parent[other_reco_mask]
-                
-                    if (tier == 0) :
-                        n_not_best_match = 0.0
-                        n_false_primary  = 0.0
-                        n_correct_parent = ak.sum(primary_reco_mask)
-                        n_false_parent = ak.sum(other_reco_mask)
-                    else :
-                        n_not_best_match = ak.sum(bm_parent_o == -1)
-                        n_false_primary  = ak.sum(primary_reco_mask)
-                        n_correct_parent = ak.sum(bm_parent_o == mc_parent_o)
-                        n_false_parent = ak.sum((bm_parent_o != -1) & (bm_parent_o != mc_parent_o))
-                
-                    frac_not_best_match = round(0.0 if n_other == 0 else float(n_not_best_match) / float(n_other), 2)
-                    frac_false_primary = round(0.0 if n_other == 0 else float(n_false_primary) / float(n_other), 2)
-                    frac_correct_parent = round(0.0 if n_other == 0 else float(n_correct_parent) / float(n_other), 2)
-                    frac_false_parent = round(0.0 if n_other == 0 else float(n_false_parent) / float(n_other), 2)
-                
-                    print(' ' + str(Definitions.tier_strings[tier]) + str(' '* (10 - len(str(Definitions.tier_strings[tier])))) +
-                                                            '|' + str(frac_correct_parent) + str(' '* (16 - len(str(frac_correct_parent)))) + \
-                                                            '|' + str(frac_false_primary) + str(' '* (15 - len(str(frac_false_primary)))) + \
-                                                            '|' + str(frac_false_parent) + str(' '* (14 - len(str(frac_false_parent)))) + \
-                                                            '|' + str(frac_not_best_match) + str(' '* (23 - len(str(frac_not_best_match)))) + \
-                                                            '|', file=f)
-                    
                 print('------------------------------------------------------------------------------------', file=f)
-                print('', file=f)
 
+                for tier in Definitions.tiers :
+                    ValidationFunc.PrintHierarchyTableEntry(tier, HierarchyMetricsFromRecords(records, int_type, pdg, tier, option), f)
+
+                ValidationFunc.PrintHierarchyTableFooter(f)
+
+##############################################################################################
+##############################################################################################
+
+def ChainAll(particle_ok, parent) :
+
+    # Pointer jumping on the flat parent indices: after k steps chain_ok covers 2^k generations
+    # and ancestor points 2^k generations up, so no padding to the largest event is needed
+    chain_ok = particle_ok.copy()
+    ancestor = parent.copy()
+    active = np.flatnonzero(ancestor >= 0)
+
+    for i_jump in range(64) :
+        if len(active) == 0 :
+            return chain_ok
+
+        chain_ok[active] &= chain_ok[ancestor[active]]
+        ancestor[active] = ancestor[ancestor[active]]
+        active = active[ancestor[active] >= 0]
+
+    raise ValueError('MC_ParentIndex contains a cycle')
+
+##############################################################################################
+##############################################################################################
+
+def ClassifyChainReconstruction(hierarchy_branches, pfp_branches) :
+
+    hierarchy_flat = FlatIndex.GetFlatBranches(hierarchy_branches)
+    outcome, mc_has_match, _ = ClassifyHierarchyOutcomes(hierarchy_flat, pfp_branches)
+    mc_parent = hierarchy_flat['MC_ParentIndex']
+
+    # Was the particle, and every ancestor up to the neutrino, reconstructed (and correctly parented)?
+    chain_has_match = ChainAll(mc_has_match, mc_parent)
+    chain_correct_parent = ChainAll(mc_has_match & (outcome == 0), mc_parent)
+
+    # 0 : chain broken, 1 : chain reconstructed, 2 : chain reconstructed and correctly parented
+    return chain_has_match.astype(np.int64) + chain_correct_parent.astype(np.int64)
+
+##############################################################################################
+##############################################################################################
+
+class ChainEfficiencyAccumulator :
+    def __init__(self, n_replicas=0, seed=Bootstrap.default_seed) :
+        self.tree_branches = {'PFPTree' : ['MCP_HasMatch'],
+                              'HierarchyTree' : ['MC_HierarchyTier', 'BM_HierarchyTier', 'MC_ParentIndex', 'BM_ParentIndex']}
+        # (int, pdg, tier, chain level) for all true particles, the last int/pdg/tier index is 'none of them'
+        self.counts = np.zeros((len(Definitions.ints) + 1, len(Definitions.pdgs) + 1, len(Definitions.tiers) + 1, 3), dtype=np.int64)
+
+        # Bootstrap replicas of counts, (n_replicas, ...)
+        self.seed = seed
+        self.replicas = np.zeros((n_replicas,) + self.counts.shape, dtype=np.int64) if n_replicas > 0 else None
+
+        if n_replicas > 0 :
+            self.tree_branches['EventTree'] = list(Bootstrap.event_id_branches)
+
+    def Fill(self, chunk, int_masks, tier_masks, pdg_masks) :
+        codes = HistogramEngine.GetAxisCodes(int_masks, tier_masks, pdg_masks)
+        chain_level = ClassifyChainReconstruction(chunk['HierarchyTree'], chunk['PFPTree'])
+
+        key = np.ravel_multi_index((codes['int'], codes['pdg'], codes['tier'], chain_level), self.counts.shape)
+        self.counts += np.bincount(key, minlength=self.counts.size).reshape(self.counts.shape)
+
+        if self.replicas is not None :
+            event_weights = Bootstrap.GetEventWeights(chunk['EventTree'], self.replicas.shape[0], self.seed)
+            Bootstrap.FillReplicas(self.replicas, key, Bootstrap.GetEntryEvents(chunk['HierarchyTree']['MC_HierarchyTier']), event_weights)
+
+    def Merge(self, other) :
+        self.counts += other.counts
+        if self.replicas is not None :
+            self.replicas += other.replicas
+        return self
+
+    def Subtract(self, other) :
+        self.counts -= other.counts
+        if self.replicas is not None :
+            self.replicas -= other.replicas
+        return self
+
+    def GetRecords(self, count_scales=None) :
+
+        records = []
+
+        for demand_correct_parent in [True, False] :
+            for split_by_pdg in [True, False] :
+                for (int_type, pdg, tier), efficiency_metrics in self.GetEfficiencyMetrics(demand_correct_parent, split_by_pdg).items() :
+                    records += MetricRecords.RecordsFromEfficiencyMetrics('chain_efficiency', int_type, pdg, tier, efficiency_metrics, GetChainOption(demand_correct_parent),
+                                                                         count_scales)
+
+        return records
+
+    def GetEfficiencyMetrics(self, demand_correct_parent, split_by_pdg) :
+
+        n_reco, n_targets = GetChainCounts(self.counts, demand_correct_parent, split_by_pdg)
+        efficiency_metrics = {}
+
+        for int_index, int_type in enumerate(Definitions.ints) :
+            for pdg_index, pdg in enumerate(Definitions.pdgs if split_by_pdg else [-1]) :
+                for tier_index, tier in enumerate(Definitions.tiers) :
+                    efficiency_metrics[(int_type, pdg, tier)] = ValidationFunc.EfficiencyMetricsFromCounts(int(n_targets[int_index, pdg_index, tier_index]),
+                                                                                                           int(n_reco[int_index, pdg_index, tier_index]))
+
+        return efficiency_metrics
+
+    def GetRecordCounts(self, counts) :
+
+        # (n_pass, n_total) of each record, in the order of GetRecords, for counts with any leading axes
+        chain_counts = [GetChainCounts(counts, demand_correct_parent, split_by_pdg) for demand_correct_parent in [True, False] for split_by_pdg in [True, False]]
+
+        return [np.concatenate([level_counts[index].reshape(level_counts[index].shape[:-3] + (-1,)) for level_counts in chain_counts], axis=-1) for index in range(2)]
+
+##############################################################################################
+##############################################################################################
+
+def GetChainCounts(counts, demand_correct_parent, split_by_pdg) :
+
+    # (n_reco, n_targets), each (..., int, pdg, tier), from ChainEfficiencyAccumulator counts with any leading axes (e.g. the replicas)
+    counts = counts[..., :len(Definitions.ints), :, :len(Definitions.tiers), :]
+    counts = counts[..., :len(Definitions.pdgs), :, :] if split_by_pdg else counts.sum(axis=-3, keepdims=True)
+
+    return counts[..., 2 if demand_correct_parent else 1:].sum(axis=-1), counts.sum(axis=-1)
+
+##############################################################################################
+##############################################################################################
+
+def GetChainOption(demand_correct_parent) :
+    return 'YesDemandCorrectParent' if demand_correct_parent else 'NotDemandCorrectParent'
+
+##############################################################################################
+##############################################################################################
+
+def CalculateChainEfficiency(int_masks, tier_masks, pdg_masks, hierarchy_branches, pfp_branches, count_scales=None, plot_dir=default_plot_dir) :
+
+    accumulator = ChainEfficiencyAccumulator()
+    accumulator.Fill({'HierarchyTree' : hierarchy_branches, 'PFPTree' : pfp_branches}, int_masks, tier_masks, pdg_masks)
+    WriteChainEfficiencyTables(accumulator, count_scales, plot_dir)
+
+    return accumulator
+
+##############################################################################################
+##############################################################################################
+
+@Profiling.Profiled('table:chain')
+def WriteChainEfficiencyTables(accumulator, count_scales=None, plot_dir=default_plot_dir) :
+
+    records = Bootstrap.AddBootstrapUncertainties(accumulator.GetRecords(count_scales), accumulator, accumulator.GetRecordCounts)
+    indexed_records = MetricRecords.IndexRecords(records)
+    os.makedirs(plot_dir, exist_ok=True)
+
+    for demand_correct_parent in [True, False] :
+
+        file_name = 'ChainEfficiencyTables_' + GetChainOption(demand_correct_parent)
+
+        with open(f'{plot_dir}{file_name}.txt', "w") as f :
+
+            print("DEMAND_CORRECT_PARENT =", demand_correct_parent, file=f)
+            print("", file=f)
+
+            for int_type in Definitions.ints :
+                for pdg in Definitions.pdgs + [-1] :
+
+                    pdg_string = 'All PDG' if pdg == -1 else Definitions.pdg_strings[pdg]
+                    ValidationFunc.PrintEfficiencyTableHeader(int_type, f, pdg_string)
+
+                    for tier in Definitions.tiers :
+                        record = indexed_records[('chain_efficiency', int_type, pdg, tier, GetChainOption(demand_correct_parent), 'Reco')]
+                        ValidationFunc.PrintEfficiencyTableEntry(tier, MetricRecords.EfficiencyMetricsFromRecord(record), f)
+
+                    ValidationFunc.PrintEfficiencyTableFooter(f)
+
+    MetricRecords.WriteRecords(records, f'{plot_dir}ChainEfficiencyMetrics')
+
+    return records
+
+##############################################################################################
 ##############################################################################################
-##############################################################################################
\ No newline at end of file
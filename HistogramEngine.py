@@ -0,0 +1,254 @@
+import awkward as ak
+import numpy as np
+import Bootstrap
+import Definitions
+import Profiling
+
+# Reco classification of the best match: not reconstructed, track, shower, neither
+reco_classes = [0, 1, 2, 3]
+
+reco_class_strings = {
+    0 : "NotReco",
+    1 : "Track",
+    2 : "Shower",
+    3 : "Other"
+}
+
+##############################################################################################
+##############################################################################################
+
+class CategoryHist :
+    # counts has shape (int, pdg, tier, has_match, reco_class[, underflow + bins + overflow])
+    # The last index of the int/pdg/tier axes holds PFPs that are in none of the categories
+    # With n_replicas, replicas holds the bootstrap replicas of counts, (n_replicas, ...), where binned
+    # histograms aren't split by reco class (it's only needed for the confusion matrix), to keep them small
+    def __init__(self, edges=None, n_replicas=0) :
+        self.edges = edges
+        shape = (len(Definitions.ints) + 1, len(Definitions.pdgs) + 1, len(Definitions.tiers) + 1, 2, len(reco_classes))
+        replica_shape = shape if edges is None else shape[:-1] + (1, len(edges) + 1)
+        if edges is not None :
+            shape = shape + (len(edges) + 1,)
+        self.counts = np.zeros(shape, dtype=np.int64)
+        self.replicas = np.zeros((n_replicas,) + replica_shape, dtype=np.int64) if n_replicas > 0 else None
+
+    def GetIndices(self, int_type, pdg, tier, has_match, reco_class) :
+        return (slice(None) if int_type is None else Definitions.ints.index(int_type),
+                slice(None) if pdg is None else Definitions.pdgs.index(pdg),
+                slice(None) if tier is None else Definitions.tiers.index(tier),
+                slice(None) if has_match is None else has_match,
+                slice(None) if reco_class is None else reco_class)
+
+    def Project(self, int_type=None, pdg=None, tier=None, has_match=None, reco_class=None) :
+        projected = self.counts[self.GetIndices(int_type, pdg, tier, has_match, reco_class)]
+
+        # Sum over the category axes that weren't fixed, but not over the final entries
+        n_category_axes = projected.ndim - (0 if self.edges is None else 1)
+        return projected.sum(axis=tuple(range(n_category_axes))) if n_category_axes > 0 else projected
+
+    def ProjectReplicas(self, int_type=None, pdg=None, tier=None, has_match=None, reco_class=None) :
+        # As Project, with the replicas along the first axis
+        projected = self.replicas[(slice(None),) + self.GetIndices(int_type, pdg, tier, has_match, reco_class)]
+        n_category_axes = projected.ndim - 1 - (0 if self.edges is None else 1)
+        return projected.sum(axis=tuple(range(1, n_category_axes + 1))) if n_category_axes > 0 else projected
+
+    def SliceReplicas(self, int_type=None, pdg=None, tier=None, has_match=None) :
+        return self.ProjectReplicas(int_type, pdg, tier, has_match)[:, 1:-1]
+
+    def Slice(self, int_type=None, pdg=None, tier=None, has_match=None, reco_class=None) :
+        return self.Project(int_type, pdg, tier, has_match, reco_class)[1:-1]
+
+    def NEntries(self, int_type=None, pdg=None, tier=None, has_match=None, reco_class=None) :
+        projected = self.Project(int_type, pdg, tier, has_match, reco_class)
+        return projected if self.edges is None else projected.sum()
+
+    def Merge(self, other) :
+        self.counts += other.counts
+        if self.replicas is not None :
+            self.replicas += other.replicas
+        return self
+
+    def Subtract(self, other) :
+        self.counts -= other.counts
+        if self.replicas is not None :
+            self.replicas -= other.replicas
+        return self
+
+##############################################################################################
+##############################################################################################
+
+def GetVarKey(plot_var) :
+    if hasattr(plot_var, 'true_tree_name') :
+        return f'{plot_var.true_tree_name}-{plot_var.reco_tree_name}'
+
+    return plot_var.tree_name
+
+##############################################################################################
+##############################################################################################
+
+def GetVarBranches(plot_var) :
+    return plot_var.branches
+
+##############################################################################################
+##############################################################################################
+
+def GetVarValues(pfp_branches, plot_var) :
+    if hasattr(plot_var, 'true_tree_name') :
+        values = pfp_branches[plot_var.true_tree_name] - pfp_branches[plot_var.reco_tree_name]
+    else :
+        values = pfp_branches[plot_var.tree_name]
+
+    return ak.to_numpy(ak.flatten(values))
+
+##############################################################################################
+##############################################################################################
+
+def GetBinIndices(values, edges) :
+    # Same edge convention as np.histogram (last bin closed), 0 = underflow, len(edges) = overflow (inc. NaN)
+    n_bins = len(edges) - 1
+    bin_indices = np.searchsorted(edges, values, side='right')
+    bin_indices[values == edges[-1]] = n_bins
+
+    return bin_indices
+
+##############################################################################################
+##############################################################################################
+
+def GetAxisCodes(int_masks, tier_masks, pdg_masks) :
+
+    codes = {}
+
+    for axis, categories, masks in [('int', Definitions.ints, int_masks), ('pdg', Definitions.pdgs, pdg_masks), ('tier', Definitions.tiers, tier_masks)] :
+        # Masks from Definitions carry their codes, so only hand-made mask dicts need a pass per category
+        if isinstance(masks, Definitions.CategoryMasks) :
+            codes[axis] = masks.codes
+            continue
+
+        flat_masks = [ak.to_numpy(ak.flatten(masks[category])) for category in categories]
+        axis_codes = np.full(len(flat_masks[0]), len(categories), dtype=Definitions.GetCodeDtype(len(categories)))
+        for index, flat_mask in enumerate(flat_masks) :
+            axis_codes[flat_mask] = index
+        codes[axis] = axis_codes
+
+    return codes
+
+##############################################################################################
+##############################################################################################
+
+def GetCategoryCodes(int_masks, tier_masks, pdg_masks, pfp_branches, fill_reco_class=True) :
+
+    mc_has_match = ak.to_numpy(ak.flatten(pfp_branches['MCP_HasMatch']))
+
+    codes = GetAxisCodes(int_masks, tier_masks, pdg_masks)
+    codes['has_match'] = (mc_has_match == 1).astype(np.int8)
+
+    # Without the track/shower branches everything lands in reco class 0
+    if fill_reco_class :
+        bm_is_track = ak.to_numpy(ak.flatten(pfp_branches['BM_IsTrack']))
+        bm_is_shower = ak.to_numpy(ak.flatten(pfp_branches['BM_IsShower']))
+        codes['reco_class'] = np.select([bm_is_track == -1, bm_is_track == 1, bm_is_shower == 1], [0, 1, 2], default=3).astype(np.int8)
+    else :
+        codes['reco_class'] = np.zeros(len(mc_has_match), dtype=np.int8)
+
+    return codes
+
+##############################################################################################
+##############################################################################################
+
+def GetCategoryIndex(codes) :
+    category_index = codes['int'].astype(np.int64)
+    category_index = category_index * (len(Definitions.pdgs) + 1) + codes['pdg']
+    category_index = category_index * (len(Definitions.tiers) + 1) + codes['tier']
+    category_index = category_index * 2 + codes['has_match']
+    category_index = category_index * len(reco_classes) + codes['reco_class']
+
+    return category_index
+
+##############################################################################################
+##############################################################################################
+
+class FillEngine :
+    # n_replicas > 0 also fills that many event-level bootstrap replicas (see Bootstrap)
+    def __init__(self, plot_vars=(), fill_reco_class=True, n_replicas=0, seed=Bootstrap.default_seed) :
+        self.plot_vars = {GetVarKey(plot_var) : plot_var for plot_var in plot_vars}
+        self.fill_reco_class = fill_reco_class
+        self.n_replicas = n_replicas
+        self.seed = seed
+        self.hists = {var_key : CategoryHist(np.histogram_bin_edges(np.array([]), bins=plot_var.n_bins, range=plot_var.range), n_replicas) \
+                      for var_key, plot_var in self.plot_vars.items()}
+        self.category_counts = CategoryHist(n_replicas=n_replicas)
+
+        var_branches = [branch for plot_var in self.plot_vars.values() for branch in GetVarBranches(plot_var)]
+        reco_class_branches = ['BM_IsTrack', 'BM_IsShower'] if fill_reco_class else []
+        self.tree_branches = {'PFPTree' : ['MCP_HasMatch'] + reco_class_branches + var_branches}
+
+        if n_replicas > 0 :
+            self.tree_branches['EventTree'] = list(Bootstrap.event_id_branches)
+
+    def Fill(self, chunk, int_masks, tier_masks, pdg_masks) :
+        pfp_branches = chunk['PFPTree']
+
+        with Profiling.Stage('fill:categories') :
+            codes = GetCategoryCodes(int_masks, tier_masks, pdg_masks, pfp_branches, self.fill_reco_class)
+
+        var_values = {}
+
+        for var_key, plot_var in self.plot_vars.items() :
+            with Profiling.Stage(f'fill:{var_key}') :
+                var_values[var_key] = GetVarValues(pfp_branches, plot_var)
+
+        with Profiling.Stage('fill:bincount') :
+            self.FillCodes(codes, var_values)
+
+        if self.n_replicas > 0 :
+            with Profiling.Stage('fill:bootstrap') :
+                event_weights = Bootstrap.GetEventWeights(chunk['EventTree'], self.n_replicas, self.seed)
+                self.FillReplicas(codes, var_values, Bootstrap.GetEntryEvents(pfp_branches['MCP_HasMatch']), event_weights)
+
+    def FillCodes(self, codes, var_values) :
+        category_index = GetCategoryIndex(codes)
+        n_categories = self.category_counts.counts.size
+
+        # Give every histogram its own block of one global index space, then fill them all at once
+        global_indices = [category_index]
+        offset = n_categories
+
+        for var_key in self.plot_vars :
+            hist = self.hists[var_key]
+            n_slots = len(hist.edges) + 1
+            bin_indices = GetBinIndices(var_values[var_key], hist.edges)
+            global_indices.append(offset + category_index * n_slots + bin_indices)
+            offset += hist.counts.size
+
+        filled = np.bincount(np.concatenate(global_indices), minlength=offset)
+
+        self.category_counts.counts += filled[:n_categories].reshape(self.category_counts.counts.shape)
+        offset = n_categories
+
+        for var_key in self.plot_vars :
+            hist = self.hists[var_key]
+            hist.counts += filled[offset:offset + hist.counts.size].reshape(hist.counts.shape)
+            offset += hist.counts.size
+
+    def FillReplicas(self, codes, var_values, entry_events, event_weights) :
+        category_index = GetCategoryIndex(codes)
+        Bootstrap.FillReplicas(self.category_counts.replicas, category_index, entry_events, event_weights)
+
+        # Binned replicas have no reco class axis
+        category_index = category_index // len(reco_classes)
+
+        for var_key in self.plot_vars :
+            hist = self.hists[var_key]
+            bin_indices = GetBinIndices(var_values[var_key], hist.edges)
+            Bootstrap.FillReplicas(hist.replicas, category_index * (len(hist.edges) + 1) + bin_indices, entry_events, event_weights)
+
+    def Merge(self, other) :
+        self.category_counts.Merge(other.category_counts)
+        for var_key, hist in self.hists.items() :
+            hist.Merge(other.hists[var_key])
+        return self
+
+    def Subtract(self, other) :
+        self.category_counts.Subtract(other.category_counts)
+        for var_key, hist in self.hists.items() :
+            hist.Subtract(other.hists[var_key])
+        return self
@@ -0,0 +1,228 @@
+import awkward as ak
+import importlib.util
+import numpy as np
+import os
+import sys
+
+# Per-event loops for the particle -> particle lookups (hierarchy outcomes, Michel links), walking the flat
+# buffers of each event once and writing straight into their outputs, with no intermediate arrays.
+# Which implementation is used:
+#   'numba'   the loops below, compiled (the default when Numba is installed)
+#   'numpy'   the vectorised NumPy paths in FlatIndex, HierarchyValidationFunc and ValidationFunc (the default otherwise)
+#   'python'  the loops, interpreted, only to check them as they are slow
+# PANDORA_METRICS_KERNELS overrides the default, e.g. for the worker processes
+# Both give identical results, `python Kernels.py <files>` checks it on real files, `python -m pytest test_Kernels.py` on synthetic ones
+
+backends = ['numba', 'numpy', 'python']
+
+##############################################################################################
+##############################################################################################
+
+def HasNumba() :
+    return importlib.util.find_spec('numba') is not None
+
+backend = os.environ.get('PANDORA_METRICS_KERNELS') or ('numba' if HasNumba() else 'numpy')
+
+compiled_kernels = {}
+
+##############################################################################################
+##############################################################################################
+
+def UseKernels() :
+    return backend != 'numpy'
+
+##############################################################################################
+##############################################################################################
+
+def GetKernel(loop) :
+
+    if backend != 'numba' :
+        return loop
+
+    # Compiled on first use, and kept on disk by Numba between runs
+    if loop not in compiled_kernels :
+        import numba
+        compiled_kernels[loop] = numba.njit(nogil=True, cache=True)(loop)
+
+    return compiled_kernels[loop]
+
+##############################################################################################
+##############################################################################################
+
+def GetBuffers(jagged) :
+
+    # Content and (n_events + 1) offsets of a jagged array, straight from its layout when it is already packed
+    layout = ak.to_layout(jagged)
+
+    if isinstance(layout, ak.contents.ListOffsetArray) and isinstance(layout.content, ak.contents.NumpyArray) :
+        offsets = np.asarray(layout.offsets.data)
+        content = np.asarray(layout.content.data)[offsets[0]:offsets[-1]]
+        return content, offsets if offsets[0] == 0 else offsets - offsets[0]
+
+    n_entries = ak.to_numpy(ak.num(jagged))
+    offsets = np.zeros(len(n_entries) + 1, dtype=np.int64)
+    np.cumsum(n_entries, out=offsets[1:])
+
+    return ak.to_numpy(ak.flatten(jagged)), offsets
+
+##############################################################################################
+##############################################################################################
+
+def ResolveLinksLoop(link_offsets, link_index, event_offsets, flat_index) :
+
+    for i_event in range(len(link_offsets) - 1) :
+        for i_link in range(link_offsets[i_event], link_offsets[i_event + 1]) :
+            flat_index[i_link] = event_offsets[i_event] + link_index[i_link] if link_index[i_link] >= 0 else -1
+
+##############################################################################################
+##############################################################################################
+
+def ClassifyHierarchyLoop(offsets, mc_tier, bm_tier, mc_parent, bm_parent, mc_has_match, outcome, parent_has_match) :
+
+    # Parent indices are event-local, outcome as HierarchyValidationFunc.outcomes
+    for i_event in range(len(offsets) - 1) :
+        start = offsets[i_event]
+        for i_particle in range(start, offsets[i_event + 1]) :
+            parent_has_match[i_particle] = (mc_parent[i_particle] >= 0) and (mc_has_match[start + mc_parent[i_particle]] == 1)
+
+            # True primaries are only asked whether they were reconstructed as primary
+            if mc_tier[i_particle] == 1 :
+                outcome[i_particle] = 0 if bm_tier[i_particle] == 1 else 2
+            elif bm_tier[i_particle] == 1 :
+                outcome[i_particle] = 1
+            elif bm_parent[i_particle] == -1 :
+                outcome[i_particle] = 3
+            elif bm_parent[i_particle] == mc_parent[i_particle] :
+                outcome[i_particle] = 0
+            else :
+                outcome[i_particle] = 2
+
+##############################################################################################
+##############################################################################################
+
+def CountLinkOutcomesLoop(link_offsets, link_index, link_category, event_offsets, bm_tier, bm_parent, mc_parent, counts) :
+
+    # counts : (n_categories, 5), the links followed then the non-exclusive outcomes of
+    # ValidationFunc.CalculateHierarchyMetrics (correct parent, false primary, false parent, not best match)
+    for i_event in range(len(link_offsets) - 1) :
+        for i_link in range(link_offsets[i_event], link_offsets[i_event + 1]) :
+            category = link_category[i_link]
+            if (link_index[i_link] < 0) or (category < 0) :
+                continue
+
+            child = event_offsets[i_event] + link_index[i_link]
+            counts[category, 0] += 1
+
+            if bm_tier[child] == 1 :
+                counts[category, 2] += 1
+                continue
+
+            if bm_parent[child] == mc_parent[child] :
+                counts[category, 1] += 1
+
+            if bm_parent[child] == -1 :
+                counts[category, 4] += 1
+            elif bm_parent[child] != mc_parent[child] :
+                counts[category, 3] += 1
+
+##############################################################################################
+##############################################################################################
+
+def ResolveLinks(local_index, event_offsets) :
+
+    # As FlatIndex.ToFlatIndex
+    link_index, link_offsets = GetBuffers(local_index)
+    flat_index = np.empty(len(link_index), dtype=np.int64)
+    GetKernel(ResolveLinksLoop)(link_offsets, link_index, np.asarray(event_offsets, dtype=np.int64), flat_index)
+
+    return flat_index
+
+##############################################################################################
+##############################################################################################
+
+def ClassifyHierarchyOutcomes(hierarchy_branches, pfp_branches) :
+
+    # As HierarchyValidationFunc.ClassifyHierarchyOutcomes, which hands over to this
+    mc_tier, offsets = GetBuffers(hierarchy_branches['MC_HierarchyTier'])
+    bm_tier = GetBuffers(hierarchy_branches['BM_HierarchyTier'])[0]
+    mc_parent = GetBuffers(hierarchy_branches['MC_ParentIndex'])[0]
+    bm_parent = GetBuffers(hierarchy_branches['BM_ParentIndex'])[0]
+    mc_has_match = GetBuffers(pfp_branches['MCP_HasMatch'])[0]
+
+    outcome = np.empty(len(mc_tier), dtype=np.int8)
+    parent_has_match = np.empty(len(mc_tier), dtype=bool)
+    GetKernel(ClassifyHierarchyLoop)(offsets, mc_tier, bm_tier, mc_parent, bm_parent, mc_has_match, outcome, parent_has_match)
+
+    return outcome, mc_has_match == 1, parent_has_match
+
+##############################################################################################
+##############################################################################################
+
+def CountLinkOutcomes(local_index, event_offsets, bm_tier, bm_parent, mc_parent, link_category=None, n_categories=1) :
+
+    # local_index : jagged event-local indices into the (flat) hierarchy arrays, link_category : category of each link, -1 to skip it
+    link_index, link_offsets = GetBuffers(local_index)
+    link_category = np.zeros(len(link_index), dtype=np.int64) if link_category is None else link_category
+    counts = np.zeros((n_categories, 5), dtype=np.int64)
+    GetKernel(CountLinkOutcomesLoop)(link_offsets, link_index, link_category, np.asarray(event_offsets, dtype=np.int64), bm_tier, bm_parent, mc_parent, counts)
+
+    return counts
+
+##############################################################################################
+##############################################################################################
+
+def CheckKernels(file_names, kernel_backend=None) :
+
+    # The loops (kernel_backend, by default compiled if Numba is installed) against the NumPy paths, on every event of the files
+    global backend
+
+    import uproot
+    import Definitions
+    import FlatIndex
+    import HierarchyValidationFunc
+    import StreamingLoader
+    import TrackValidationFunc
+    import ValidationFunc
+
+    engine = TrackValidationFunc.TrackChildEngine()
+    tree_branches = StreamingLoader.MergeTreeBranches(Definitions.mask_tree_branches, engine.tree_branches,
+                                                      HierarchyValidationFunc.HierarchyTableAccumulator().tree_branches)
+    kernel_backend = kernel_backend or ('numba' if HasNumba() else 'python')
+    backend_before = backend
+
+    try :
+        for file_name in file_names :
+            with uproot.open(file_name) as file :
+                trees = {tree_name : StreamingLoader.CompactArrays(file[tree_name].arrays(branches, library='ak')) for tree_name, branches in tree_branches.items()}
+
+            int_masks = Definitions.GetIntMasks(trees['EventTree'], trees['PFPTree'])
+            pdg_masks = Definitions.GetPDGMasks(trees['PFPTree'])
+            tier_masks = Definitions.GetTierMasks(trees['HierarchyTree'])
+
+            results = {}
+            for check_backend in ['numpy', kernel_backend] :
+                backend = check_backend
+                michel_index = trees['TrackTree']['BM_MichelIndex']
+                hierarchy_flat = FlatIndex.FlatBranches(trees['HierarchyTree'])
+                check_engine = TrackValidationFunc.TrackChildEngine()
+                check_engine.FillBranches(trees['PFPTree'], trees['TrackTree'], trees['HierarchyTree'], int_masks, tier_masks, pdg_masks)
+                results[check_backend] = {'links' : FlatIndex.ToFlatIndex(michel_index, FlatIndex.GetEventOffsets(trees['PFPTree']['MCP_HasMatch'])),
+                                          'outcomes' : HierarchyValidationFunc.ClassifyHierarchyOutcomes(trees['HierarchyTree'], trees['PFPTree']),
+                                          'chains' : HierarchyValidationFunc.ClassifyChainReconstruction(trees['HierarchyTree'], trees['PFPTree']),
+                                          'michel_hierarchy' : check_engine.counts['hierarchy'],
+                                          'hierarchy_metrics' : ValidationFunc.CalculateHierarchyMetrics(hierarchy_flat, michel_index)}
+
+            for name, expected in results['numpy'].items() :
+                found = results[kernel_backend][name]
+                same = (expected == found) if isinstance(expected, dict) else \
+                       all(np.array_equal(a, b) for a, b in zip(expected, found)) if isinstance(expected, tuple) else np.array_equal(expected, found)
+                if not same :
+                    raise AssertionError(f'{name} differs between the numpy and {kernel_backend} kernels for {file_name}')
+
+            print(f'{file_name}: numpy and {kernel_backend} kernels agree')
+
+    finally :
+        backend = backend_before
+
+if __name__ == '__main__' :
+    CheckKernels(sys.argv[1:])
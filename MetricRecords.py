@@ -0,0 +1,179 @@
+import awkward as ak
+import importlib.util
+import json
+import numpy as np
+import Definitions
+import ValidationFunc
+
+# One record per (metric, interaction, PDG, tier, option, category), at full precision
+#   pdg is -1 for all PDGs, option tells apart variants of a metric (e.g. whether the parent must be reconstructed)
+#   uncertainty is binomial, bootstrap_uncertainty the event-level bootstrap one (nan unless replicas were filled)
+record_fields = {
+    'metric'      : str,
+    'int_type'    : int,
+    'pdg'         : int,
+    'tier'        : int,
+    'option'      : str,
+    'category'    : str,
+    'n_pass'      : int,
+    'n_total'     : int,
+    'fraction'    : float,
+    'uncertainty' : float,
+    'bootstrap_uncertainty' : float
+}
+
+records_version = 2
+
+# CalculateHierarchyMetrics count -> category, as named in HierarchyValidationFunc.outcome_strings
+hierarchy_count_categories = {
+    'n_correct_parent' : 'Correct Parent',
+    'n_false_primary'  : 'False Primary',
+    'n_false_parent'   : 'Wrong Parent',
+    'n_not_best_match' : 'Parent Not Best Match'
+}
+
+##############################################################################################
+##############################################################################################
+
+def MakeRecord(metric, int_type, pdg, tier, category, n_pass, n_total, option='', bootstrap_uncertainty=np.nan, count_scales=None) :
+
+    # count_scales : events in the files per event read, by interaction type, for counts from a quick-look subsample (see QuickLook)
+    #   the counts are scaled up by it, their fractions and uncertainties stay those of the events read
+
+    n_pass = int(n_pass)
+    n_total = int(n_total)
+    fraction = 0.0 if n_total == 0 else float(n_pass) / float(n_total)
+
+    # Binomial uncertainty
+    uncertainty = 0.0 if n_total == 0 else float(np.sqrt(fraction * (1.0 - fraction) / n_total))
+
+    if count_scales is not None :
+        n_pass = int(round(n_pass * count_scales.get(int_type, 1.0)))
+        n_total = int(round(n_total * count_scales.get(int_type, 1.0)))
+
+    return {'metric' : metric, 'int_type' : int(int_type), 'pdg' : int(pdg), 'tier' : int(tier), 'option' : option, 'category' : category,
+            'n_pass' : n_pass, 'n_total' : n_total, 'fraction' : fraction, 'uncertainty' : uncertainty, 'bootstrap_uncertainty' : float(bootstrap_uncertainty)}
+
+##############################################################################################
+##############################################################################################
+
+def GetRecordKey(record) :
+    return (record['metric'], record['int_type'], record['pdg'], record['tier'], record['option'], record['category'])
+
+##############################################################################################
+##############################################################################################
+
+def IndexRecords(records) :
+    return {GetRecordKey(record) : record for record in records}
+
+##############################################################################################
+##############################################################################################
+
+def GetEfficiencyCounts(counts) :
+
+    # (n_reco, n_targets), each (..., int, pdg then all PDGs, tier), from CategoryHist counts with any leading axes (e.g. the replicas)
+    counts = counts.sum(axis=-1)[..., :len(Definitions.ints), :, :len(Definitions.tiers), :]
+    counts = np.concatenate([counts[..., :len(Definitions.pdgs), :, :], counts.sum(axis=-3, keepdims=True)], axis=-3)
+
+    return counts[..., 1], counts.sum(axis=-1)
+
+##############################################################################################
+##############################################################################################
+
+def GetEfficiencyRecords(category_counts, metric='efficiency', count_scales=None) :
+
+    # Whether each true particle was reconstructed, from the CategoryHist counts
+    n_reco, n_targets = GetEfficiencyCounts(category_counts.counts)
+    records = []
+
+    for int_index, int_type in enumerate(Definitions.ints) :
+        for pdg_index, pdg in enumerate(Definitions.pdgs + [-1]) :
+            for tier_index, tier in enumerate(Definitions.tiers) :
+                records.append(MakeRecord(metric, int_type, pdg, tier, 'Reco', n_reco[int_index, pdg_index, tier_index], n_targets[int_index, pdg_index, tier_index],
+                                          count_scales=count_scales))
+
+    return records
+
+##############################################################################################
+##############################################################################################
+
+def RecordsFromEfficiencyMetrics(metric, int_type, pdg, tier, efficiency_metrics, option='', count_scales=None) :
+    return [MakeRecord(metric, int_type, pdg, tier, 'Reco', efficiency_metrics['NReco'], efficiency_metrics['NTarget'], option,
+                       efficiency_metrics.get('EfficiencyErr', np.nan), count_scales)]
+
+##############################################################################################
+##############################################################################################
+
+def RecordsFromHierarchyMetrics(metric, int_type, pdg, tier, hierarchy_metrics, option='', count_scales=None) :
+    return [MakeRecord(metric, int_type, pdg, tier, category, hierarchy_metrics[count_key], hierarchy_metrics['n_total'], option,
+                       hierarchy_metrics.get(count_key.replace('n_', 'err_', 1), np.nan), count_scales) \
+            for count_key, category in hierarchy_count_categories.items()]
+
+##############################################################################################
+##############################################################################################
+
+def EfficiencyMetricsFromRecord(record) :
+    # The dict the text table printers take, with the efficiency of the events read if the counts were scaled
+    efficiency_metrics = ValidationFunc.EfficiencyMetricsFromCounts(record['n_total'], record['n_pass'])
+
+    if record['n_total'] > 0 :
+        efficiency_metrics['Efficiency'] = round(record['fraction'], 2)
+
+    return efficiency_metrics
+
+##############################################################################################
+##############################################################################################
+
+def WriteJSON(records, file_name) :
+
+    # Column-oriented, so a dashboard can load it straight into a table (nan is written as null)
+    columns = {field : [None if (field_type == float) and np.isnan(record[field]) else record[field] for record in records] \
+               for field, field_type in record_fields.items()}
+
+    with open(file_name, 'w') as f :
+        json.dump({'version' : records_version, 'n_records' : len(records), 'columns' : columns}, f)
+
+##############################################################################################
+##############################################################################################
+
+def ReadJSON(file_name) :
+
+    with open(file_name) as f :
+        columns = json.load(f)['columns']
+
+    return [{field : np.nan if value is None else field_type(value) for (field, field_type), value in zip(record_fields.items(), values)} \
+            for values in zip(*[columns[field] for field in record_fields])]
+
+##############################################################################################
+##############################################################################################
+
+def HasParquet() :
+    return importlib.util.find_spec('pyarrow') is not None
+
+##############################################################################################
+##############################################################################################
+
+def WriteParquet(records, file_name) :
+    columns = {field : ak.Array([field_type(record[field]) for record in records]) for field, field_type in record_fields.items()}
+    ak.to_parquet(ak.zip(columns, depth_limit=1), file_name)
+
+##############################################################################################
+##############################################################################################
+
+def ReadParquet(file_name) :
+    return [{field : field_type(record[field]) for field, field_type in record_fields.items()} for record in ak.from_parquet(file_name).to_list()]
+
+##############################################################################################
+##############################################################################################
+
+def WriteRecords(records, file_stem) :
+
+    # JSON always, Parquet as well when pyarrow is there
+    file_names = [f'{file_stem}.json']
+    WriteJSON(records, file_names[0])
+
+    if HasParquet() :
+        file_names.append(f'{file_stem}.parquet')
+        WriteParquet(records, file_names[-1])
+
+    return file_names
@@ -1,226 +1,245 @@
-import awkward as ak
 import numpy as np
-import matplotlib.pyplot as plt
+import os
+import Bootstrap
 import Definitions
+import FigureRendering
+import HistogramEngine
+import MetricRecords
+import Profiling
+import ValidationFunc
 
-plot_dir = '/Users/isobel/Desktop/DUNE/2026/PandoraValidation/PFPValPlots/'
+# Relative to the working directory, batch runs pass their own (PandoraMetrics.py run --output)
+default_plot_dir = os.path.join('plots', 'pfp', '')
 
 ##############################################################################################
 ##############################################################################################
 
-def TrackShowerClassification(int_masks, tier_masks, pdg_masks, pfp_branches) :
-    
+def FillHistograms(int_masks, tier_masks, pdg_masks, pfp_branches, plot_vars) :
+    engine = HistogramEngine.FillEngine(plot_vars)
+    engine.Fill({'PFPTree' : pfp_branches}, int_masks, tier_masks, pdg_masks)
+    return engine
+
+##############################################################################################
+##############################################################################################
+
+def TrackShowerClassification(int_masks, tier_masks, pdg_masks, pfp_branches, plot_dir=default_plot_dir) :
+    engine = FillHistograms(int_masks, tier_masks, pdg_masks, pfp_branches, [])
+    DrawTrackShowerClassification(engine.category_counts, plot_dir=plot_dir)
+
+##############################################################################################
+##############################################################################################
+
+def BuildTrackShowerFigures(category_counts, plot_dir=default_plot_dir) :
+
+    figures = []
+
     for tier in Definitions.tiers :
-    
-        confMatrix_eff = [[], [], []]
-        tier_mask = tier_masks[tier]
-        
-        for int_type in Definitions.ints :
-            
-            int_mask = int_masks[int_type]
-    
+
+        panels = []
+
+        for iInt, int_type in enumerate(Definitions.ints) :
+
+            confMatrix_eff = []
+            confMatrix_err = []
+
             for pdg in Definitions.pdgs :
-                
                 # Only look at those that have been reconstructed
-                target_mask = int_mask & pdg_masks[pdg] & tier_mask & (pfp_branches['BM_IsTrack'] != -1)
-                n_particle = ak.sum(target_mask)
-                n_track = ak.sum(pfp_branches['BM_IsTrack'][target_mask] == 1)
-                n_shower = ak.sum(pfp_branches['BM_IsShower'][target_mask] == 1)
-                confMatrix_eff[int_type].append([round(n_track / n_particle, 2), round(n_shower / n_particle, 2)])
-        
-        ## Draw
-        fig, ax = plt.subplots(nrows=1, ncols=3, figsize=(12, 5))
-        confMatrix_eff = np.array(confMatrix_eff)
-        
-        for int_type in Definitions.ints :
-        
-            # Draw confusion
-            im = ax[int_type].imshow(confMatrix_eff[int_type], cmap='Blues')
-            
-            # Axis ticks
-            ax[int_type].set_xticks([0, 1])
-            ax[int_type].set_xticklabels(["Track", "Shower"])
-            ax[int_type].set_yticks(range(len(Definitions.pdgs)))
-            ax[int_type].set_yticklabels([str(p) for p in Definitions.pdgs])
-            
-            # Axis labels and title
-            ax[int_type].set_xlabel("Reco Classification")
-            ax[int_type].set_ylabel("True PDG")
-            ax[int_type].set_title(f'{Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]}')
-            
-            # Colorbar
-            cbar = fig.colorbar(im, ax=ax[int_type])
-            cbar.set_label("Counts")
-            
-            # Add text inside cells
-            for i in range(confMatrix_eff[int_type].shape[0]):
-                for j in range(confMatrix_eff[int_type].shape[1]):
-                    ax[int_type].text(j, i, confMatrix_eff[int_type][i, j],
-                            ha="center", va="center", color="black")
-            
-        plt.tight_layout()
-        plt.show()
-    
+                n_particle = category_counts.NEntries(int_type, pdg, tier) - category_counts.NEntries(int_type, pdg, tier, reco_class=0)
+                n_track = category_counts.NEntries(int_type, pdg, tier, reco_class=1)
+                n_shower = category_counts.NEntries(int_type, pdg, tier, reco_class=2)
+                confMatrix_eff.append([round(n_track / n_particle, 2), round(n_shower / n_particle, 2)])
+
+                if category_counts.replicas is not None :
+                    replica_particle = category_counts.ProjectReplicas(int_type, pdg, tier) - category_counts.ProjectReplicas(int_type, pdg, tier, reco_class=0)
+                    replica_class = [category_counts.ProjectReplicas(int_type, pdg, tier, reco_class=reco_class) for reco_class in [1, 2]]
+                    confMatrix_err.append([round(float(Bootstrap.GetRatioUncertainty(replica, replica_particle)), 2) for replica in replica_class])
+
+            panel = {'row' : 0, 'col' : iInt,
+                     'matrix' : np.array(confMatrix_eff),
+                     'xticklabels' : ["Track", "Shower"],
+                     'yticklabels' : [str(p) for p in Definitions.pdgs],
+                     'xlabel' : "Reco Classification",
+                     'ylabel' : "True PDG",
+                     'title' : f'{Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]}',
+                     'colorbar_label' : "Counts"}
+
+            if category_counts.replicas is not None :
+                panel['errors'] = np.array(confMatrix_err)
+
+            panels.append(panel)
+
         file_name = f'TrackShowerClassification_{Definitions.tier_strings[tier]}'
-        fig.savefig(f'{plot_dir}{file_name}.pdf', bbox_inches='tight')
+        figures.append({'renderer' : 'confusion', 'file_name' : f'{plot_dir}{file_name}.pdf',
+                        'nrows' : 1, 'ncols' : len(Definitions.ints), 'figsize' : (12, 5), 'panels' : panels})
+
+    return figures
+
+##############################################################################################
+##############################################################################################
+
+def DrawTrackShowerClassification(category_counts, n_workers=1, skip_unchanged=False, plot_dir=default_plot_dir, keep_open=True) :
+    FigureRendering.RenderFigures(BuildTrackShowerFigures(category_counts, plot_dir), n_workers, skip_unchanged, keep_open)
+
+##############################################################################################
+##############################################################################################
+
+@Profiling.Profiled('table:efficiency')
+def WriteEfficiencyTables(category_counts, count_scales=None, plot_dir=default_plot_dir) :
+
+    file_name = 'EfficiencyTables'
+    records = Bootstrap.AddBootstrapUncertainties(MetricRecords.GetEfficiencyRecords(category_counts, count_scales=count_scales), category_counts, MetricRecords.GetEfficiencyCounts)
+    indexed_records = MetricRecords.IndexRecords(records)
+    os.makedirs(plot_dir, exist_ok=True)
+
+    with open(f'{plot_dir}{file_name}.txt', "w") as f :
+        for int_type in Definitions.ints :
+            ValidationFunc.PrintEfficiencyTableHeader(int_type, f)
+
+            for tier in Definitions.tiers :
+                record = indexed_records[('efficiency', int_type, -1, tier, '', 'Reco')]
+                ValidationFunc.PrintEfficiencyTableEntry(tier, MetricRecords.EfficiencyMetricsFromRecord(record), f)
+
+            ValidationFunc.PrintEfficiencyTableFooter(f)
+
+    MetricRecords.WriteRecords(records, f'{plot_dir}EfficiencyMetrics')
+
+    return records
+
+#####################################################################################################################################################
+#####################################################################################################################################################
+
+def RecoEfficiency(int_masks, tier_masks, pdg_masks, pfp_branches, plot_var, plot_dir=default_plot_dir) :
+    engine = FillHistograms(int_masks, tier_masks, pdg_masks, pfp_branches, [plot_var])
+    DrawRecoEfficiency(engine.hists[HistogramEngine.GetVarKey(plot_var)], plot_var, plot_dir=plot_dir)
 
 #####################################################################################################################################################
 #####################################################################################################################################################
 
-def RecoEfficiency(int_masks, tier_masks, pdg_masks, pfp_branches, plot_var) :
+def GetGridPanel(iInt, iPDG, tier, x_label, y_label, title_var_name) :
+    # iInt and iPDG are positions in Definitions.ints and Definitions.pdgs
+    int_type = Definitions.ints[iInt]
+    is_x_label_index = iInt == (len(Definitions.ints) - 1)
+    is_y_label_index = (iPDG == 0)
+
+    return {'row' : iInt, 'col' : iPDG,
+            'xlabel' : x_label if is_x_label_index else '',
+            'ylabel' : y_label if is_y_label_index else '',
+            'title' : f'       {Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]} {title_var_name}' if is_y_label_index else '',
+            'tick_params' : {'labelbottom' : is_x_label_index, 'bottom' : is_x_label_index, 'labelleft' : is_y_label_index, 'left' : is_y_label_index}}
+
+#####################################################################################################################################################
+#####################################################################################################################################################
+
+def BuildRecoEfficiencyFigures(hist, plot_var, plot_dir=default_plot_dir) :
+
+    edges = hist.edges
+    bin_centers = 0.5 * (edges[1:] + edges[:-1])
+    figures = []
 
-    mc_metric = pfp_branches[plot_var.tree_name]
-    mc_has_match = pfp_branches['MCP_HasMatch']
-    
     for tier in Definitions.tiers :
 
-        tier_mask = tier_masks[tier]
-    
         # Save plots for each tier in a different file
-        fig, ax = plt.subplots(ncols=len(Definitions.pdgs), nrows=len(Definitions.ints), figsize=(14, 10))
+        panels = []
+
+        for iInt, int_type in enumerate(Definitions.ints) :
 
-        for int_type in Definitions.ints :
-        
-            int_mask = int_masks[int_type]
-    
             for iPDG in range(len(Definitions.pdgs)) :
-    
+
                 pdg = Definitions.pdgs[iPDG]
                 pdg_string = Definitions.pdg_strings[pdg]
                 colour = Definitions.pdg_color[pdg]
 
-                target_mask = int_mask & pdg_masks[pdg] & tier_mask
-                reco_mask = target_mask & (mc_has_match == 1)
-
-                target_entries = ak.to_numpy(ak.flatten(pfp_branches[plot_var.tree_name][target_mask]))
-                reco_entries = ak.to_numpy(ak.flatten(pfp_branches[plot_var.tree_name][reco_mask]))
-                
-                hist_target, edges = np.histogram(target_entries, bins=plot_var.n_bins, range=plot_var.range)
-                hist_reco, _ = np.histogram(reco_entries, bins=plot_var.n_bins, range=plot_var.range)
-                efficiency = np.divide(hist_reco, hist_target, 
-                                       out=np.zeros_like(hist_reco, dtype=float), 
+                hist_target = hist.Slice(int_type, pdg, tier)
+                hist_reco = hist.Slice(int_type, pdg, tier, has_match=1)
+                efficiency = np.divide(hist_reco, hist_target,
+                                       out=np.zeros_like(hist_reco, dtype=float),
                                        where=hist_target > 0)
 
-                # Binomial efficiency uncertainty
+                # Binomial efficiency uncertainty, or the bootstrap one if there are replicas
                 efficiency_err = np.zeros_like(efficiency)
                 valid = hist_target > 0
                 efficiency_err[valid] = np.sqrt(
                     efficiency[valid] * (1.0 - efficiency[valid]) / hist_target[valid]
                 )
 
-                bin_centers = 0.5 * (edges[1:] + edges[:-1])
-                ax[int_type][iPDG].errorbar(bin_centers, efficiency, yerr=efficiency_err, fmt='o-', color=colour, capsize=3, label=f' {pdg_string} ')
-                #ax[int_type][iPDG].plot(bin_centers, efficiency, 'o-', color=colour, label=(f' {pdg_string} '))
-                ax[int_type][iPDG].legend()
-                ax[int_type][iPDG].set_ylim(0.0, 1.0)
-                is_x_label_index = int_type == (len(Definitions.ints) - 1)
-                ax[int_type][iPDG].set_xlabel(plot_var.x_label if is_x_label_index else '')
-                ax[int_type][iPDG].tick_params(labelbottom=is_x_label_index, bottom=is_x_label_index)
-                is_y_label_index = (iPDG == 0)
-                ax[int_type][iPDG].set_title(f'       {Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]} {plot_var.tree_name}' if is_y_label_index else '')
-                ax[int_type][iPDG].set_ylabel('Efficiency' if is_y_label_index else '')
-                ax[int_type][iPDG].tick_params(labelleft=is_y_label_index, left=is_y_label_index)
-                ax[int_type][iPDG].grid(True)
-                fig.tight_layout(pad=0)
-                fig.subplots_adjust(left=0.08, bottom=0.08)
+                if hist.replicas is not None :
+                    efficiency_err = np.nan_to_num(Bootstrap.GetRatioUncertainty(hist.SliceReplicas(int_type, pdg, tier, has_match=1), hist.SliceReplicas(int_type, pdg, tier)))
+
+                panel = GetGridPanel(iInt, iPDG, tier, plot_var.x_label, 'Efficiency', plot_var.tree_name)
+                panel['series'] = [{'type' : 'errorbar', 'x' : bin_centers, 'y' : efficiency, 'yerr' : efficiency_err,
+                                    'kwargs' : {'fmt' : 'o-', 'color' : colour, 'capsize' : 3, 'label' : f' {pdg_string} '}}]
+                panels.append(panel)
 
         file_name = f'Efficiency_{plot_var.tree_name}_{Definitions.tier_strings[tier]}'
-        fig.savefig(f'{plot_dir}{file_name}.pdf', bbox_inches='tight')
+        figures.append({'renderer' : 'grid', 'file_name' : f'{plot_dir}{file_name}.pdf',
+                        'nrows' : len(Definitions.ints), 'ncols' : len(Definitions.pdgs), 'figsize' : (14, 10),
+                        'tight_layout' : {'pad' : 0}, 'subplots_adjust' : {'left' : 0.08, 'bottom' : 0.08}, 'panels' : panels})
+
+    return figures
 
 #####################################################################################################################################################
 #####################################################################################################################################################
 
-def PlotVariable(int_masks, tier_masks, pdg_masks, pfp_branches, plot_var, only_matched) :
-
-    mc_metric = pfp_branches[plot_var.tree_name]
+def DrawRecoEfficiency(hist, plot_var, n_workers=1, skip_unchanged=False, plot_dir=default_plot_dir, keep_open=True) :
+    FigureRendering.RenderFigures(BuildRecoEfficiencyFigures(hist, plot_var, plot_dir), n_workers, skip_unchanged, keep_open)
 
-    mc_has_match = ak.ones_like(mc_metric)
-    if (only_matched) :
-        mc_has_match = pfp_branches['MCP_HasMatch']
-    
-    for tier in Definitions.tiers :
+#####################################################################################################################################################
+#####################################################################################################################################################
 
-        tier_mask = tier_masks[tier]
-    
-        # Save plots for each tier in a different file
-        fig, ax = plt.subplots(ncols=len(Definitions.pdgs), nrows=len(Definitions.ints), figsize=(14, 10))
+def PlotVariable(int_masks, tier_masks, pdg_masks, pfp_branches, plot_var, only_matched, plot_dir=default_plot_dir) :
+    engine = FillHistograms(int_masks, tier_masks, pdg_masks, pfp_branches, [plot_var])
+    DrawVariable(engine.hists[HistogramEngine.GetVarKey(plot_var)], plot_var, only_matched, plot_dir=plot_dir)
 
-        for int_type in Definitions.ints :
-        
-            int_mask = int_masks[int_type]
-    
-            for iPDG in range(len(Definitions.pdgs)) :
-    
-                pdg = Definitions.pdgs[iPDG]
-                pdg_string = Definitions.pdg_strings[pdg]
-                colour = Definitions.pdg_color[pdg]
-
-                target_mask = int_mask & pdg_masks[pdg] & tier_mask
-                reco_mask = target_mask & (mc_has_match == 1)
-                reco_entries = ak.to_numpy(ak.flatten(mc_metric[reco_mask]))
-                n_reco_entries = len(reco_entries)
-                weights = np.ones(n_reco_entries) * (1.0 / n_reco_entries)
-                
-                ax[int_type][iPDG].hist(reco_entries, bins=plot_var.n_bins, range=plot_var.range, weights=weights, histtype='step', color=colour, linewidth=1, label=(f' {pdg_string} '))
-                ax[int_type][iPDG].legend()
-                ax[int_type][iPDG].set_ylim(0.0, 1.0)
-                is_x_label_index = int_type == (len(Definitions.ints) - 1)
-                ax[int_type][iPDG].set_xlabel(plot_var.x_label if is_x_label_index else '')
-                ax[int_type][iPDG].tick_params(labelbottom=is_x_label_index, bottom=is_x_label_index)
-                is_y_label_index = (iPDG == 0)
-                ax[int_type][iPDG].set_title(f'       {Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]} {plot_var.tree_name}' if is_y_label_index else '')
-                ax[int_type][iPDG].set_ylabel(plot_var.y_label if is_y_label_index else '')
-                ax[int_type][iPDG].tick_params(labelleft=is_y_label_index, left=is_y_label_index)
-                ax[int_type][iPDG].grid(True)
-                fig.tight_layout(pad=0)
-                fig.subplots_adjust(left=0.08, bottom=0.08)
+#####################################################################################################################################################
+#####################################################################################################################################################
 
-        file_name = f'Efficiency_{plot_var.tree_name}_{Definitions.tier_strings[tier]}'
-        fig.savefig(f'{plot_dir}{file_name}.pdf', bbox_inches='tight')
+def PlotDiffVariable(int_masks, tier_masks, pdg_masks, pfp_branches, plot_diff_var, plot_dir=default_plot_dir) :
+    engine = FillHistograms(int_masks, tier_masks, pdg_masks, pfp_branches, [plot_diff_var])
+    DrawVariable(engine.hists[HistogramEngine.GetVarKey(plot_diff_var)], plot_diff_var, True, plot_dir=plot_dir)
 
 #####################################################################################################################################################
 #####################################################################################################################################################
 
-def PlotDiffVariable(int_masks, tier_masks, pdg_masks, pfp_branches, plot_diff_var) :
+def BuildVariableFigures(hist, plot_var, only_matched, plot_dir=default_plot_dir) :
+
+    edges = hist.edges
+    has_match = 1 if only_matched else None
+    var_name = HistogramEngine.GetVarKey(plot_var)
+    file_prefix = var_name if hasattr(plot_var, 'true_tree_name') else f'Distribution_{var_name}'
+    figures = []
 
-    mc_metric = pfp_branches[plot_diff_var.true_tree_name] - pfp_branches[plot_diff_var.reco_tree_name]
-    mc_has_match = pfp_branches['MCP_HasMatch']
-    
     for tier in Definitions.tiers :
 
-        tier_mask = tier_masks[tier]
-    
         # Save plots for each tier in a different file
-        fig, ax = plt.subplots(ncols=len(Definitions.pdgs), nrows=len(Definitions.ints), figsize=(14, 10))
+        panels = []
+
+        for iInt, int_type in enumerate(Definitions.ints) :
 
-        for int_type in Definitions.ints :
-        
-            int_mask = int_masks[int_type]
-    
             for iPDG in range(len(Definitions.pdgs)) :
-    
+
                 pdg = Definitions.pdgs[iPDG]
                 pdg_string = Definitions.pdg_strings[pdg]
                 colour = Definitions.pdg_color[pdg]
 
-                target_mask = int_mask & pdg_masks[pdg] & tier_mask
-                reco_mask = target_mask & (mc_has_match == 1)
-                reco_entries = ak.to_numpy(ak.flatten(mc_metric[reco_mask]))
-                n_reco_entries = len(reco_entries)
-                weights = np.ones(n_reco_entries) * (1.0 / n_reco_entries)
-                ax[int_type][iPDG].hist(reco_entries, bins=plot_diff_var.n_bins, range=plot_diff_var.range, weights=weights, histtype='step', color=colour, linewidth=1, label=(f' {pdg_string} '))
-                ax[int_type][iPDG].legend()
-                ax[int_type][iPDG].set_ylim(0.0, 1.0)
-                is_x_label_index = int_type == (len(Definitions.ints) - 1)
-                ax[int_type][iPDG].set_xlabel(plot_diff_var.x_label if is_x_label_index else '')
-                ax[int_type][iPDG].tick_params(labelbottom=is_x_label_index, bottom=is_x_label_index)
-                is_y_label_index = (iPDG == 0)
-                ax[int_type][iPDG].set_title(f'       {Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]} {plot_diff_var.true_tree_name}-{plot_diff_var.reco_tree_name}' if is_y_label_index else '')
-                ax[int_type][iPDG].set_ylabel(plot_diff_var.y_label if is_y_label_index else '')
-                ax[int_type][iPDG].tick_params(labelleft=is_y_label_index, left=is_y_label_index)
-                ax[int_type][iPDG].grid(True)
-                fig.tight_layout(pad=0)
-                fig.subplots_adjust(left=0.08, bottom=0.08)
-
-        file_name = f'{plot_diff_var.true_tree_name}-{plot_diff_var.reco_tree_name}_{Definitions.tier_strings[tier]}'
-        fig.savefig(f'{plot_dir}{file_name}.pdf', bbox_inches='tight')
\ No newline at end of file
+                # Normalise to all selected entries, including those outside the plotted range
+                hist_reco = hist.Slice(int_type, pdg, tier, has_match=has_match)
+                n_reco_entries = hist.NEntries(int_type, pdg, tier, has_match=has_match)
+                weights = hist_reco * (1.0 / n_reco_entries) if n_reco_entries > 0 else np.zeros(len(hist_reco))
+
+                panel = GetGridPanel(iInt, iPDG, tier, plot_var.x_label, plot_var.y_label, var_name)
+                panel['series'] = [{'type' : 'hist', 'edges' : edges, 'weights' : weights,
+                                    'kwargs' : {'histtype' : 'step', 'color' : colour, 'linewidth' : 1, 'label' : f' {pdg_string} '}}]
+                panels.append(panel)
+
+        file_name = f'{file_prefix}_{Definitions.tier_strings[tier]}'
+        figures.append({'renderer' : 'grid', 'file_name' : f'{plot_dir}{file_name}.pdf',
+                        'nrows' : len(Definitions.ints), 'ncols' : len(Definitions.pdgs), 'figsize' : (14, 10),
+                        'tight_layout' : {'pad' : 0}, 'subplots_adjust' : {'left' : 0.08, 'bottom' : 0.08}, 'panels' : panels})
+
+    return figures
+
+#####################################################################################################################################################
+#####################################################################################################################################################
+
+def DrawVariable(hist, plot_var, only_matched, n_workers=1, skip_unchanged=False, plot_dir=default_plot_dir, keep_open=True) :
+    FigureRendering.RenderFigures(BuildVariableFigures(hist, plot_var, only_matched, plot_dir), n_workers, skip_unchanged, keep_open)
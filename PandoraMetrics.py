@@ -0,0 +1,235 @@
+import argparse
+import os
+import sys
+import traceback
+
+# Headless entry point for batch jobs, running the same functions as the notebooks, e.g.
+#   python PandoraMetrics.py run --input 'files/*.root' --output out/ --metrics pfp,hierarchy,michel
+#   python PandoraMetrics.py compare --input-a old.root --input-b new.root --labels old new --output out/
+# Each metric writes to its own <output>/<metric>/ directory, a comparison to <output>/comparison/
+# The analysis modules are only imported once the arguments are parsed, and pyplot only when plots are made
+
+metric_names = ['pfp', 'hierarchy', 'michel', 'thresholds', 'cutflow']
+
+# What runs without --metrics, the completeness/purity threshold scans and the cut flows are only run when asked for
+default_metric_names = ['pfp', 'hierarchy', 'michel']
+
+# Metrics that can be filled from --cache-dir, the others always read the trees
+cache_metric_names = ['pfp']
+
+# Exit statuses
+exit_success = 0
+exit_failure = 1        # at least one metric failed, the others still ran
+exit_usage = 2          # bad arguments or no input files, as argparse
+
+##############################################################################################
+##############################################################################################
+
+def ParseMetrics(metrics) :
+
+    selected = [metric.strip() for metric in metrics.split(',') if metric.strip() != '']
+    unknown = [metric for metric in selected if metric not in metric_names]
+
+    if (len(selected) == 0) or (len(unknown) > 0) :
+        raise argparse.ArgumentTypeError(f'expected a comma separated list of {metric_names}, got {metrics}')
+
+    return selected
+
+##############################################################################################
+##############################################################################################
+
+def ParseFraction(fraction) :
+
+    value = float(fraction)
+
+    if not (0.0 < value <= 1.0) :
+        raise argparse.ArgumentTypeError(f'expected a fraction in (0, 1], got {fraction}')
+
+    return value
+
+##############################################################################################
+##############################################################################################
+
+def GetMetricDir(output_dir, metric) :
+
+    metric_dir = os.path.join(output_dir, metric, '')
+    os.makedirs(metric_dir, exist_ok=True)
+
+    return metric_dir
+
+##############################################################################################
+##############################################################################################
+
+def GetPFPVars() :
+
+    import ValidationFunc
+
+    # (efficiency, matched, all, diff) variables of the pfp metrics
+    return ([ValidationFunc.n_mc_hits_2d_var, ValidationFunc.theta_xz_var, ValidationFunc.theta_yz_var, ValidationFunc.pfo_energy_var],
+            [ValidationFunc.pfo_signed_vertex_acc_var],
+            [ValidationFunc.completeness_var, ValidationFunc.purity_var],
+            [ValidationFunc.length_diff_var, ValidationFunc.displacement_diff_var])
+
+##############################################################################################
+##############################################################################################
+
+def RunMetric(metric, args, metric_dir, quick_look=None) :
+
+    import Profiling
+    import StreamingLoader
+    import ThresholdScan
+    import ValidationRunner
+
+    trace_file = f'{metric_dir}ProfileTrace.json' if args.profile else None
+    make_plots = not args.no_plots
+    step_size = StreamingLoader.default_step_size if args.step_size is None else args.step_size
+
+    # Each metric's trace only holds its own stages
+    Profiling.Reset()
+
+    if metric == 'pfp' :
+        ValidationRunner.RunPFPValidation(args.input, *GetPFPVars(), args.workers, step_size, not args.force_render, args.store_dir, trace_file, args.replicas, make_plots, quick_look,
+                                          args.cache_dir, metric_dir)
+
+    elif metric == 'hierarchy' :
+        ValidationRunner.RunHierarchyValidation(args.input, args.workers, step_size, args.store_dir, trace_file, args.replicas, quick_look, metric_dir)
+
+    elif metric == 'michel' :
+        ValidationRunner.RunMichelValidation(args.input, args.workers, step_size, args.store_dir, trace_file, args.replicas, make_plots, quick_look=quick_look, plot_dir=metric_dir)
+
+    elif metric == 'thresholds' :
+        ValidationRunner.RunThresholdScan(args.input, tuple(ThresholdScan.threshold_planes), args.workers, step_size, args.store_dir, trace_file, make_plots, quick_look=quick_look,
+                                          plot_dir=metric_dir)
+
+    elif metric == 'cutflow' :
+        ValidationRunner.RunCutFlow(args.input, None, args.workers, step_size, args.store_dir, trace_file, quick_look, metric_dir)
+
+##############################################################################################
+##############################################################################################
+
+def Run(args) :
+
+    # Definitions reads the categories when it is first imported
+    if args.categories is not None :
+        os.environ['PANDORA_METRICS_CATEGORIES'] = os.path.abspath(args.categories)
+
+    if not args.no_plots :
+        import matplotlib
+        matplotlib.use('Agg')
+
+    import QuickLook
+    import ValidationRunner
+
+    # One subsample for every metric, selected from each file once
+    quick_look = None if args.quick_look is None else QuickLook.QuickLookSample(args.quick_look, args.quick_look_seed)
+
+    try :
+        missing = [file_name for file_name in ValidationRunner.GetFileNames(args.input) if not os.path.isfile(file_name)]
+    except FileNotFoundError as error :
+        print(f'pandora-metrics: {error}', file=sys.stderr)
+        return exit_usage
+
+    if len(missing) > 0 :
+        print(f'pandora-metrics: input files not found: {missing}', file=sys.stderr)
+        return exit_usage
+
+    status = exit_success
+
+    for metric in args.metrics :
+        print(f'pandora-metrics: running {metric}')
+        if (args.cache_dir is not None) and (metric not in cache_metric_names) :
+            print(f'pandora-metrics: --cache-dir only applies to {",".join(cache_metric_names)}, {metric} reads the trees')
+        try :
+            RunMetric(metric, args, GetMetricDir(args.output, metric), quick_look)
+        except Exception :
+            traceback.print_exc()
+            print(f'pandora-metrics: {metric} failed', file=sys.stderr)
+            status = exit_failure
+
+    if quick_look is not None :
+        quick_look.PrintSummary()
+
+    return status
+
+##############################################################################################
+##############################################################################################
+
+def Compare(args) :
+
+    if args.categories is not None :
+        os.environ['PANDORA_METRICS_CATEGORIES'] = os.path.abspath(args.categories)
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    import StreamingLoader
+    import VersionComparison
+
+    missing = [file_name for file_name in [args.input_a, args.input_b] if not os.path.isfile(file_name)]
+
+    if len(missing) > 0 :
+        print(f'pandora-metrics: input files not found: {missing}', file=sys.stderr)
+        return exit_usage
+
+    step_size = StreamingLoader.default_step_size if args.step_size is None else args.step_size
+
+    try :
+        VersionComparison.CompareVersions(args.input_a, args.input_b, args.labels, *GetPFPVars(), step_size, args.workers or os.cpu_count() or 1,
+                                          not args.force_render, GetMetricDir(args.output, 'comparison'))
+    except Exception :
+        traceback.print_exc()
+        print('pandora-metrics: comparison failed', file=sys.stderr)
+        return exit_failure
+
+    return exit_success
+
+##############################################################################################
+##############################################################################################
+
+def main(argv=None) :
+
+    parser = argparse.ArgumentParser(prog='pandora-metrics', description='Run the Pandora validation metrics without the notebooks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Write the tables, metric records and plots of the selected metrics')
+    run_parser.add_argument('--input', nargs='+', required=True, help='ROOT files or glob patterns')
+    run_parser.add_argument('--output', required=True, help='Directory for the outputs, one subdirectory per metric')
+    run_parser.add_argument('--metrics', type=ParseMetrics, default=list(default_metric_names), help=f'Comma separated, from {",".join(metric_names)} (default: {",".join(default_metric_names)})')
+    run_parser.add_argument('--no-plots', action='store_true', help='Tables and metric records only, pyplot is never imported')
+    run_parser.add_argument('--force-render', action='store_true', help='Render every figure, even those whose data has not changed')
+    run_parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+    run_parser.add_argument('--step-size', type=int, default=None, help='Events per streamed chunk (default: StreamingLoader.default_step_size)')
+    run_parser.add_argument('--store-dir', default=None, help='Keep per-file results here, so reruns only process added or changed files')
+    run_parser.add_argument('--replicas', type=int, default=0, help='Bootstrap replicas for the uncertainties (default: binomial only)')
+    run_parser.add_argument('--categories', default=None, help='Category registry to use instead of Categories.json')
+    run_parser.add_argument('--quick-look', type=ParseFraction, default=None, help='Run on this fraction of the events, stratified by interaction type, with the counts scaled to all of them')
+    run_parser.add_argument('--quick-look-seed', type=int, default=0, help='Seed of the quick-look subsample (default: 0)')
+    run_parser.add_argument('--cache-dir', default=None, help='Keep the derived columns of each file here, so pfp reruns skip the trees (not with --replicas or --quick-look)')
+    run_parser.add_argument('--profile', action='store_true', help='Write a Chrome trace of the stages to each metric directory')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two reconstruction versions of the same sample, event by event')
+    compare_parser.add_argument('--input-a', required=True, help='ROOT file of the first version')
+    compare_parser.add_argument('--input-b', required=True, help='ROOT file of the second version')
+    compare_parser.add_argument('--labels', nargs=2, default=['A', 'B'], help='Names of the two versions in the tables and legends (default: A B)')
+    compare_parser.add_argument('--output', required=True, help='Directory for the outputs, written to its comparison subdirectory')
+    compare_parser.add_argument('--force-render', action='store_true', help='Render every figure, even those whose data has not changed')
+    compare_parser.add_argument('--workers', type=int, default=None, help='Worker processes for rendering (default: one per CPU)')
+    compare_parser.add_argument('--step-size', type=int, default=None, help='Matched events per chunk (default: StreamingLoader.default_step_size)')
+    compare_parser.add_argument('--categories', default=None, help='Category registry to use instead of Categories.json')
+
+    args = parser.parse_args(argv)
+
+    # The cached columns hold every event, and not which event each PFP came from
+    if (args.command == 'run') and (args.cache_dir is not None) and ((args.replicas > 0) or (args.quick_look is not None)) :
+        parser.error('--cache-dir can\'t be used with --replicas or --quick-look')
+
+    if args.command == 'run' :
+        return Run(args)
+
+    if args.command == 'compare' :
+        return Compare(args)
+
+    return exit_usage
+
+if __name__ == '__main__' :
+    sys.exit(main())
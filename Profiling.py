@@ -0,0 +1,251 @@
+import contextlib
+import functools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+# Opt-in timing of the pipeline stages (load, masks, fills, tables, figure saves), written as a Chrome trace
+# that chrome://tracing or ui.perfetto.dev can open. One complete ('X') event per stage, its args hold
+#   cpu_s                CPU time of this process
+#   rss_bytes            resident memory at the end of the stage, max_rss_bytes the high water mark so far
+#   peak_traced_bytes    peak of the traced allocations (Python, NumPy and so awkward buffers) above the start
+#   net_traced_bytes     traced allocations still held at the end of the stage
+# Switched on with Enable(), or for a whole run, worker processes included, with PANDORA_METRICS_PROFILE=1
+# The traced bytes need Enable(allocations=True) or PANDORA_METRICS_PROFILE=memory, as tracemalloc slows
+# Python-heavy stages (matplotlib especially) down several times, so their wall times are then not comparable
+
+profile_setting = os.environ.get('PANDORA_METRICS_PROFILE', '0')
+
+enabled = profile_setting not in ['', '0']
+trace_allocations = profile_setting == 'memory'
+
+events = []
+
+# Running peak of the traced allocations of each open stage, innermost last, per thread (see StreamingLoader.PrefetchChunks)
+peak_stacks = {}
+
+##############################################################################################
+##############################################################################################
+
+def Enable(allocations=False) :
+
+    global enabled, trace_allocations
+
+    enabled = True
+    trace_allocations = allocations
+
+##############################################################################################
+##############################################################################################
+
+def Disable() :
+
+    global enabled
+
+    enabled = False
+
+    if tracemalloc.is_tracing() :
+        tracemalloc.stop()
+
+##############################################################################################
+##############################################################################################
+
+def GetSettings() :
+    # What a worker process needs to profile the same way, None if profiling is off
+    return {'allocations' : trace_allocations} if enabled else None
+
+##############################################################################################
+##############################################################################################
+
+def StartWorker(settings) :
+
+    # Forked workers start with a copy of the main process events, which are already counted there
+    events.clear()
+    peak_stacks.clear()
+
+    if settings is not None :
+        Enable(**settings)
+
+##############################################################################################
+##############################################################################################
+
+def GetRSS() :
+
+    # Linux only, None elsewhere
+    try :
+        with open('/proc/self/statm') as f :
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError) :
+        return None
+
+##############################################################################################
+##############################################################################################
+
+def GetMaxRSS() :
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+##############################################################################################
+##############################################################################################
+
+@contextlib.contextmanager
+def Stage(name, **args) :
+
+    if not enabled :
+        yield
+        return
+
+    if trace_allocations and not tracemalloc.is_tracing() :
+        tracemalloc.start()
+
+    is_tracing = tracemalloc.is_tracing()
+    peak_stack = peak_stacks.setdefault(threading.get_ident(), [])
+
+    if is_tracing :
+        # Hand the peak so far to the enclosing stage before resetting it for this one
+        traced_start, traced_peak = tracemalloc.get_traced_memory()
+        if len(peak_stack) > 0 :
+            peak_stack[-1] = max(peak_stack[-1], traced_peak)
+        tracemalloc.reset_peak()
+        peak_stack.append(traced_start)
+
+    timestamp = time.time()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    try :
+        yield
+    finally :
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+
+        event_args = dict(args)
+        event_args.update({'cpu_s' : cpu_time, 'rss_bytes' : GetRSS(), 'max_rss_bytes' : GetMaxRSS()})
+
+        if is_tracing :
+            traced_stop, traced_peak = tracemalloc.get_traced_memory()
+            traced_peak = max(peak_stack.pop(), traced_peak)
+            if len(peak_stack) > 0 :
+                peak_stack[-1] = max(peak_stack[-1], traced_peak)
+            event_args.update({'peak_traced_bytes' : traced_peak - traced_start, 'net_traced_bytes' : traced_stop - traced_start})
+
+        # Wall clock timestamps, so events from worker processes line up with the main process
+        events.append({'name' : name, 'cat' : name.split(':')[0], 'ph' : 'X', 'ts' : timestamp * 1e6, 'dur' : wall_time * 1e6,
+                       'pid' : os.getpid(), 'tid' : threading.get_ident(), 'args' : event_args})
+
+##############################################################################################
+##############################################################################################
+
+def Profiled(name) :
+
+    # Decorator form of Stage, for whole functions
+    def Decorator(function) :
+        @functools.wraps(function)
+        def Wrapper(*args, **kwargs) :
+            with Stage(name) :
+                return function(*args, **kwargs)
+        return Wrapper
+
+    return Decorator
+
+##############################################################################################
+##############################################################################################
+
+def TakeEvents() :
+
+    # Hands a worker's events back to the main process
+    taken = list(events)
+    events.clear()
+
+    return taken
+
+##############################################################################################
+##############################################################################################
+
+def AddEvents(worker_events) :
+    events.extend(worker_events)
+
+##############################################################################################
+##############################################################################################
+
+def Reset() :
+    events.clear()
+
+##############################################################################################
+##############################################################################################
+
+def Summarise(trace_events=None) :
+
+    # Totals per stage name, nested stages are also counted in their parents
+    trace_events = events if trace_events is None else trace_events
+    summary = {}
+
+    for event in trace_events :
+        stage = summary.setdefault(event['name'], {'count' : 0, 'wall_s' : 0.0, 'cpu_s' : 0.0, 'peak_traced_bytes' : 0, 'max_rss_bytes' : 0})
+        stage['count'] += 1
+        stage['wall_s'] += event['dur'] / 1e6
+        stage['cpu_s'] += event['args']['cpu_s']
+        stage['peak_traced_bytes'] = max(stage['peak_traced_bytes'], event['args'].get('peak_traced_bytes', 0))
+        stage['max_rss_bytes'] = max(stage['max_rss_bytes'], event['args']['max_rss_bytes'])
+
+    return summary
+
+##############################################################################################
+##############################################################################################
+
+def PrintSummary(trace_events=None) :
+
+    summary = Summarise(trace_events)
+
+    print(f"{'stage':<40} {'count':>7} {'wall [s]':>10} {'cpu [s]':>10} {'peak traced [MB]':>17} {'max RSS [MB]':>13}")
+
+    for name, stage in sorted(summary.items(), key=lambda item : -item[1]['wall_s']) :
+        print(f"{name:<40} {stage['count']:>7} {stage['wall_s']:10.3f} {stage['cpu_s']:10.3f} {stage['peak_traced_bytes'] / 1e6:17.1f} {stage['max_rss_bytes'] / 1e6:13.1f}")
+
+##############################################################################################
+##############################################################################################
+
+def GetGitCommit() :
+    try :
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except (OSError, subprocess.CalledProcessError) :
+        return None
+
+##############################################################################################
+##############################################################################################
+
+def GetVersions() :
+
+    versions = {'python' : platform.python_version()}
+
+    for module_name in ['numpy', 'awkward', 'uproot'] :
+        try :
+            versions[module_name] = __import__(module_name).__version__
+        except ImportError :
+            versions[module_name] = None
+
+    return versions
+
+##############################################################################################
+##############################################################################################
+
+def WriteTrace(file_name, trace_events=None) :
+
+    trace_events = events if trace_events is None else trace_events
+
+    # Times from the start of the run, so traces of different runs can be laid side by side
+    start = min([event['ts'] for event in trace_events], default=0.0)
+    trace = {'traceEvents' : [dict(event, ts=event['ts'] - start) for event in trace_events],
+             'displayTimeUnit' : 'ms',
+             'otherData' : {'commit' : GetGitCommit(), 'versions' : GetVersions(), 'start_time' : start / 1e6,
+                            'summary' : Summarise(trace_events)}}
+
+    with open(file_name, 'w') as f :
+        json.dump(trace, f)
+
+    return file_name
@@ -0,0 +1,156 @@
+import awkward as ak
+import numpy as np
+import uproot
+import Bootstrap
+import Definitions
+import StreamingLoader
+
+# Quick-look runs: the same outputs as a full run, from a seeded subsample of the events stratified by interaction type
+#   Every interaction type keeps the same fraction of its events, and its counts are scaled up by (events in the files / events read)
+#   (the count_scales the records and tables are written with), while its fractions and their uncertainties are those of the events read
+#   Events are taken a block at a time, the blocks being the PFPTree baskets (or clusters) in a seeded order, so only the baskets of the blocks
+#   taken are read. Events are independent, so the events of a few blocks are as good a sample as the same number scattered
+#   The same files, fraction and seed always give the same events, whatever the step size or number of workers
+
+default_seed = 0
+
+##############################################################################################
+##############################################################################################
+
+def GetBlockOffsets(file) :
+
+    # Entries where every branch of the biggest tree starts a new basket (TTree) or cluster (RNTuple), and num_entries
+    tree = file['PFPTree' if 'PFPTree' in file else 'EventTree']
+
+    if hasattr(tree, 'common_entry_offsets') :
+        return np.asarray(tree.common_entry_offsets(), dtype=np.int64)
+
+    cluster_starts = [cluster.num_first_entry for cluster in tree.cluster_summaries]
+
+    return np.array(cluster_starts + [tree.num_entries], dtype=np.int64)
+
+##############################################################################################
+##############################################################################################
+
+def SelectEntries(file_name, fraction, seed=default_seed) :
+
+    # The subsample's entries (sorted), the block offsets, and the events in the file and taken of each interaction type (last: none of them)
+    with uproot.open(file_name) as file :
+        event_branches = file['EventTree'].arrays(Bootstrap.event_id_branches + Definitions.mask_tree_branches['EventTree'], library='ak')
+        block_offsets = GetBlockOffsets(file)
+
+    int_codes = Definitions.GetCategoryCodes('int', event_branches).astype(np.int64)
+    n_events = len(int_codes)
+
+    # Each interaction type takes its events block by block, in a seeded block order, then a seeded event order within the last block
+    block_index = np.searchsorted(block_offsets, np.arange(n_events), side='right') - 1
+    block_keys = Bootstrap.SplitMix64(np.arange(len(block_offsets), dtype=np.uint64) ^ Bootstrap.SplitMix64(np.full(1, seed, dtype=np.uint64)))
+    order = np.lexsort((Bootstrap.GetEventKeys(event_branches, seed), block_keys[block_index], int_codes))
+
+    n_total = np.bincount(int_codes, minlength=len(Definitions.ints) + 1)
+    n_read = np.ceil(fraction * n_total).astype(np.int64)
+
+    rank = np.arange(n_events) - (np.cumsum(n_total) - n_total)[int_codes[order]]
+    entries = np.sort(order[rank < n_read[int_codes[order]]])
+
+    return entries, block_offsets, n_total, n_read
+
+##############################################################################################
+##############################################################################################
+
+def GetEntryRanges(entries, block_offsets, step_size=StreamingLoader.default_step_size) :
+
+    # (entry_start, entry_stop, entries kept counted from entry_start) for StreamingLoader.IterateChunks,
+    # over each run of adjacent blocks with entries taken, at most step_size entries at a time
+    blocks = np.unique(np.searchsorted(block_offsets, entries, side='right') - 1)
+    entry_ranges = []
+
+    for run in np.split(blocks, np.flatnonzero(np.diff(blocks) > 1) + 1) :
+        if len(run) == 0 :
+            continue
+
+        run_start, run_stop = int(block_offsets[run[0]]), int(block_offsets[run[-1] + 1])
+
+        for entry_start in range(run_start, run_stop, step_size) :
+            range_entries = entries[np.searchsorted(entries, entry_start) : np.searchsorted(entries, min(entry_start + step_size, run_stop))]
+            if len(range_entries) > 0 :
+                # Trimmed to the entries kept, the other trees' baskets past them aren't needed
+                entry_ranges.append((int(range_entries[0]), int(range_entries[-1]) + 1, range_entries - range_entries[0]))
+
+    return entry_ranges
+
+##############################################################################################
+##############################################################################################
+
+class QuickLookSample :
+    # The subsample of each file, selected when the file is first asked for
+    def __init__(self, fraction, seed=default_seed) :
+        if not (0.0 < fraction <= 1.0) :
+            raise ValueError(f'The quick-look fraction must be in (0, 1], got {fraction}')
+
+        self.fraction = fraction
+        self.seed = seed
+        self.selections = {}
+
+    def Select(self, file_name) :
+        if file_name not in self.selections :
+            self.selections[file_name] = SelectEntries(file_name, self.fraction, self.seed)
+        return self.selections[file_name]
+
+    def GetEntryRanges(self, file_name, step_size=StreamingLoader.default_step_size) :
+        entries, block_offsets = self.Select(file_name)[:2]
+        return GetEntryRanges(entries, block_offsets, step_size)
+
+    def GetEventCounts(self) :
+        # (events in the files, events read) of each interaction type, over the files selected so far
+        n_total = sum(selection[2] for selection in self.selections.values())
+        n_read = sum(selection[3] for selection in self.selections.values())
+        return n_total, n_read
+
+    def GetCountScales(self) :
+        n_total, n_read = self.GetEventCounts()
+        return {int_type : float(n_total[index]) / float(n_read[index]) if n_read[index] > 0 else 1.0 for index, int_type in enumerate(Definitions.ints)}
+
+    def PrintSummary(self) :
+
+        n_total, n_read = self.GetEventCounts()
+        count_scales = self.GetCountScales()
+
+        print(f'Quick look: {self.fraction} of the events, seed {self.seed}')
+
+        for index, int_type in enumerate(Definitions.ints) :
+            print(f' {Definitions.int_strings[int_type]:<10}| {int(n_read[index])} of {int(n_total[index])} events, counts x {count_scales[int_type]:.2f}')
+
+##############################################################################################
+##############################################################################################
+
+def GetCountScales(quick_look) :
+    # What the records and tables of a run are scaled by, None for a full run
+    return None if quick_look is None else quick_look.GetCountScales()
+
+##############################################################################################
+##############################################################################################
+
+def LoadTrees(file_name, tree_branches, fraction=None, seed=default_seed) :
+
+    # {tree_name : branches} for the notebooks, as StreamingLoader.CompactArrays(tree.arrays(...)),
+    # of every event (fraction None) or of a quick-look subsample, and the count_scales to write its tables with
+    quick_look = None if fraction is None else QuickLookSample(fraction, seed)
+    trees = {}
+
+    with uproot.open(file_name) as file :
+        entry_ranges = None if quick_look is None else quick_look.GetEntryRanges(file_name)
+
+        for tree_name, branches in tree_branches.items() :
+            tree = file[tree_name]
+            if entry_ranges is None :
+                arrays = tree.arrays(branches, library='ak')
+            else :
+                arrays = ak.to_packed(ak.concatenate([tree.arrays(branches, entry_start=entry_start, entry_stop=entry_stop, library='ak')[entries] \
+                                                      for entry_start, entry_stop, entries in entry_ranges]))
+            trees[tree_name] = StreamingLoader.CompactArrays(arrays)
+
+    if quick_look is not None :
+        quick_look.PrintSummary()
+
+    return trees, GetCountScales(quick_look)
@@ -0,0 +1,144 @@
+import copy
+import hashlib
+import os
+import pickle
+import Definitions
+
+# Per-file partial aggregates, tagged with the path and content hash of the file they came from, plus their running total:
+#   <store_dir>/<accumulators key>/results.pkl                 {'files' : {path : {'hash', 'size', 'mtime'}}, 'total' : accumulators}
+#   <store_dir>/<accumulators key>/partials/<partial key>.pkl  the accumulators filled from that file alone
+# The bootstrap replicas depend on the file's path (Bootstrap.GetFileKey) as well as its content, so the
+# partials are keyed on both: a moved file, or two copies of one file, each get their own
+
+# Bump when the meaning of the stored counts changes
+results_version = 4
+
+hash_block_bytes = 16 * 1024 ** 2
+
+##############################################################################################
+##############################################################################################
+
+def GetContentHash(file_name) :
+
+    content_hash = hashlib.sha1()
+
+    with open(file_name, 'rb') as f :
+        for block in iter(lambda : f.read(hash_block_bytes), b'') :
+            content_hash.update(block)
+
+    return content_hash.hexdigest()
+
+##############################################################################################
+##############################################################################################
+
+def GetPartialKey(path, content_hash) :
+    return hashlib.sha1(f'{os.path.abspath(path)}\0{content_hash}'.encode()).hexdigest()
+
+##############################################################################################
+##############################################################################################
+
+def GetAccumulatorsKey(accumulators) :
+    # Empty accumulators, so this only depends on what they fill (variables, binning, categories and their selections)
+    return hashlib.sha1(pickle.dumps((results_version, Definitions.category_registry, accumulators), protocol=4)).hexdigest()
+
+##############################################################################################
+##############################################################################################
+
+def SavePickle(path, obj) :
+
+    with open(f'{path}.tmp', 'wb') as f :
+        pickle.dump(obj, f, protocol=4)
+
+    os.replace(f'{path}.tmp', path)
+
+##############################################################################################
+##############################################################################################
+
+def LoadPickle(path) :
+    with open(path, 'rb') as f :
+        return pickle.load(f)
+
+##############################################################################################
+##############################################################################################
+
+class ResultsStore :
+    def __init__(self, store_dir, accumulators) :
+        self.path = os.path.join(store_dir, GetAccumulatorsKey(accumulators))
+        self.partials_dir = os.path.join(self.path, 'partials')
+        self.template = copy.deepcopy(accumulators)
+
+        results_path = os.path.join(self.path, 'results.pkl')
+        results = LoadPickle(results_path) if os.path.exists(results_path) else {'files' : {}, 'total' : copy.deepcopy(accumulators)}
+        self.files = results['files']
+        self.total = results['total']
+
+    def GetFileRecord(self, file_name) :
+
+        # Only rehash files whose size or modification time moved
+        stat = os.stat(file_name)
+        record = self.files.get(os.path.abspath(file_name))
+
+        if (record is not None) and (record['size'] == stat.st_size) and (record['mtime'] == stat.st_mtime_ns) :
+            return record
+
+        return {'hash' : GetContentHash(file_name), 'size' : stat.st_size, 'mtime' : stat.st_mtime_ns}
+
+    def GetStaleFiles(self, file_names) :
+
+        # Files that were added, or whose content changed, since the last update
+        self.records = {os.path.abspath(file_name) : self.GetFileRecord(file_name) for file_name in file_names}
+        stale = []
+
+        for file_name in file_names :
+            record = self.files.get(os.path.abspath(file_name))
+            if (record is None) or (record['hash'] != self.records[os.path.abspath(file_name)]['hash']) :
+                stale.append(file_name)
+
+        return stale
+
+    def GetPartialPath(self, path, content_hash) :
+        return os.path.join(self.partials_dir, f'{GetPartialKey(path, content_hash)}.pkl')
+
+    def LoadPartial(self, path, content_hash) :
+        return LoadPickle(self.GetPartialPath(path, content_hash))
+
+    def Update(self, file_names, partials) :
+
+        # partials : {file_name : accumulators} for each of GetStaleFiles(file_names)
+        os.makedirs(self.partials_dir, exist_ok=True)
+        new_files = {os.path.abspath(file_name) : self.records[os.path.abspath(file_name)] for file_name in file_names}
+
+        # Take out removed files and the old content of changed files, before their partials can be replaced
+        for path, record in self.files.items() :
+            if (path not in new_files) or (new_files[path]['hash'] != record['hash']) :
+                for accumulator, old in zip(self.total, self.LoadPartial(path, record['hash'])) :
+                    accumulator.Subtract(old)
+
+        # Then add the new content
+        for file_name, accumulators in partials.items() :
+            SavePickle(self.GetPartialPath(file_name, self.records[os.path.abspath(file_name)]['hash']), accumulators)
+            for accumulator, new in zip(self.total, accumulators) :
+                accumulator.Merge(new)
+
+        old_keys = {GetPartialKey(path, record['hash']) for path, record in self.files.items()}
+        self.files = new_files
+        SavePickle(os.path.join(self.path, 'results.pkl'), {'files' : self.files, 'total' : self.total})
+
+        # Partials no file refers to any more
+        for partial_key in old_keys - {GetPartialKey(path, record['hash']) for path, record in self.files.items()} :
+            os.remove(os.path.join(self.partials_dir, f'{partial_key}.pkl'))
+
+        return copy.deepcopy(self.total)
+
+    def Rebuild(self) :
+
+        # Recompute the total from the stored partials, e.g. if it's ever in doubt
+        self.total = copy.deepcopy(self.template)
+
+        for path, record in self.files.items() :
+            for accumulator, partial in zip(self.total, self.LoadPartial(path, record['hash'])) :
+                accumulator.Merge(partial)
+
+        SavePickle(os.path.join(self.path, 'results.pkl'), {'files' : self.files, 'total' : self.total})
+
+        return copy.deepcopy(self.total)
@@ -0,0 +1,310 @@
+import awkward as ak
+import collections
+import numpy as np
+import os
+import Definitions
+import FlatIndex
+import HistogramEngine
+import MetricRecords
+import Profiling
+import StreamingLoader
+
+# Relative to the working directory, batch runs pass their own (PandoraMetrics.py run --output)
+default_plot_dir = os.path.join('plots', 'cutflow', '')
+
+# Selections are lists of cuts over the flat PFP entries, applied in order, e.g.
+#   ['pdg:13', 'has_match', 'michel_target', 'michel_recod']
+#   '<axis>:<category>'  a category of Definitions (axis int, pdg or tier), from the category codes
+#   a name in cuts, or a BranchCut
+# Every prefix of a selection is a conjunction, kept as a packed bitset in a least recently used cache bounded in bytes,
+# so selections that start with the same cuts share them, and the counts after each cut (the cut flow) come for free
+
+default_max_cache_bytes = 64 * 1024 * 1024
+
+category_axes = {'int' : Definitions.ints, 'pdg' : Definitions.pdgs, 'tier' : Definitions.tiers}
+
+##############################################################################################
+##############################################################################################
+
+class BranchCut :
+    # Entries whose branch equals value, from a tree with one entry per PFP (PFPTree, TrackTree, HierarchyTree)
+    def __init__(self, tree_name, branch, value=1) :
+        self.tree_name = tree_name
+        self.branch = branch
+        self.value = value
+
+    def GetKey(self) :
+        return (self.tree_name, self.branch, self.value)
+
+    def GetName(self) :
+        return f'{self.branch}=={self.value}'
+
+    def Evaluate(self, selection) :
+        return selection.GetFlat(self.tree_name, self.branch) == self.value
+
+cuts = {
+    'has_match'     : BranchCut('PFPTree', 'MCP_HasMatch'),
+    'is_track'      : BranchCut('PFPTree', 'BM_IsTrack'),
+    'is_shower'     : BranchCut('PFPTree', 'BM_IsShower'),
+    'michel_target' : BranchCut('TrackTree', 'MCP_HasTargetMichel'),
+    'michel_recod'  : BranchCut('TrackTree', 'BM_IsMichelRecod')
+}
+
+# What CutFlowAccumulator fills unless told otherwise
+default_cut_flows = {
+    'reconstruction' : ['has_match'],
+    'michel'         : ['pdg:13', 'has_match', 'michel_target', 'michel_recod']
+}
+
+##############################################################################################
+##############################################################################################
+
+def GetCut(cut) :
+    return cuts[cut] if isinstance(cut, str) and (cut in cuts) else cut
+
+##############################################################################################
+##############################################################################################
+
+def GetCutKey(cut) :
+    # Named cuts and the BranchCut they stand for share one key, and so one cache entry
+    cut = GetCut(cut)
+    return cut if isinstance(cut, str) else cut.GetKey()
+
+##############################################################################################
+##############################################################################################
+
+def GetCutName(cut) :
+    return cut if isinstance(cut, str) else cut.GetName()
+
+##############################################################################################
+##############################################################################################
+
+def GetCutTreeBranches(selection_cuts) :
+
+    tree_branches = {}
+
+    for cut in selection_cuts :
+        cut = GetCut(cut)
+        if isinstance(cut, BranchCut) :
+            tree_branches = StreamingLoader.MergeTreeBranches(tree_branches, {cut.tree_name : [cut.branch]})
+
+    return tree_branches
+
+##############################################################################################
+##############################################################################################
+
+class Selection :
+    # The cuts of one chunk (or one notebook's in-memory branches), trees as {tree_name : branches}
+    def __init__(self, trees, int_masks, tier_masks, pdg_masks, max_cache_bytes=default_max_cache_bytes) :
+        self.trees = trees
+        self.int_masks = int_masks
+        self.codes = HistogramEngine.GetAxisCodes(int_masks, tier_masks, pdg_masks)
+        self.n_entries = len(self.codes['int'])
+        self.flat_trees = {}
+
+        # Prefix keys -> packed bitsets, least recently used first
+        self.cache = collections.OrderedDict()
+        self.cache_bytes = 0
+        self.max_cache_bytes = max_cache_bytes
+        self.n_evaluated = 0
+
+    def GetFlat(self, tree_name, branch) :
+        if tree_name not in self.flat_trees :
+            self.flat_trees[tree_name] = FlatIndex.GetFlatBranches(self.trees[tree_name])
+        return self.flat_trees[tree_name][branch]
+
+    def EvaluateCut(self, cut) :
+
+        self.n_evaluated += 1
+        cut = GetCut(cut)
+
+        if isinstance(cut, str) :
+            axis, category = cut.split(':')
+            categories = category_axes[axis]
+            return self.codes[axis] == categories.index(type(categories[0])(category))
+
+        return cut.Evaluate(self)
+
+    def Store(self, key, mask) :
+
+        packed = np.packbits(mask)
+
+        if packed.nbytes > self.max_cache_bytes :
+            return
+
+        self.cache[key] = packed
+        self.cache_bytes += packed.nbytes
+
+        while self.cache_bytes > self.max_cache_bytes :
+            self.cache_bytes -= self.cache.popitem(last=False)[1].nbytes
+
+    def Lookup(self, key) :
+
+        packed = self.cache.get(key)
+
+        if packed is None :
+            return None
+
+        self.cache.move_to_end(key)
+        return np.unpackbits(packed, count=self.n_entries).view(bool)
+
+    def GetMask(self, selection_cuts) :
+
+        # Flat bool mask of the entries passing every cut, from the longest cached prefix
+        keys = tuple(GetCutKey(cut) for cut in selection_cuts)
+
+        if len(keys) == 0 :
+            return np.ones(self.n_entries, dtype=bool)
+
+        n_cached = len(keys)
+        mask = self.Lookup(keys)
+
+        while (mask is None) and (n_cached > 1) :
+            n_cached -= 1
+            mask = self.Lookup(keys[:n_cached])
+
+        if mask is None :
+            n_cached = 0
+
+        for index in range(n_cached, len(keys)) :
+            # Single cuts are cached too, for selections that use them further down
+            cut_mask = self.Lookup(keys[index:index + 1])
+            if cut_mask is None :
+                cut_mask = self.EvaluateCut(selection_cuts[index])
+                self.Store(keys[index:index + 1], cut_mask)
+
+            mask = cut_mask if mask is None else mask & cut_mask
+            if index > 0 :
+                self.Store(keys[:index + 1], mask)
+
+        return mask
+
+    def GetJaggedMask(self, selection_cuts) :
+        # As the Definitions masks, for notebooks
+        counts = self.int_masks.counts if isinstance(self.int_masks, Definitions.CategoryMasks) else ak.num(self.int_masks[Definitions.ints[0]])
+        return ak.unflatten(self.GetMask(selection_cuts), counts)
+
+    def Count(self, selection_cuts) :
+        return int(np.count_nonzero(self.GetMask(selection_cuts)))
+
+    def GetCutFlow(self, selection_cuts) :
+
+        # (cut, int, pdg, tier) counts: every entry, then those left after each cut, the last int/pdg/tier index is 'none of them'
+        shape = (len(Definitions.ints) + 1, len(Definitions.pdgs) + 1, len(Definitions.tiers) + 1)
+        category_index = np.ravel_multi_index((self.codes['int'], self.codes['pdg'], self.codes['tier']), shape)
+        cut_flow = np.zeros((len(selection_cuts) + 1,) + shape, dtype=np.int64)
+        cut_flow[0] = np.bincount(category_index, minlength=cut_flow[0].size).reshape(shape)
+
+        for index in range(len(selection_cuts)) :
+            cut_flow[index + 1] = np.bincount(category_index[self.GetMask(selection_cuts[:index + 1])], minlength=cut_flow[0].size).reshape(shape)
+
+        return cut_flow
+
+##############################################################################################
+##############################################################################################
+
+class CutFlowAccumulator :
+    # counts[flow] : (cut, int, pdg, tier) as Selection.GetCutFlow, for each selection of cut_flows
+    def __init__(self, cut_flows=None, max_cache_bytes=default_max_cache_bytes) :
+        self.cut_flows = {name : list(selection_cuts) for name, selection_cuts in (default_cut_flows if cut_flows is None else cut_flows).items()}
+
+        # A flow's counts and tables are per cut, so one without any has nothing to show
+        empty_flows = [name for name, selection_cuts in self.cut_flows.items() if len(selection_cuts) == 0]
+        if len(empty_flows) > 0 :
+            raise ValueError(f'Cut flows need at least one cut, {empty_flows} have none')
+
+        self.max_cache_bytes = max_cache_bytes
+
+        shape = (len(Definitions.ints) + 1, len(Definitions.pdgs) + 1, len(Definitions.tiers) + 1)
+        self.counts = {name : np.zeros((len(selection_cuts) + 1,) + shape, dtype=np.int64) for name, selection_cuts in self.cut_flows.items()}
+
+        self.tree_branches = GetCutTreeBranches([cut for selection_cuts in self.cut_flows.values() for cut in selection_cuts])
+
+    def Fill(self, chunk, int_masks, tier_masks, pdg_masks) :
+        # One Selection for every flow, so flows that start the same share their cuts
+        selection = Selection(chunk, int_masks, tier_masks, pdg_masks, self.max_cache_bytes)
+
+        for name, selection_cuts in self.cut_flows.items() :
+            with Profiling.Stage(f'fill:cutflow:{name}') :
+                self.counts[name] += selection.GetCutFlow(selection_cuts)
+
+    def Merge(self, other) :
+        for name, counts in self.counts.items() :
+            counts += other.counts[name]
+        return self
+
+    def Subtract(self, other) :
+        for name, counts in self.counts.items() :
+            counts -= other.counts[name]
+        return self
+
+    def GetCount(self, name, index, int_type, pdg=None, tier=None) :
+        counts = self.counts[name][index, Definitions.ints.index(int_type)]
+        counts = counts.sum(axis=0) if pdg is None else counts[Definitions.pdgs.index(pdg)]
+        return int(counts[:len(Definitions.tiers)].sum() if tier is None else counts[Definitions.tiers.index(tier)])
+
+    def GetRecords(self, count_scales=None) :
+
+        # Each cut's count over the count before it
+        records = []
+
+        for name, selection_cuts in self.cut_flows.items() :
+            for int_type in Definitions.ints :
+                for pdg in Definitions.pdgs + [-1] :
+                    pdg_selection = None if pdg == -1 else pdg
+                    for tier in Definitions.tiers :
+                        for index, cut in enumerate(selection_cuts) :
+                            records.append(MetricRecords.MakeRecord(f'cutflow_{name}', int_type, pdg, tier, GetCutName(cut),
+                                                                    self.GetCount(name, index + 1, int_type, pdg_selection, tier), self.GetCount(name, index, int_type, pdg_selection, tier),
+                                                                    count_scales=count_scales))
+
+        return records
+
+##############################################################################################
+##############################################################################################
+
+def CalculateCutFlow(int_masks, tier_masks, pdg_masks, trees, cut_flows=None, count_scales=None, plot_dir=default_plot_dir) :
+
+    # trees : the notebook's {tree_name : branches}
+    accumulator = CutFlowAccumulator(cut_flows)
+    accumulator.Fill(trees, int_masks, tier_masks, pdg_masks)
+    WriteCutFlowTables(accumulator, count_scales, plot_dir)
+
+    return accumulator
+
+##############################################################################################
+##############################################################################################
+
+@Profiling.Profiled('table:cutflow')
+def WriteCutFlowTables(accumulator, count_scales=None, plot_dir=default_plot_dir) :
+
+    # Entries left after each cut, all PDGs, one column per tier, rendered from the records (scaled by count_scales for a quick look)
+    records = accumulator.GetRecords(count_scales)
+    indexed_records = MetricRecords.IndexRecords(records)
+    os.makedirs(plot_dir, exist_ok=True)
+
+    with open(f'{plot_dir}CutFlowTables.txt', "w") as f :
+        for name, selection_cuts in accumulator.cut_flows.items() :
+            cut_names = [GetCutName(cut) for cut in selection_cuts]
+            name_width = max(len(cut_name) for cut_name in ['all'] + cut_names) + 2
+            line = '-' * (name_width + 13 * (len(Definitions.tiers) + 1) + 1)
+
+            for int_type in Definitions.ints :
+                print(f'{name}: {Definitions.int_strings[int_type]}', file=f)
+                print(line, file=f)
+                print(f'{"":<{name_width}}|' + ''.join(f' {Definitions.tier_strings[tier]:>10} |' for tier in Definitions.tiers) + f' {"All":>10} |', file=f)
+                print(line, file=f)
+
+                cut_records = [[indexed_records[(f'cutflow_{name}', int_type, -1, tier, '', cut_name)] for tier in Definitions.tiers] for cut_name in cut_names]
+                rows = [('all', [record['n_total'] for record in cut_records[0]])] + [(cut_name, [record['n_pass'] for record in tier_records]) \
+                                                                                     for cut_name, tier_records in zip(cut_names, cut_records)]
+
+                for cut_name, entries in rows :
+                    print(f' {cut_name:<{name_width - 1}}|' + ''.join(f' {entry:>10} |' for entry in entries + [sum(entries)]), file=f)
+
+                print(line, file=f)
+                print('', file=f)
+
+    MetricRecords.WriteRecords(records, f'{plot_dir}CutFlowMetrics')
+
+    return records
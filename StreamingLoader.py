@@ -0,0 +1,287 @@
+import awkward as ak
+import numpy as np
+import os
+import queue
+import threading
+import uproot
+import Definitions
+import Profiling
+
+# Trees are written one entry per event, so the same entry range addresses the same event in each
+tree_names = ['EventTree', 'PFPTree', 'HierarchyTree', 'TrackTree']
+event_id_branches = ['Run', 'Subrun', 'Event']
+
+default_step_size = 5000
+
+# Chunks read ahead, on a background thread, of the one being filled (0 reads each branch when it is first used)
+# and the threads uproot decompresses and interprets their baskets with (more than the cores only adds overhead)
+default_n_prefetch = 1
+default_n_io_threads = min(4, os.cpu_count() or 1)
+
+# Compact in-memory dtypes, whatever the on-disk ones: flags and tiers int8, PDG codes, hit counts and indices int32,
+# and every floating point branch (the kinematics, completeness, purity...) float32. Other branches keep their dtype
+compact_dtypes = {}
+compact_dtypes.update({branch : np.int8 for branch in ['MCInt_IsCC', 'MCP_HasMatch', 'BM_IsTrack', 'BM_IsShower', 'MC_HierarchyTier', 'BM_HierarchyTier',
+                                                       'MCP_HasMichel', 'MCP_HasTargetMichel', 'BM_IsMichelRecod', 'BM_MichelIsChild', 'BM_MichelIsShower']})
+compact_dtypes.update({branch : np.int32 for branch in event_id_branches + ['MCNu_PDG', 'MCP_TruePDG', 'MCP_NMCHits2D', 'MC_ParentIndex', 'BM_ParentIndex', 'BM_MichelIndex']})
+
+##############################################################################################
+##############################################################################################
+
+def MergeTreeBranches(*tree_branch_dicts) :
+
+    merged = {}
+
+    for tree_branches in tree_branch_dicts :
+        for tree_name, branches in tree_branches.items() :
+            merged_branches = merged.setdefault(tree_name, [])
+            for branch in branches :
+                if branch not in merged_branches :
+                    merged_branches.append(branch)
+
+    return merged
+
+##############################################################################################
+##############################################################################################
+
+def PlanBranches(accumulators) :
+    # The minimal set of branches per tree for the requested outputs
+    return MergeTreeBranches(Definitions.mask_tree_branches, *[accumulator.tree_branches for accumulator in accumulators])
+
+##############################################################################################
+##############################################################################################
+
+class LazyTreeBranches :
+    # Reads each planned branch on first use, so outputs that aren't touched cost no I/O
+    def __init__(self, tree, branches, entry_start=None, entry_stop=None, entries=None, file_name=None) :
+        self.tree = tree
+        self.branches = list(branches)
+        self.entry_start = 0 if entry_start is None else entry_start
+        self.entry_stop = tree.num_entries if entry_stop is None else entry_stop
+        self.arrays = {}
+
+        # Entries kept from those read, counted from entry_start, None for all of them (see QuickLook)
+        self.entries = entries
+
+        # Which file the entries come from, so events of different files with the same IDs are told apart (see Bootstrap)
+        self.file_name = file_name
+
+    def Select(self, array) :
+        return array if self.entries is None else ak.to_packed(array[self.entries])
+
+    def __getitem__(self, branch) :
+        if branch not in self.arrays :
+            if branch not in self.branches :
+                raise KeyError(f'{branch} is not in the planned {self.tree.name} branches {self.branches}, declare it in the tree_branches of the output that reads it')
+            with Profiling.Stage('load', tree=self.tree.name, branch=branch, entry_start=self.entry_start) :
+                self.arrays[branch] = self.Select(CompactBranch(branch, self.tree[branch].array(entry_start=self.entry_start, entry_stop=self.entry_stop, library="ak")))
+        return self.arrays[branch]
+
+    def __contains__(self, branch) :
+        return branch in self.branches
+
+    def Load(self, decompression_executor=None, interpretation_executor=None) :
+        # Every planned branch not read yet, in one call so uproot can decompress their baskets in parallel
+        tree_keys = set(self.tree.keys())
+        branches = [branch for branch in self.branches if (branch not in self.arrays) and (branch in tree_keys)]
+
+        if len(branches) > 0 :
+            with Profiling.Stage('load', tree=self.tree.name, entry_start=self.entry_start) :
+                arrays = self.tree.arrays(branches, entry_start=self.entry_start, entry_stop=self.entry_stop, decompression_executor=decompression_executor,
+                                          interpretation_executor=interpretation_executor, library="ak")
+            for branch in branches :
+                self.arrays[branch] = self.Select(CompactBranch(branch, arrays[branch]))
+
+        return self
+
+    def __len__(self) :
+        return self.entry_stop - self.entry_start if self.entries is None else len(self.entries)
+
+    def keys(self) :
+        return list(self.branches)
+
+##############################################################################################
+##############################################################################################
+
+def GetLeafDtype(layout) :
+
+    # The dtype of the numbers under any list (or option) nesting, without copying them out
+    while not isinstance(layout, ak.contents.NumpyArray) :
+        layout = layout.content
+
+    return layout.dtype
+
+##############################################################################################
+##############################################################################################
+
+def CompactBranch(branch, array) :
+
+    dtype = GetLeafDtype(array.layout)
+    compact_dtype = compact_dtypes.get(branch, np.float32 if dtype.kind == 'f' else dtype)
+
+    return array if dtype == compact_dtype else ak.values_astype(array, compact_dtype)
+
+##############################################################################################
+##############################################################################################
+
+def CompactArrays(arrays) :
+
+    # A whole tree.arrays(...) result, for notebooks that load the file in one go
+    # The particle branches of a tree have the same counts, so they also share one offsets buffer rather than one each
+    compact = {}
+    shared_offsets = None
+
+    for branch in arrays.fields :
+        layout = CompactBranch(branch, arrays[branch]).layout
+        if isinstance(layout, ak.contents.ListOffsetArray) :
+            if shared_offsets is None :
+                shared_offsets = layout.offsets
+            elif np.array_equal(layout.offsets.data, shared_offsets.data) :
+                layout = ak.contents.ListOffsetArray(shared_offsets, layout.content)
+        compact[branch] = ak.Array(layout)
+
+    return ak.zip(compact, depth_limit=1)
+
+##############################################################################################
+##############################################################################################
+
+def LoadBranches(file_name, accumulators) :
+
+    file = uproot.open(file_name)
+    tree_branches = PlanBranches(accumulators)
+
+    return {tree_name : LazyTreeBranches(file[tree_name], branches, file_name=file_name) for tree_name, branches in tree_branches.items()}
+
+##############################################################################################
+##############################################################################################
+
+def GetNEntries(trees) :
+
+    n_entries = {tree_name : tree.num_entries for tree_name, tree in trees.items()}
+
+    if len(set(n_entries.values())) > 1 :
+        raise ValueError(f'Trees have different numbers of entries: {n_entries}')
+
+    return next(iter(n_entries.values()))
+
+##############################################################################################
+##############################################################################################
+
+def CheckChunkAlignment(id_branches, entry_start) :
+
+    ref_tree_name = next(iter(id_branches))
+    ref_ids = id_branches[ref_tree_name]
+
+    for tree_name, ids in id_branches.items() :
+        misaligned = np.zeros(len(ids), dtype=bool)
+
+        for branch in event_id_branches :
+            misaligned |= (ak.to_numpy(ids[branch]) != ak.to_numpy(ref_ids[branch]))
+
+        if np.any(misaligned) :
+            first_entry = entry_start + int(np.argmax(misaligned))
+            raise ValueError(f'{tree_name} is not aligned with {ref_tree_name} at entry {first_entry}')
+
+##############################################################################################
+##############################################################################################
+
+def IterateChunks(file_name, tree_branches, step_size=default_step_size, entry_ranges=None) :
+
+    # entry_ranges : (entry_start, entry_stop, entries kept or None) to read instead of every entry in steps, e.g. QuickLook's
+    with uproot.open(file_name) as file :
+
+        trees = {tree_name : file[tree_name] for tree_name in tree_branches}
+        n_entries = GetNEntries(trees)
+
+        # Only trees that carry Run/Subrun/Event can be checked
+        id_trees = {tree_name : tree for tree_name, tree in trees.items() if all(branch in tree.keys() for branch in event_id_branches)}
+
+        if entry_ranges is None :
+            entry_ranges = [(entry_start, min(entry_start + step_size, n_entries), None) for entry_start in range(0, n_entries, step_size)]
+
+        for entry_start, entry_stop, entries in entry_ranges :
+
+            if len(id_trees) > 1 :
+                with Profiling.Stage('load:alignment', entry_start=entry_start) :
+                    id_branches = {tree_name : tree.arrays(event_id_branches, entry_start=entry_start, entry_stop=entry_stop, library="ak") \
+                                   for tree_name, tree in id_trees.items()}
+                    CheckChunkAlignment(id_branches, entry_start)
+
+            chunk = {tree_name : LazyTreeBranches(trees[tree_name], branches, entry_start, entry_stop, entries, file_name) \
+                     for tree_name, branches in tree_branches.items()}
+
+            yield chunk
+
+##############################################################################################
+##############################################################################################
+
+def PrefetchChunks(chunks, n_prefetch=default_n_prefetch, n_io_threads=default_n_io_threads) :
+
+    # Reads chunk N+1 on a background thread while chunk N is filled, so the time per file is closer to max(I/O, compute)
+    # than their sum. At most n_prefetch read chunks wait in the queue, which caps the memory
+    if n_prefetch <= 0 :
+        yield from chunks
+        return
+
+    read_chunks = queue.Queue(maxsize=n_prefetch)
+    stop = threading.Event()
+    end = object()
+
+    def Put(item) :
+        # Gives up once the consumer has stopped, rather than waiting on a full queue forever
+        while not stop.is_set() :
+            try :
+                read_chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full :
+                pass
+        return False
+
+    def Read() :
+        decompression_executor = uproot.ThreadPoolExecutor(n_io_threads)
+        interpretation_executor = uproot.ThreadPoolExecutor(n_io_threads)
+        try :
+            for chunk in chunks :
+                for tree_branches in chunk.values() :
+                    tree_branches.Load(decompression_executor, interpretation_executor)
+                if not Put(chunk) :
+                    return
+            Put(end)
+        except BaseException as error :
+            Put(error)
+        finally :
+            chunks.close()
+            decompression_executor.shutdown()
+            interpretation_executor.shutdown()
+
+    reader = threading.Thread(target=Read, name='PrefetchChunks', daemon=True)
+    reader.start()
+
+    try :
+        while True :
+            item = read_chunks.get()
+            if item is end :
+                return
+            if isinstance(item, BaseException) :
+                raise item
+            yield item
+    finally :
+        stop.set()
+        reader.join()
+
+##############################################################################################
+##############################################################################################
+
+def RunStreaming(file_name, accumulators, step_size=default_step_size, n_prefetch=default_n_prefetch, entry_ranges=None) :
+
+    for chunk in PrefetchChunks(IterateChunks(file_name, PlanBranches(accumulators), step_size, entry_ranges), n_prefetch) :
+
+        int_masks = Definitions.GetIntMasks(chunk['EventTree'], chunk['PFPTree'])
+        pdg_masks = Definitions.GetPDGMasks(chunk['PFPTree'])
+        tier_masks = Definitions.GetTierMasks(chunk['HierarchyTree'])
+
+        for accumulator in accumulators :
+            with Profiling.Stage(f'fill:{type(accumulator).__name__}', entry_start=chunk['EventTree'].entry_start) :
+                accumulator.Fill(chunk, int_masks, tier_masks, pdg_masks)
+
+    return accumulators
@@ -0,0 +1,155 @@
+import awkward as ak
+import numpy as np
+import os
+
+# Truth PDGs drawn for synthetic MCParticles, with some that fall outside Definitions.pdgs
+synthetic_pdgs = np.array([13, -13, 2212, 211, -211, 22, 11, -11, 2112, 321])
+synthetic_pdg_probs = np.array([0.12, 0.03, 0.25, 0.1, 0.1, 0.2, 0.05, 0.03, 0.08, 0.04])
+
+# (branch, low, high) of the uniform kinematic branches
+pfp_float_branches = [('MCP_TrueEnergy', 0.0, 3.5), ('MCP_TrueThetaXZ', -3.5, 3.5), ('MCP_TrueThetaYZ', -1.7, 1.7),
+                      ('MCP_Length', 0.0, 300.0), ('MCP_Displacement', 0.0, 30.0),
+                      ('BM_Completeness', 0.0, 1.0), ('BM_CompletenessU', 0.0, 1.0), ('BM_CompletenessV', 0.0, 1.0), ('BM_CompletenessW', 0.0, 1.0),
+                      ('BM_Purity', 0.0, 1.0), ('BM_PurityU', 0.0, 1.0), ('BM_PurityV', 0.0, 1.0), ('BM_PurityW', 0.0, 1.0),
+                      ('BM_VertexAcc', -60.0, 60.0), ('BM_Length', 0.0, 300.0), ('BM_Displacement', 0.0, 30.0)]
+
+##############################################################################################
+##############################################################################################
+
+def GenerateHierarchy(rng, n_events, mean_pfps, max_depth, child_rate=0.6) :
+
+    # Primaries per event, then each particle spawns Poisson(child_rate) children, tier by tier
+    mean_primaries = mean_pfps / sum(child_rate ** depth for depth in range(max_depth))
+    tier_events = [np.repeat(np.arange(n_events), rng.poisson(mean_primaries, n_events))]
+    tier_parents = [np.full(len(tier_events[0]), -1)]
+    n_previous = 0
+
+    for depth in range(1, max_depth) :
+        n_children = rng.poisson(child_rate, len(tier_events[-1]))
+        tier_parents.append(np.repeat(n_previous + np.arange(len(tier_events[-1])), n_children))
+        tier_events.append(np.repeat(tier_events[-1], n_children))
+        n_previous += len(tier_events[-2])
+
+    event = np.concatenate(tier_events)
+    parent = np.concatenate(tier_parents)
+    tier = np.concatenate([np.full(len(events), depth + 1) for depth, events in enumerate(tier_events)])
+
+    # Group by event (stable, so parents stay ahead of their children) and make parent indices event-local
+    order = np.argsort(event, kind='stable')
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    counts = np.bincount(event, minlength=n_events)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    event = event[order]
+    parent = parent[order]
+    tier = tier[order]
+    has_parent = parent >= 0
+    parent[has_parent] = position[parent[has_parent]] - offsets[event[has_parent]]
+
+    return counts, offsets, event, tier, parent
+
+##############################################################################################
+##############################################################################################
+
+def GenerateTrees(n_events, mean_pfps=10, max_depth=4, seed=0, event_offset=0) :
+
+    rng = np.random.default_rng(seed)
+    counts, offsets, event, tier, parent = GenerateHierarchy(rng, n_events, mean_pfps, max_depth)
+    n_pfp = len(event)
+    local_index = np.arange(n_pfp) - offsets[event]
+
+    def Jagged(values) :
+        return ak.unflatten(values, counts)
+
+    run = np.ones(n_events, dtype=np.int32)
+    event_number = np.arange(event_offset, event_offset + n_events, dtype=np.int32)
+    subrun = (event_number // 100).astype(np.int32)
+    event_ids = {'Run' : run, 'Subrun' : subrun, 'Event' : event_number}
+
+    # Truth
+    pdg = rng.choice(synthetic_pdgs, n_pfp, p=synthetic_pdg_probs).astype(np.int32)
+    has_match = (rng.random(n_pfp) < 0.8).astype(np.int32)
+
+    # Reco, mostly right
+    is_track = np.where(has_match == 1, (rng.random(n_pfp) < 0.6), -1).astype(np.int32)
+    is_shower = np.where(has_match == 1, 1 - is_track, -1).astype(np.int32)
+    bm_tier = np.where(has_match == 1, np.where(rng.random(n_pfp) < 0.8, tier, rng.integers(1, max_depth + 1, n_pfp)), -1)
+    bm_parent = np.where((has_match == 1) & (bm_tier != 1), np.where(rng.random(n_pfp) < 0.8, parent, -1), -1)
+    bm_parent = np.where((bm_parent == -1) & (bm_tier > 1) & (local_index > 0) & (rng.random(n_pfp) < 0.3), 0, bm_parent)
+
+    # Michels hang off muons
+    is_muon = (np.abs(pdg) == 13) & (counts[event] > 1)
+    has_michel = (is_muon & (rng.random(n_pfp) < 0.6)).astype(np.int32)
+    michel_index = np.where(has_michel == 1, rng.integers(0, np.maximum(counts[event], 1)), -1).astype(np.int32)
+    michel_recod = np.where(has_michel == 1, rng.random(n_pfp) < 0.7, 0).astype(np.int32)
+
+    trees = {}
+    trees['EventTree'] = dict(event_ids,
+                              MCInt_IsCC=(rng.random(n_events) < 0.7).astype(np.int32),
+                              MCNu_PDG=rng.choice([14, -14, 12, -12], n_events).astype(np.int32))
+
+    pfp = dict(event_ids,
+               MCP_TruePDG=Jagged(pdg), MCP_HasMatch=Jagged(has_match),
+               MCP_NMCHits2D=Jagged(rng.integers(0, 3500, n_pfp).astype(np.int32)),
+               BM_IsTrack=Jagged(is_track), BM_IsShower=Jagged(is_shower))
+
+    for branch, low, high in pfp_float_branches :
+        values = rng.uniform(low, high, n_pfp).astype(np.float32)
+        if branch.startswith('BM_') :
+            values = np.where(has_match == 1, values, -999.0).astype(np.float32)
+        pfp[branch] = Jagged(values)
+
+    trees['PFPTree'] = pfp
+    trees['HierarchyTree'] = dict(event_ids,
+                                  MC_HierarchyTier=Jagged(tier.astype(np.int32)), MC_ParentIndex=Jagged(parent.astype(np.int32)),
+                                  BM_HierarchyTier=Jagged(bm_tier.astype(np.int32)), BM_ParentIndex=Jagged(bm_parent.astype(np.int32)))
+    trees['TrackTree'] = dict(event_ids,
+                              MCP_HasMichel=Jagged(has_michel), MCP_HasTargetMichel=Jagged(has_michel),
+                              BM_IsMichelRecod=Jagged(michel_recod), BM_MichelIndex=Jagged(michel_index),
+                              BM_MichelIsChild=Jagged(michel_recod), BM_MichelIsShower=Jagged(michel_recod))
+
+    return trees
+
+##############################################################################################
+##############################################################################################
+
+def WriteSyntheticFile(file_name, n_events, mean_pfps=10, max_depth=4, seed=0, events_per_basket=50000) :
+
+    import uproot
+
+    # Written in baskets, like a real file, so that chunked reading is realistic
+    with uproot.recreate(file_name) as file :
+        for i_basket, entry_start in enumerate(range(0, n_events, events_per_basket)) :
+            n_basket_events = min(events_per_basket, n_events - entry_start)
+            trees = GenerateTrees(n_basket_events, mean_pfps, max_depth, seed + i_basket, entry_start)
+
+            for tree_name, branches in trees.items() :
+                # TTrees, as the validation files are, rather than uproot's default RNTuple
+                if i_basket == 0 :
+                    file.mktree(tree_name, {branch : (values.type.content if isinstance(values, ak.Array) else values.dtype) \
+                                            for branch, values in branches.items()})
+                file[tree_name].extend(branches)
+
+    return file_name
+
+##############################################################################################
+##############################################################################################
+
+def WriteSyntheticParquet(output_dir, n_events, mean_pfps=10, max_depth=4, seed=0) :
+
+    # One file per tree, e.g. for when uproot can't write
+    os.makedirs(output_dir, exist_ok=True)
+    trees = GenerateTrees(n_events, mean_pfps, max_depth, seed)
+
+    for tree_name, branches in trees.items() :
+        ak.to_parquet(ak.zip(branches, depth_limit=1), os.path.join(output_dir, f'{tree_name}.parquet'))
+
+    return output_dir
+
+##############################################################################################
+##############################################################################################
+
+def ReadSyntheticParquet(output_dir, tree_branches) :
+    return {tree_name : ak.from_parquet(os.path.join(output_dir, f'{tree_name}.parquet'), columns=branches) \
+            for tree_name, branches in tree_branches.items()}
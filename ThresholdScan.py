@@ -0,0 +1,248 @@
+import numpy as np
+import os
+import Definitions
+import FlatIndex
+import HistogramEngine
+import MetricRecords
+import Profiling
+
+# Relative to the working directory, batch runs pass their own (PandoraMetrics.py run --output)
+default_plot_dir = os.path.join('plots', 'thresholds', '')
+
+# Completeness and purity branches of each plane, '' for the three planes together
+threshold_planes = {
+    ''  : ('BM_Completeness', 'BM_Purity'),
+    'U' : ('BM_CompletenessU', 'BM_PurityU'),
+    'V' : ('BM_CompletenessV', 'BM_PurityV'),
+    'W' : ('BM_CompletenessW', 'BM_PurityW')
+}
+
+default_n_bins = 100
+
+# Working points (the same completeness and purity threshold) in the text tables, and the contours drawn on the maps
+table_thresholds = [0.0, 0.1, 0.5, 0.8, 0.9]
+map_levels = [0.5, 0.8, 0.9]
+
+##############################################################################################
+##############################################################################################
+
+class ThresholdScanEngine :
+    # Efficiency and track/shower classification for every pair of completeness and purity thresholds, from one fill
+    # counts[plane] : (int, pdg, tier, reco_class, completeness slot, purity slot) for every true particle
+    #   slot 0 holds the particles without a best match (or without hits in that plane), slot i > 0 the values in bin i - 1
+    # A particle passes the thresholds (thresholds[k_c], thresholds[k_p]) when its slots are above k_c and k_p,
+    # so reverse cumulative sums over the two slot axes give the passing counts of every threshold pair at once
+    def __init__(self, planes=('',), n_bins=default_n_bins) :
+        self.planes = list(planes)
+        self.n_bins = n_bins
+        self.edges = np.linspace(0.0, 1.0, n_bins + 1)
+        self.thresholds = self.edges[:-1]
+
+        # Enough decimals in the record options to tell every threshold apart, 2 up to 100 bins
+        self.threshold_digits = max(2, int(np.ceil(np.log10(n_bins))))
+
+        shape = (len(Definitions.ints) + 1, len(Definitions.pdgs) + 1, len(Definitions.tiers) + 1, len(HistogramEngine.reco_classes), n_bins + 1, n_bins + 1)
+        self.counts = {plane : np.zeros(shape, dtype=np.int64) for plane in self.planes}
+
+        self.tree_branches = {'PFPTree' : ['MCP_HasMatch', 'BM_IsTrack', 'BM_IsShower'] + [branch for plane in self.planes for branch in threshold_planes[plane]]}
+
+    def GetSlots(self, values, has_match) :
+        # Values outside [0, 1] (e.g. the -999 of particles without a match) and NaN pass no threshold
+        bin_indices = HistogramEngine.GetBinIndices(values, self.edges)
+        return np.where(has_match & (bin_indices <= self.n_bins), bin_indices, 0)
+
+    def Fill(self, chunk, int_masks, tier_masks, pdg_masks) :
+        pfp_flat = FlatIndex.GetFlatBranches(chunk['PFPTree'])
+        codes = HistogramEngine.GetCategoryCodes(int_masks, tier_masks, pdg_masks, chunk['PFPTree'])
+
+        category_index = codes['int'].astype(np.int64)
+        category_index = category_index * (len(Definitions.pdgs) + 1) + codes['pdg']
+        category_index = category_index * (len(Definitions.tiers) + 1) + codes['tier']
+        category_index = category_index * len(HistogramEngine.reco_classes) + codes['reco_class']
+        has_match = codes['has_match'] == 1
+        n_slots = self.n_bins + 1
+
+        for plane, counts in self.counts.items() :
+            with Profiling.Stage(f'fill:threshold_scan{plane}') :
+                completeness_branch, purity_branch = threshold_planes[plane]
+                key = (category_index * n_slots + self.GetSlots(pfp_flat[completeness_branch], has_match)) * n_slots + self.GetSlots(pfp_flat[purity_branch], has_match)
+                counts += np.bincount(key, minlength=counts.size).reshape(counts.shape)
+
+    def Merge(self, other) :
+        for plane, counts in self.counts.items() :
+            counts += other.counts[plane]
+        return self
+
+    def Subtract(self, other) :
+        for plane, counts in self.counts.items() :
+            counts -= other.counts[plane]
+        return self
+
+    def Project(self, plane='', int_type=None, pdg=None, tier=None, reco_class=None) :
+        # (slot, slot) counts, summed over the category axes that weren't fixed
+        indices = (slice(None) if int_type is None else Definitions.ints.index(int_type),
+                   slice(None) if pdg is None else Definitions.pdgs.index(pdg),
+                   slice(None) if tier is None else Definitions.tiers.index(tier),
+                   slice(None) if reco_class is None else reco_class)
+        projected = self.counts[plane][indices]
+        return projected.reshape((-1,) + projected.shape[-2:]).sum(axis=0)
+
+    def GetPassCounts(self, plane='', int_type=None, pdg=None, tier=None, reco_class=None) :
+        # (n_bins, n_bins) particles with completeness >= thresholds[k_c] and purity >= thresholds[k_p]
+        slots = self.Project(plane, int_type, pdg, tier, reco_class)[1:, 1:]
+        return np.flip(np.flip(slots, (0, 1)).cumsum(axis=0).cumsum(axis=1), (0, 1))
+
+    def GetEfficiencyMap(self, plane='', int_type=None, pdg=None, tier=None) :
+        # Passing particles over all true particles, and the counts behind it
+        n_pass = self.GetPassCounts(plane, int_type, pdg, tier)
+        n_total = self.Project(plane, int_type, pdg, tier).sum()
+        return np.divide(n_pass, n_total, out=np.zeros(n_pass.shape), where=n_total > 0), n_pass, n_total
+
+    def GetClassificationMap(self, reco_class, plane='', int_type=None, pdg=None, tier=None) :
+        # Of the passing particles, the fraction classified as reco_class (1 track, 2 shower), i.e. the confusion matrix entry
+        n_class = self.GetPassCounts(plane, int_type, pdg, tier, reco_class)
+        n_pass = self.GetPassCounts(plane, int_type, pdg, tier)
+        return np.divide(n_class, n_pass, out=np.zeros(n_pass.shape), where=n_pass > 0), n_class, n_pass
+
+    def GetRecords(self, count_scales=None) :
+
+        # The completeness scan (no purity threshold) and the purity scan (no completeness threshold), one record per threshold
+        records = []
+
+        for plane in self.planes :
+            for int_type in Definitions.ints :
+                for pdg in Definitions.pdgs + [-1] :
+                    pdg_selection = None if pdg == -1 else pdg
+                    for tier in Definitions.tiers :
+                        _, n_pass, n_total = self.GetEfficiencyMap(plane, int_type, pdg_selection, tier)
+                        _, n_track, n_reco = self.GetClassificationMap(1, plane, int_type, pdg_selection, tier)
+                        n_shower = self.GetPassCounts(plane, int_type, pdg_selection, tier, 2)
+
+                        for branch, scan in zip(threshold_planes[plane], [np.s_[:, 0], np.s_[0, :]]) :
+                            for threshold, n_pass_cut, n_track_cut, n_shower_cut, n_reco_cut in zip(self.thresholds, n_pass[scan], n_track[scan], n_shower[scan], n_reco[scan]) :
+                                option = f'{branch}>={threshold:.{self.threshold_digits}f}'
+                                records.append(MetricRecords.MakeRecord('threshold_efficiency', int_type, pdg, tier, 'Reco', n_pass_cut, n_total, option, count_scales=count_scales))
+                                records.append(MetricRecords.MakeRecord('threshold_track_shower', int_type, pdg, tier, 'Track', n_track_cut, n_reco_cut, option, count_scales=count_scales))
+                                records.append(MetricRecords.MakeRecord('threshold_track_shower', int_type, pdg, tier, 'Shower', n_shower_cut, n_reco_cut, option, count_scales=count_scales))
+
+        return records
+
+##############################################################################################
+##############################################################################################
+
+def GetThresholdIndex(engine, threshold) :
+    return int(np.searchsorted(engine.thresholds, threshold - 1e-9))
+
+##############################################################################################
+##############################################################################################
+
+@Profiling.Profiled('table:threshold_scan')
+def WriteThresholdScanTables(engine, count_scales=None, plot_dir=default_plot_dir) :
+
+    # Efficiency at each working point of table_thresholds, all PDGs
+    os.makedirs(plot_dir, exist_ok=True)
+
+    for plane in engine.planes :
+        with open(f'{plot_dir}ThresholdScanTables{plane}.txt', "w") as f :
+            for int_type in Definitions.ints :
+                print(f'{Definitions.int_strings[int_type]}', file=f)
+                print('-' * (13 + 8 * len(table_thresholds)), file=f)
+                print(' Thresholds |' + ''.join(f'  {threshold:.2f} |' for threshold in table_thresholds), file=f)
+                print('-' * (13 + 8 * len(table_thresholds)), file=f)
+
+                for tier in Definitions.tiers :
+                    efficiency = engine.GetEfficiencyMap(plane, int_type, None, tier)[0]
+                    entries = [efficiency[GetThresholdIndex(engine, threshold), GetThresholdIndex(engine, threshold)] for threshold in table_thresholds]
+                    print(f' {Definitions.tier_strings[tier]:<10} |' + ''.join(f'  {entry:.2f} |' for entry in entries), file=f)
+
+                print('-' * (13 + 8 * len(table_thresholds)), file=f)
+                print('', file=f)
+
+    records = engine.GetRecords(count_scales)
+    MetricRecords.WriteRecords(records, f'{plot_dir}ThresholdScanMetrics')
+
+    return records
+
+##############################################################################################
+##############################################################################################
+
+def GetScanPanel(iInt, iPDG, tier, x_label, y_label, title) :
+    # As PFPValidationFunc.GetGridPanel, iInt and iPDG are positions in Definitions.ints and Definitions.pdgs
+    int_type = Definitions.ints[iInt]
+    is_x_label_index = iInt == (len(Definitions.ints) - 1)
+    is_y_label_index = (iPDG == 0)
+
+    return {'row' : iInt, 'col' : iPDG,
+            'xlabel' : x_label if is_x_label_index else '',
+            'ylabel' : y_label if is_y_label_index else '',
+            'title' : f'{Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]} {title}',
+            'tick_params' : {'labelbottom' : is_x_label_index, 'bottom' : is_x_label_index, 'labelleft' : is_y_label_index, 'left' : is_y_label_index}}
+
+##############################################################################################
+##############################################################################################
+
+def GetBinomialUncertainty(fraction, n_total) :
+    uncertainty = np.zeros_like(fraction)
+    valid = n_total > 0
+    uncertainty[valid] = np.sqrt(fraction[valid] * (1.0 - fraction[valid]) / n_total[valid])
+    return uncertainty
+
+##############################################################################################
+##############################################################################################
+
+def BuildThresholdScanFigures(engine, plot_dir=default_plot_dir) :
+
+    figures = []
+
+    for plane in engine.planes :
+        completeness_branch, purity_branch = threshold_planes[plane]
+
+        for tier in Definitions.tiers :
+            curve_panels = []
+            class_panels = []
+            efficiency_panels = []
+            track_panels = []
+
+            for iInt, int_type in enumerate(Definitions.ints) :
+                for iPDG, pdg in enumerate(Definitions.pdgs) :
+                    pdg_string = Definitions.pdg_strings[pdg]
+                    colour = Definitions.pdg_color[pdg]
+
+                    efficiency, _, n_total = engine.GetEfficiencyMap(plane, int_type, pdg, tier)
+                    track_fraction, _, n_pass = engine.GetClassificationMap(1, plane, int_type, pdg, tier)
+                    shower_fraction = engine.GetClassificationMap(2, plane, int_type, pdg, tier)[0]
+                    n_total = np.full(len(engine.thresholds), n_total)
+
+                    # Efficiency curves, one threshold at a time
+                    panel = GetScanPanel(iInt, iPDG, tier, 'Threshold', 'Efficiency', pdg_string)
+                    panel['series'] = [{'type' : 'errorbar', 'x' : engine.thresholds, 'y' : efficiency[:, 0], 'yerr' : GetBinomialUncertainty(efficiency[:, 0], n_total),
+                                        'kwargs' : {'color' : colour, 'linestyle' : 'solid', 'label' : 'Completeness'}},
+                                       {'type' : 'errorbar', 'x' : engine.thresholds, 'y' : efficiency[0, :], 'yerr' : GetBinomialUncertainty(efficiency[0, :], n_total),
+                                        'kwargs' : {'color' : colour, 'linestyle' : 'dashed', 'label' : 'Purity'}}]
+                    curve_panels.append(panel)
+
+                    # Track/shower classification against the completeness threshold
+                    panel = GetScanPanel(iInt, iPDG, tier, 'Completeness Threshold', 'Fraction', pdg_string)
+                    panel['series'] = [{'type' : 'errorbar', 'x' : engine.thresholds, 'y' : shower_fraction[:, 0], 'yerr' : GetBinomialUncertainty(shower_fraction[:, 0], n_pass[:, 0]),
+                                        'kwargs' : {'marker' : 'x', 'capsize' : 2, 'label' : 'Shower'}},
+                                       {'type' : 'errorbar', 'x' : engine.thresholds, 'y' : track_fraction[:, 0], 'yerr' : GetBinomialUncertainty(track_fraction[:, 0], n_pass[:, 0]),
+                                        'kwargs' : {'marker' : 'x', 'capsize' : 2, 'label' : 'Track'}}]
+                    class_panels.append(panel)
+
+                    # Working point maps
+                    for panels, matrix, label in [(efficiency_panels, efficiency, 'Efficiency'), (track_panels, track_fraction, 'Track Fraction')] :
+                        panel = GetScanPanel(iInt, iPDG, tier, 'Completeness Threshold', 'Purity Threshold', pdg_string)
+                        panel.update({'matrix' : matrix, 'x_edges' : engine.edges, 'y_edges' : engine.edges, 'levels' : map_levels, 'colorbar_label' : label})
+                        panels.append(panel)
+
+            tier_string = Definitions.tier_strings[tier]
+            grid_layout = {'nrows' : len(Definitions.ints), 'ncols' : len(Definitions.pdgs), 'figsize' : (20, 10),
+                           'tight_layout' : {'pad' : 0}, 'subplots_adjust' : {'left' : 0.08, 'bottom' : 0.08}}
+
+            for renderer, file_name, panels in [('grid', f'ThresholdScan_Efficiency{plane}_{tier_string}', curve_panels),
+                                                ('grid', f'ThresholdScan_TrackShower{plane}_{tier_string}', class_panels),
+                                                ('map', f'ThresholdScan_EfficiencyMap{plane}_{tier_string}', efficiency_panels),
+                                                ('map', f'ThresholdScan_TrackFractionMap{plane}_{tier_string}', track_panels)] :
+                figures.append(dict(grid_layout, renderer=renderer, file_name=f'{plot_dir}{file_name}.pdf', panels=panels))
+
+    return figures
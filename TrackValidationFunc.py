@@ -1,15 +1,63 @@
-import awkward as ak
 import numpy as np
-import matplotlib.pyplot as plt
+import os
+import Bootstrap
 import Definitions
+import FigureRendering
+import FlatIndex
+import HistogramEngine
+import Kernels
+import MetricRecords
+import Selections
+import ValidationFunc
+
+# Relative to the working directory, batch runs pass their own (PandoraMetrics.py run --output)
+default_plot_dir = os.path.join('plots', 'michel', '')
+
+michel_plotting_vars = [ValidationFunc.michel_n_mc_hits_2d_var, ValidationFunc.michel_completeness_var, ValidationFunc.michel_purity_var]
+michel_track_shower_vars = [ValidationFunc.michel_n_mc_hits_2d_var]
+michel_efficiency_vars = [ValidationFunc.michel_n_mc_hits_2d_var]
+
+# Hierarchy outcomes of a reconstructed child's link to its parent, not exclusive (see ValidationFunc.CalculateHierarchyMetrics)
+child_outcomes = ['correct_parent', 'false_primary', 'false_parent', 'not_best_match']
+
+# Reconstructed children are split into all, tracks and showers for the track/shower plots
+child_classes = ['all', 'track', 'shower']
+
+##############################################################################################
+##############################################################################################
+
+class TrackChildTopology :
+    # A true track (the parent, e.g. a muon) with one child particle (e.g. its Michel electron), as the TrackTree records it:
+    #   target_branch  the parent has a child that should be reconstructed
+    #   recod_branch   that child was reconstructed
+    #   index_branch   event-local PFPTree/HierarchyTree index of the child's best match, -1 if there isn't one
+    def __init__(self, name, parent_pdg, target_branch, recod_branch, index_branch, plot_vars=(), track_shower_vars=(), efficiency_vars=()) :
+        self.name = name
+        self.parent_pdg = parent_pdg
+        self.target_branch = target_branch
+        self.recod_branch = recod_branch
+        self.index_branch = index_branch
+        self.plot_vars = list(plot_vars)
+        self.track_shower_vars = list(track_shower_vars)
+        self.efficiency_vars = list(efficiency_vars)
+
+        # As Selections cuts, the reconstructed parents are a prefix away from the targets
+        self.target_cuts = [f'pdg:{parent_pdg}', 'has_match', Selections.BranchCut('TrackTree', target_branch)]
+        self.reco_cuts = self.target_cuts + [Selections.BranchCut('TrackTree', recod_branch)]
+
+michel_topology = TrackChildTopology('Michel', 13, 'MCP_HasTargetMichel', 'BM_IsMichelRecod', 'BM_MichelIndex',
+                                     michel_plotting_vars, michel_track_shower_vars, michel_efficiency_vars)
         
 ##############################################################################################
 ##############################################################################################
 
 
-def plot_michel_efficiency(target_michel_indices, reco_michel_indices, pfp_branches, plot_var, fig, ax) :
-    target_entries = ak.to_numpy(ak.flatten(pfp_branches[plot_var.tree_name][target_michel_indices]))
-    reco_entries = ak.to_numpy(ak.flatten(pfp_branches[plot_var.tree_name][reco_michel_indices]))
+def plot_michel_efficiency(target_michel_indices, reco_michel_indices, pfp_branches, plot_var, fig, ax, event_weights=None) :
+    pfp_flat = FlatIndex.GetFlatBranches(pfp_branches)
+    target_flat_indices = pfp_flat.FlatIndex(target_michel_indices, plot_var.tree_name)
+    reco_flat_indices = pfp_flat.FlatIndex(reco_michel_indices, plot_var.tree_name)
+    target_entries = pfp_flat.Take(plot_var.tree_name, target_flat_indices)
+    reco_entries = pfp_flat.Take(plot_var.tree_name, reco_flat_indices)
     
     hist_target, edges = np.histogram(target_entries, bins=plot_var.n_bins, range=plot_var.range)
     hist_reco, _ = np.histogram(reco_entries, bins=plot_var.n_bins, range=plot_var.range)
@@ -24,6 +72,15 @@ def plot_michel_efficiency(target_michel_indices, reco_michel_indices, pfp_branc
         efficiency[valid] * (1.0 - efficiency[valid]) / hist_target[valid]
     )
 
+    # Bootstrap uncertainty instead, with event_weights from Bootstrap.GetEventWeights
+    # (the events of the -1 entries that Take drops go too)
+    if event_weights is not None :
+        replica_target, replica_reco = [Bootstrap.GetReplicaHistogram(HistogramEngine.GetBinIndices(entries, edges), len(edges) + 1,
+                                                                      Bootstrap.GetEntryEvents(indices)[flat_indices >= 0], event_weights)[:, 1:-1] \
+                                        for entries, indices, flat_indices in [(target_entries, target_michel_indices, target_flat_indices),
+                                                                               (reco_entries, reco_michel_indices, reco_flat_indices)]]
+        efficiency_err = np.nan_to_num(Bootstrap.GetRatioUncertainty(replica_reco, replica_target))
+
     bin_centers = 0.5 * (edges[1:] + edges[:-1])
     ax.errorbar(bin_centers, efficiency, yerr=efficiency_err, fmt='o-', color='black', capsize=3, label=f' Michel ')
     ax.legend()
@@ -32,7 +89,7 @@ def plot_michel_efficiency(target_michel_indices, reco_michel_indices, pfp_branc
 ##############################################################################################
 
 def plot_michel_var(target_michel_indices, pfp_branches, plot_var, fig, ax) :
-    target_entries = ak.to_numpy(ak.flatten(pfp_branches[plot_var.tree_name][target_michel_indices]))
+    target_entries = FlatIndex.GetFlatBranches(pfp_branches).Take(plot_var.tree_name, target_michel_indices)
     n_target_entries = len(target_entries)
 
     if (n_target_entries == 0) :
@@ -43,3 +100,322 @@ def plot_michel_var(target_michel_indices, pfp_branches, plot_var, fig, ax) :
     ax.hist(target_entries, bins=plot_var.n_bins, range=plot_var.range, weights=weights, histtype='step', color='black', linewidth=1, label=(f' Michel '))
     ax.legend()
 
+##############################################################################################
+##############################################################################################
+
+class TrackChildEngine :
+    # Every metric of one TrackChildTopology from a single pass: the parent -> child links are resolved once per chunk
+    # into flat indices, then each output is one bincount over (interaction, parent tier, ...) keys:
+    #   'efficiency'         (int, tier, [target, reco]) parents, every target in the first slot and those reconstructed in the second
+    #   'hierarchy'          (int, tier, [total] + child_outcomes) reconstructed children
+    #   'var:<key>'          (int, tier, bin) target children, bins as HistogramEngine.GetBinIndices (under/overflow included)
+    #   'track_shower:<key>' (int, tier, child_classes, bin) reconstructed children
+    #   'efficiency:<key>'   (int, tier, [target, reco], bin) children
+    # n_replicas > 0 also fills that many event-level bootstrap replicas of each (see Bootstrap)
+    def __init__(self, topology=michel_topology, n_replicas=0, seed=Bootstrap.default_seed) :
+        self.topology = topology
+        self.n_replicas = n_replicas
+        self.seed = seed
+
+        category_shape = (len(Definitions.ints) + 1, len(Definitions.tiers) + 1)
+        self.edges = {HistogramEngine.GetVarKey(plot_var) : np.histogram_bin_edges(np.array([]), bins=plot_var.n_bins, range=plot_var.range) \
+                      for plot_var in topology.plot_vars + topology.track_shower_vars + topology.efficiency_vars}
+
+        shapes = {'efficiency' : category_shape + (2,), 'hierarchy' : category_shape + (len(child_outcomes) + 1,)}
+        for prefix, plot_vars, shape in [('var', topology.plot_vars, ()), ('track_shower', topology.track_shower_vars, (len(child_classes),)),
+                                         ('efficiency', topology.efficiency_vars, (2,))] :
+            for plot_var in plot_vars :
+                var_key = HistogramEngine.GetVarKey(plot_var)
+                shapes[f'{prefix}:{var_key}'] = category_shape + shape + (len(self.edges[var_key]) + 1,)
+
+        self.counts = {name : np.zeros(shape, dtype=np.int64) for name, shape in shapes.items()}
+        self.replicas = {name : np.zeros((n_replicas,) + shape, dtype=np.int64) for name, shape in shapes.items()} if n_replicas > 0 else None
+
+        var_branches = [branch for plot_var in topology.plot_vars + topology.track_shower_vars + topology.efficiency_vars \
+                        for branch in HistogramEngine.GetVarBranches(plot_var)]
+        self.tree_branches = {'PFPTree' : ['MCP_HasMatch', 'BM_IsTrack', 'BM_IsShower'] + var_branches,
+                              'TrackTree' : [topology.target_branch, topology.recod_branch, topology.index_branch],
+                              'HierarchyTree' : ['MC_ParentIndex', 'BM_HierarchyTier', 'BM_ParentIndex']}
+
+        if n_replicas > 0 :
+            self.tree_branches['EventTree'] = list(Bootstrap.event_id_branches)
+
+    def Fill(self, chunk, int_masks, tier_masks, pdg_masks) :
+        event_weights = Bootstrap.GetEventWeights(chunk['EventTree'], self.n_replicas, self.seed) if self.n_replicas > 0 else None
+        self.FillBranches(chunk['PFPTree'], chunk['TrackTree'], chunk['HierarchyTree'], int_masks, tier_masks, pdg_masks, event_weights)
+
+    def FillBranches(self, pfp_branches, track_branches, hierarchy_branches, int_masks, tier_masks, pdg_masks, event_weights=None) :
+
+        topology = self.topology
+        pfp_flat = FlatIndex.GetFlatBranches(pfp_branches)
+        track_flat = FlatIndex.GetFlatBranches(track_branches)
+        hierarchy_flat = FlatIndex.GetFlatBranches(hierarchy_branches)
+
+        # Parents, one per PFP entry
+        selection = Selections.Selection({'PFPTree' : pfp_flat, 'TrackTree' : track_flat}, int_masks, tier_masks, pdg_masks)
+        codes = selection.codes
+        category = codes['int'].astype(np.int64) * (len(Definitions.tiers) + 1) + codes['tier']
+        is_target = selection.GetMask(topology.target_cuts)
+        is_reco = selection.GetMask(topology.reco_cuts)
+        entry_events = None if event_weights is None else Bootstrap.GetEntryEvents(pfp_branches['MCP_HasMatch'])
+
+        # The links, resolved once: flat index of each parent's child, -1 if there isn't one
+        child_index = FlatIndex.ToFlatIndex(track_branches[topology.index_branch], pfp_flat.GetEventOffsets('MCP_HasMatch'))
+        has_target_child = is_target & (child_index >= 0)
+        has_reco_child = is_reco & (child_index >= 0)
+
+        def Select(values, selection) :
+            return values[selection], None if entry_events is None else entry_events[selection]
+
+        # Efficiency of the parents' children
+        target_keys, target_events = Select(category * 2, is_target)
+        reco_keys, reco_events = Select(category * 2 + 1, is_target & is_reco)
+        events = None if entry_events is None else np.concatenate([target_events, reco_events])
+        self.FillKeys('efficiency', np.concatenate([target_keys, reco_keys]), events, event_weights)
+
+        # Hierarchy outcomes of the reconstructed children
+        reco_child = child_index[has_reco_child]
+        reco_category, reco_events = Select(category, has_reco_child)
+
+        if (event_weights is None) and Kernels.UseKernels() :
+            # Straight into the counts, one pass over each event's links
+            hierarchy_counts = self.counts['hierarchy']
+            hierarchy_counts += Kernels.CountLinkOutcomes(track_branches[topology.index_branch], hierarchy_flat.GetEventOffsets('MC_HierarchyTier'),
+                                                          hierarchy_flat['BM_HierarchyTier'], hierarchy_flat['BM_ParentIndex'], hierarchy_flat['MC_ParentIndex'],
+                                                          np.where(is_reco, category, -1), hierarchy_counts[..., 0].size).reshape(hierarchy_counts.shape)
+        else :
+            bm_tier = hierarchy_flat['BM_HierarchyTier'][reco_child]
+            bm_parent = hierarchy_flat['BM_ParentIndex'][reco_child]
+            mc_parent = hierarchy_flat['MC_ParentIndex'][reco_child]
+            outcomes = [(bm_tier != 1) & (bm_parent == mc_parent), bm_tier == 1, (bm_tier != 1) & (bm_parent != -1) & (bm_parent != mc_parent),
+                        (bm_tier != 1) & (bm_parent == -1)]
+
+            n_slots = len(child_outcomes) + 1
+            keys = np.concatenate([reco_category * n_slots] + [reco_category[outcome] * n_slots + 1 + index for index, outcome in enumerate(outcomes)])
+            events = None if entry_events is None else np.concatenate([reco_events] + [reco_events[outcome] for outcome in outcomes])
+            self.FillKeys('hierarchy', keys, events, event_weights)
+
+        # Variable histograms of the children
+        target_category, target_events = Select(category, has_target_child)
+        target_child = child_index[has_target_child]
+        child_is_track = pfp_flat['BM_IsTrack'][reco_child] == 1
+        child_is_shower = pfp_flat['BM_IsShower'][reco_child] == 1
+
+        for plot_var in topology.plot_vars :
+            var_key = HistogramEngine.GetVarKey(plot_var)
+            n_bins = len(self.edges[var_key]) + 1
+            bins = HistogramEngine.GetBinIndices(pfp_flat[plot_var.tree_name][target_child], self.edges[var_key])
+            self.FillKeys(f'var:{var_key}', target_category * n_bins + bins, target_events, event_weights)
+
+        for plot_var in topology.track_shower_vars :
+            var_key = HistogramEngine.GetVarKey(plot_var)
+            n_bins = len(self.edges[var_key]) + 1
+            bins = HistogramEngine.GetBinIndices(pfp_flat[plot_var.tree_name][reco_child], self.edges[var_key])
+            classes = [np.ones(len(reco_child), dtype=bool), child_is_track, child_is_shower]
+            keys = np.concatenate([((reco_category * len(child_classes) + index) * n_bins + bins)[is_class] for index, is_class in enumerate(classes)])
+            events = None if entry_events is None else np.concatenate([reco_events[is_class] for is_class in classes])
+            self.FillKeys(f'track_shower:{var_key}', keys, events, event_weights)
+
+        for plot_var in topology.efficiency_vars :
+            var_key = HistogramEngine.GetVarKey(plot_var)
+            n_bins = len(self.edges[var_key]) + 1
+            target_bins = HistogramEngine.GetBinIndices(pfp_flat[plot_var.tree_name][target_child], self.edges[var_key])
+            reco_bins = HistogramEngine.GetBinIndices(pfp_flat[plot_var.tree_name][reco_child], self.edges[var_key])
+            keys = np.concatenate([(target_category * 2) * n_bins + target_bins, (reco_category * 2 + 1) * n_bins + reco_bins])
+            events = None if entry_events is None else np.concatenate([target_events, reco_events])
+            self.FillKeys(f'efficiency:{var_key}', keys, events, event_weights)
+
+    def FillKeys(self, name, keys, entry_events, event_weights) :
+        counts = self.counts[name]
+        counts += np.bincount(keys, minlength=counts.size).reshape(counts.shape)
+
+        if event_weights is not None :
+            Bootstrap.FillReplicas(self.replicas[name], keys, entry_events, event_weights)
+
+    def Merge(self, other) :
+        for name in self.counts :
+            self.counts[name] += other.counts[name]
+            if self.replicas is not None :
+                self.replicas[name] += other.replicas[name]
+        return self
+
+    def Subtract(self, other) :
+        for name in self.counts :
+            self.counts[name] -= other.counts[name]
+            if self.replicas is not None :
+                self.replicas[name] -= other.replicas[name]
+        return self
+
+    def GetEfficiencyMetrics(self, int_index, tier_index) :
+
+        # Positions in Definitions.ints and Definitions.tiers, not category keys
+        n_targets, n_reco = self.counts['efficiency'][int_index, tier_index]
+        efficiency_metrics = ValidationFunc.EfficiencyMetricsFromCounts(int(n_targets), int(n_reco))
+
+        if self.replicas is not None :
+            replica_counts = self.replicas['efficiency'][:, int_index, tier_index]
+            efficiency_metrics['EfficiencyErr'] = float(Bootstrap.GetRatioUncertainty(replica_counts[:, 1], replica_counts[:, 0]))
+
+        return efficiency_metrics
+
+    def GetHierarchyMetrics(self, int_index, tier_index) :
+
+        hierarchy_metrics = ValidationFunc.HierarchyMetricsFromCounts(*[int(count) for count in self.counts['hierarchy'][int_index, tier_index]])
+
+        if self.replicas is not None :
+            replica_counts = self.replicas['hierarchy'][:, int_index, tier_index]
+            for index, outcome in enumerate(child_outcomes) :
+                hierarchy_metrics[f'err_{outcome}'] = float(Bootstrap.GetRatioUncertainty(replica_counts[:, index + 1], replica_counts[:, 0]))
+
+        return hierarchy_metrics
+
+    def GetRecords(self, count_scales=None) :
+
+        metric_prefix = self.topology.name.lower()
+        records = []
+
+        for int_index, int_type in enumerate(Definitions.ints) :
+            for tier_index, tier in enumerate(Definitions.tiers) :
+                records += MetricRecords.RecordsFromHierarchyMetrics(f'{metric_prefix}_hierarchy', int_type, self.topology.parent_pdg, tier, self.GetHierarchyMetrics(int_index, tier_index),
+                                                                     count_scales=count_scales)
+                records += MetricRecords.RecordsFromEfficiencyMetrics(f'{metric_prefix}_efficiency', int_type, self.topology.parent_pdg, tier, self.GetEfficiencyMetrics(int_index, tier_index),
+                                                                      count_scales=count_scales)
+
+        return records
+
+    def WriteTables(self, count_scales=None, plot_dir=default_plot_dir) :
+
+        name = self.topology.name
+        records = self.GetRecords(count_scales)
+
+        # The efficiency counts as the records have them (scaled for a quick look)
+        indexed_records = MetricRecords.IndexRecords(records)
+        efficiency_metric = f'{name.lower()}_efficiency'
+        os.makedirs(plot_dir, exist_ok=True)
+
+        with open(f'{plot_dir}{name}EfficiencyTables.txt', "w") as f_efficiency, open(f'{plot_dir}{name}HierarchyTables.txt', "w") as f_hierarchy :
+            for int_index, int_type in enumerate(Definitions.ints) :
+                ValidationFunc.PrintHierarchyTableHeader(int_type, f_hierarchy)
+                ValidationFunc.PrintEfficiencyTableHeader(int_type, f_efficiency)
+
+                for tier_index, tier in enumerate(Definitions.tiers) :
+                    record = indexed_records[(efficiency_metric, int_type, self.topology.parent_pdg, tier, '', 'Reco')]
+                    ValidationFunc.PrintHierarchyTableEntry(tier, self.GetHierarchyMetrics(int_index, tier_index), f_hierarchy)
+                    ValidationFunc.PrintEfficiencyTableEntry(tier, MetricRecords.EfficiencyMetricsFromRecord(record), f_efficiency)
+
+                ValidationFunc.PrintHierarchyTableFooter(f_hierarchy)
+                ValidationFunc.PrintEfficiencyTableFooter(f_efficiency)
+
+        MetricRecords.WriteRecords(records, f'{plot_dir}{name}Metrics')
+
+        return records
+
+    def BuildFigures(self, plot_dir=default_plot_dir) :
+
+        name = self.topology.name
+        figures = []
+
+        for plot_var in self.topology.plot_vars :
+            var_key = HistogramEngine.GetVarKey(plot_var)
+            panels = []
+            for int_index in range(len(Definitions.ints)) :
+                for tier_index in range(len(Definitions.tiers)) :
+                    # Normalised to all target children, including those outside the plotted range
+                    hist = self.counts[f'var:{var_key}'][int_index, tier_index]
+                    panel = GetChildPanel(int_index, tier_index, plot_var)
+                    panel['series'] = [] if hist.sum() == 0 else \
+                                      [{'type' : 'hist', 'edges' : self.edges[var_key], 'weights' : hist[1:-1] * (1.0 / hist.sum()),
+                                        'kwargs' : {'histtype' : 'step', 'color' : 'black', 'linewidth' : 1, 'label' : f' {name} '}}]
+                    panels.append(panel)
+            figures.append(GetChildFigure(f'{plot_dir}{name}_{plot_var.tree_name}', panels))
+
+        for plot_var in self.topology.track_shower_vars :
+            var_key = HistogramEngine.GetVarKey(plot_var)
+            bin_centers = 0.5 * (self.edges[var_key][1:] + self.edges[var_key][:-1])
+            panels = []
+            for int_index in range(len(Definitions.ints)) :
+                for tier_index in range(len(Definitions.tiers)) :
+                    hist_all, hist_track, hist_shower = self.counts[f'track_shower:{var_key}'][int_index, tier_index][:, 1:-1]
+                    proportion_track, err_track = GetRatioWithUncertainty(hist_track, hist_all, np.maximum(hist_all, 1))
+                    proportion_shower, err_shower = GetRatioWithUncertainty(hist_shower, hist_all, np.maximum(hist_all, 1))
+                    if self.replicas is not None :
+                        replica_all, replica_track, replica_shower = np.moveaxis(self.replicas[f'track_shower:{var_key}'][:, int_index, tier_index][:, :, 1:-1], 1, 0)
+                        err_track = np.nan_to_num(Bootstrap.GetRatioUncertainty(replica_track, replica_all))
+                        err_shower = np.nan_to_num(Bootstrap.GetRatioUncertainty(replica_shower, replica_all))
+                    panel = GetChildPanel(int_index, tier_index, plot_var)
+                    panel['series'] = [{'type' : 'errorbar', 'x' : bin_centers, 'y' : proportion_shower, 'yerr' : err_shower,
+                                        'kwargs' : {'marker' : 'x', 'capsize' : 2, 'label' : 'Shower'}},
+                                       {'type' : 'errorbar', 'x' : bin_centers, 'y' : proportion_track, 'yerr' : err_track,
+                                        'kwargs' : {'marker' : 'x', 'capsize' : 2, 'label' : 'Track'}}]
+                    panels.append(panel)
+            figures.append(GetChildFigure(f'{plot_dir}{name}_TrackShower_{plot_var.tree_name}', panels))
+
+        for plot_var in self.topology.efficiency_vars :
+            var_key = HistogramEngine.GetVarKey(plot_var)
+            bin_centers = 0.5 * (self.edges[var_key][1:] + self.edges[var_key][:-1])
+            panels = []
+            for int_index in range(len(Definitions.ints)) :
+                for tier_index in range(len(Definitions.tiers)) :
+                    hist_target, hist_reco = self.counts[f'efficiency:{var_key}'][int_index, tier_index][:, 1:-1]
+                    efficiency, efficiency_err = GetRatioWithUncertainty(hist_reco, hist_target, hist_target)
+                    if self.replicas is not None :
+                        replica_target, replica_reco = np.moveaxis(self.replicas[f'efficiency:{var_key}'][:, int_index, tier_index][:, :, 1:-1], 1, 0)
+                        efficiency_err = np.nan_to_num(Bootstrap.GetRatioUncertainty(replica_reco, replica_target))
+                    panel = GetChildPanel(int_index, tier_index, plot_var)
+                    panel['series'] = [{'type' : 'errorbar', 'x' : bin_centers, 'y' : efficiency, 'yerr' : efficiency_err,
+                                        'kwargs' : {'fmt' : 'o-', 'color' : 'black', 'capsize' : 3, 'label' : f' {name} '}}]
+                    panels.append(panel)
+            figures.append(GetChildFigure(f'{plot_dir}{name}_Efficiency_{plot_var.tree_name}', panels))
+
+        return figures
+
+##############################################################################################
+##############################################################################################
+
+def GetRatioWithUncertainty(hist_pass, hist_total, n_for_uncertainty) :
+
+    # Binomial uncertainty, zero where there's nothing in hist_total
+    ratio = np.divide(hist_pass, hist_total, out=np.zeros_like(hist_pass, dtype=float), where=hist_total > 0)
+    uncertainty = np.zeros_like(ratio)
+    valid = n_for_uncertainty > 0
+    uncertainty[valid] = np.sqrt(ratio[valid] * (1.0 - ratio[valid]) / n_for_uncertainty[valid])
+
+    return ratio, uncertainty
+
+##############################################################################################
+##############################################################################################
+
+def GetChildPanel(int_index, tier_index, plot_var) :
+    # As ValidationFunc.ConfigurePlot, one row per interaction and one column per tier, by position
+    int_type, tier = Definitions.ints[int_index], Definitions.tiers[tier_index]
+    is_y_label_index = (tier_index == 0)
+
+    return {'row' : int_index, 'col' : tier_index,
+            'title' : f'       {Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]}',
+            'xlabel' : plot_var.x_label,
+            'ylabel' : plot_var.y_label if is_y_label_index else '',
+            'tick_params' : {'labelbottom' : True, 'bottom' : True, 'labelleft' : is_y_label_index, 'left' : is_y_label_index}}
+
+##############################################################################################
+##############################################################################################
+
+def GetChildFigure(file_name, panels) :
+    return {'renderer' : 'grid', 'file_name' : f'{file_name}.pdf', 'nrows' : len(Definitions.ints), 'ncols' : len(Definitions.tiers), 'figsize' : (14, 10),
+            'subplots_adjust' : {'left' : 0.08, 'right' : 0.98, 'bottom' : 0.08, 'top' : 0.95, 'hspace' : 0.3}, 'panels' : panels}
+
+##############################################################################################
+##############################################################################################
+
+def WriteMichelMetrics(int_masks, tier_masks, pdg_masks, pfp_branches, track_branches, hierarchy_branches, make_plots=True, event_weights=None,
+                       topology=michel_topology, n_workers=1, count_scales=None, plot_dir=default_plot_dir, keep_open=True) :
+
+    # Whole-file branches in one go, as the notebook loads them
+    # n_workers=1 draws the plots in this process, so notebooks show them, None renders them in one worker process per CPU
+    engine = TrackChildEngine(topology, 0 if event_weights is None else event_weights.shape[0])
+    engine.FillBranches(pfp_branches, track_branches, hierarchy_branches, int_masks, tier_masks, pdg_masks, event_weights)
+    records = engine.WriteTables(count_scales, plot_dir)
+
+    if make_plots :
+        FigureRendering.RenderFigures(engine.BuildFigures(plot_dir), n_workers or os.cpu_count() or 1, keep_open=keep_open)
+
+    return records
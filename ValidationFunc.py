@@ -1,7 +1,10 @@
 import awkward as ak
 import numpy as np
-import matplotlib.pyplot as plt
+import Bootstrap
 import Definitions
+import FlatIndex
+import Kernels
+import HistogramEngine
 
 ##############################################################################################
 ##############################################################################################
@@ -9,6 +12,7 @@ import Definitions
 class PlotVar :
     def __init__(self, tree_name, x_label, y_label, range, n_bins):
         self.tree_name = tree_name
+        self.branches = [tree_name]
         self.x_label = x_label
         self.y_label = y_label
         self.range = range
@@ -32,6 +36,7 @@ class PlotDiffVar :
     def __init__(self, true_tree_name, reco_tree_name, x_label, y_label, range, n_bins):
         self.true_tree_name = true_tree_name
         self.reco_tree_name = reco_tree_name
+        self.branches = [true_tree_name, reco_tree_name]
         self.x_label = x_label
         self.y_label = y_label
         self.range = range
@@ -45,7 +50,7 @@ displacement_diff_var = PlotDiffVar('MCP_Displacement', 'BM_Displacement', 'True
 ##############################################################################################
 
 def ConfigurePlot(fig, ax, int_type, tier, plot_var) :
-    is_y_label_index = (tier == 0)
+    is_y_label_index = (tier == Definitions.tiers[0])
     ax.set_title(f'       {Definitions.int_strings[int_type]}: {Definitions.tier_strings[tier]}')
     ax.set_xlabel(plot_var.x_label)
     ax.set_ylabel(plot_var.y_label if is_y_label_index else '')
@@ -57,11 +62,19 @@ def ConfigurePlot(fig, ax, int_type, tier, plot_var) :
 ##############################################################################################
 ##############################################################################################
 
-def TrackShowerAsAFunctionOf(pfp_indices, pfp_branches, plot_var, fig, ax) :
+def TrackShowerAsAFunctionOf(pfp_indices, pfp_branches, plot_var, fig, ax, event_weights=None) :
     
-    n_hits = ak.to_numpy(ak.flatten(pfp_branches[plot_var.tree_name][pfp_indices]))
-    is_track = ak.to_numpy(ak.flatten(pfp_branches['BM_IsTrack'][pfp_indices]))
-    is_shower = ak.to_numpy(ak.flatten(pfp_branches['BM_IsShower'][pfp_indices]))
+    # event_weights : Bootstrap.GetEventWeights, for bootstrap rather than binomial errors
+    pfp_flat = FlatIndex.GetFlatBranches(pfp_branches)
+    entry_events = None if event_weights is None else Bootstrap.GetEntryEvents(pfp_indices)
+    pfp_indices = pfp_flat.FlatIndex(pfp_indices, plot_var.tree_name)
+
+    # Take drops the -1 entries, so their events go too
+    if entry_events is not None :
+        entry_events = entry_events[pfp_indices >= 0]
+    n_hits = pfp_flat.Take(plot_var.tree_name, pfp_indices)
+    is_track = pfp_flat.Take('BM_IsTrack', pfp_indices)
+    is_shower = pfp_flat.Take('BM_IsShower', pfp_indices)
 
     hist_all, edges = np.histogram(n_hits, bins=plot_var.n_bins, range=plot_var.range)
     hist_track, _ = np.histogram(n_hits[is_track == 1], bins=plot_var.n_bins, range=plot_var.range)
@@ -71,6 +84,13 @@ def TrackShowerAsAFunctionOf(pfp_indices, pfp_branches, plot_var, fig, ax) :
     proportion_shower = np.divide(hist_shower, hist_all, out=np.zeros_like(hist_shower, dtype=float), where=hist_all > 0)
     err_track = np.sqrt(proportion_track * (1.0 - proportion_track) / np.maximum(hist_all, 1))
     err_shower = np.sqrt(proportion_shower * (1.0 - proportion_shower) / np.maximum(hist_all, 1))
+
+    if event_weights is not None :
+        bin_indices = HistogramEngine.GetBinIndices(n_hits, edges)
+        replica_all, replica_track, replica_shower = [Bootstrap.GetReplicaHistogram(bin_indices[is_class], len(edges) + 1, entry_events[is_class], event_weights)[:, 1:-1] \
+                                                      for is_class in [np.ones(len(n_hits), dtype=bool), is_track == 1, is_shower == 1]]
+        err_track = np.nan_to_num(Bootstrap.GetRatioUncertainty(replica_track, replica_all))
+        err_shower = np.nan_to_num(Bootstrap.GetRatioUncertainty(replica_shower, replica_all))
     
     bin_centers = 0.5 * (edges[1:] + edges[:-1])
     ax.errorbar(bin_centers, proportion_shower, yerr=err_shower, marker='x', capsize=2, label='Shower')
@@ -81,7 +101,7 @@ def TrackShowerAsAFunctionOf(pfp_indices, pfp_branches, plot_var, fig, ax) :
 ##############################################################################################
 
 def plot_var(pfp_indices, pfp_branches, plot_var, fig, ax, label) :
-    target_entries = ak.to_numpy(ak.flatten(pfp_branches[plot_var.tree_name][pfp_indices]))
+    target_entries = FlatIndex.GetFlatBranches(pfp_branches).Take(plot_var.tree_name, pfp_indices)
     n_target_entries = len(target_entries)
 
     if (n_target_entries == 0) :
@@ -103,28 +123,60 @@ def PrintHierarchyTableHeader(int_type, file) :
 ##############################################################################################
 ##############################################################################################
 
-def CalculateHierarchyMetrics(hierarchy_branches, reco_michel_indices) :
-    mc_tier         = hierarchy_branches['MC_HierarchyTier']
-    bm_tier         = hierarchy_branches['BM_HierarchyTier']
-    mc_parent       = hierarchy_branches['MC_ParentIndex']
-    bm_parent       = hierarchy_branches['BM_ParentIndex']
+def CalculateHierarchyMetrics(hierarchy_branches, reco_michel_indices, event_weights=None) :
+    # event_weights : Bootstrap.GetEventWeights, to add the bootstrap uncertainties (err_*) of the fractions
+    hierarchy_flat = FlatIndex.GetFlatBranches(hierarchy_branches)
+
+    # Counts straight from the per-event loop when there are no replicas to fill
+    if (event_weights is None) and Kernels.UseKernels() :
+        counts = Kernels.CountLinkOutcomes(reco_michel_indices, hierarchy_flat.GetEventOffsets('MC_HierarchyTier'), hierarchy_flat['BM_HierarchyTier'],
+                                           hierarchy_flat['BM_ParentIndex'], hierarchy_flat['MC_ParentIndex'])[0]
+        return HierarchyMetricsFromCounts(*[int(count) for count in counts])
+
+    entry_events = None if event_weights is None else Bootstrap.GetEntryEvents(reco_michel_indices)
+    reco_michel_indices = hierarchy_flat.FlatIndex(reco_michel_indices, 'MC_HierarchyTier')
 
-    mc_tier_michel      = ak.to_numpy(ak.flatten(mc_tier[reco_michel_indices]))
-    bm_tier_michel      = ak.to_numpy(ak.flatten(bm_tier[reco_michel_indices]))
-    mc_parent_michel    = ak.to_numpy(ak.flatten(mc_parent[reco_michel_indices]))
-    bm_parent_michel    = ak.to_numpy(ak.flatten(bm_parent[reco_michel_indices]))
+    # Take drops the -1 entries, so their events go too
+    if entry_events is not None :
+        entry_events = entry_events[reco_michel_indices >= 0]
+
+    mc_tier_michel      = hierarchy_flat.Take('MC_HierarchyTier', reco_michel_indices)
+    bm_tier_michel      = hierarchy_flat.Take('BM_HierarchyTier', reco_michel_indices)
+    mc_parent_michel    = hierarchy_flat.Take('MC_ParentIndex', reco_michel_indices)
+    bm_parent_michel    = hierarchy_flat.Take('BM_ParentIndex', reco_michel_indices)
+
+    is_not_best_match = (bm_tier_michel != 1) & (bm_parent_michel == -1)
+    is_false_primary = bm_tier_michel == 1
+    is_correct_parent = (bm_tier_michel != 1) & (bm_parent_michel == mc_parent_michel)
+    is_false_parent = (bm_tier_michel != 1) & (bm_parent_michel != -1) & (bm_parent_michel != mc_parent_michel)
 
     n_michel = mc_tier_michel.shape[0]
-    n_not_best_match = np.count_nonzero((bm_tier_michel != 1) & (bm_parent_michel == -1))
-    n_false_primary  = np.count_nonzero(bm_tier_michel == 1)
-    n_correct_parent = np.count_nonzero((bm_tier_michel != 1) & (bm_parent_michel == mc_parent_michel))
-    n_false_parent = np.count_nonzero((bm_tier_michel != 1) & (bm_parent_michel != -1) & (bm_parent_michel != mc_parent_michel))
+    hierarchy_metrics = HierarchyMetricsFromCounts(n_michel, np.count_nonzero(is_correct_parent), np.count_nonzero(is_false_primary),
+                                                   np.count_nonzero(is_false_parent), np.count_nonzero(is_not_best_match))
+
+    if event_weights is not None :
+        replica_total = Bootstrap.GetReplicaEntryCounts(np.ones(n_michel, dtype=bool), entry_events, event_weights)
+        for name, is_outcome in [('correct_parent', is_correct_parent), ('false_primary', is_false_primary), ('false_parent', is_false_parent), ('not_best_match', is_not_best_match)] :
+            hierarchy_metrics[f'err_{name}'] = float(Bootstrap.GetRatioUncertainty(Bootstrap.GetReplicaEntryCounts(is_outcome, entry_events, event_weights), replica_total))
 
+    return hierarchy_metrics
+
+##############################################################################################
+##############################################################################################
+
+def HierarchyMetricsFromCounts(n_total, n_correct_parent, n_false_primary, n_false_parent, n_not_best_match) :
     hierarchy_metrics = {}
-    hierarchy_metrics['frac_not_best_match'] = round(0.0 if n_michel == 0 else float(n_not_best_match) / float(n_michel), 2)
-    hierarchy_metrics['frac_false_primary'] = round(0.0 if n_michel == 0 else float(n_false_primary) / float(n_michel), 2)
-    hierarchy_metrics['frac_correct_parent'] = round(0.0 if n_michel == 0 else float(n_correct_parent) / float(n_michel), 2)
-    hierarchy_metrics['frac_false_parent'] = round(0.0 if n_michel == 0 else float(n_false_parent) / float(n_michel), 2)
+    hierarchy_metrics['frac_not_best_match'] = round(0.0 if n_total == 0 else float(n_not_best_match) / float(n_total), 2)
+    hierarchy_metrics['frac_false_primary'] = round(0.0 if n_total == 0 else float(n_false_primary) / float(n_total), 2)
+    hierarchy_metrics['frac_correct_parent'] = round(0.0 if n_total == 0 else float(n_correct_parent) / float(n_total), 2)
+    hierarchy_metrics['frac_false_parent'] = round(0.0 if n_total == 0 else float(n_false_parent) / float(n_total), 2)
+
+    # Unrounded, for MetricRecords
+    hierarchy_metrics['n_total'] = n_total
+    hierarchy_metrics['n_correct_parent'] = n_correct_parent
+    hierarchy_metrics['n_false_primary'] = n_false_primary
+    hierarchy_metrics['n_false_parent'] = n_false_parent
+    hierarchy_metrics['n_not_best_match'] = n_not_best_match
     return hierarchy_metrics
 
 ##############################################################################################
@@ -148,8 +200,8 @@ def PrintHierarchyTableFooter(file) :
 ##############################################################################################
 ##############################################################################################
 
-def PrintEfficiencyTableHeader(int_type, file) :
-    print(f'{Definitions.int_strings[int_type]}', file=file)
+def PrintEfficiencyTableHeader(int_type, file, pdg_string=None) :
+    print(f'{Definitions.int_strings[int_type]}' + ('' if pdg_string is None else f' - {pdg_string}'), file=file)
     print('-----------------------------------------------------------------', file=file)
     print('           |      NTarget      |       NReco       | Efficiency |', file=file)
     print('-----------------------------------------------------------------', file=file) 
@@ -157,11 +209,21 @@ def PrintEfficiencyTableHeader(int_type, file) :
 ##############################################################################################
 ##############################################################################################
 
-def CalculateEfficiencyMetrics(target_mask, reco_mask) :
-    n_targets = ak.sum(target_mask)
-    n_reco = ak.sum(reco_mask)
-    reco_efficiency = 0 if n_targets == 0 else round(float(n_reco) / n_targets, 2)    
-    
+def CalculateEfficiencyMetrics(target_mask, reco_mask, event_weights=None) :
+    efficiency_metrics = EfficiencyMetricsFromCounts(ak.sum(target_mask), ak.sum(reco_mask))
+
+    # Bootstrap uncertainty, with event_weights from Bootstrap.GetEventWeights
+    if event_weights is not None :
+        efficiency_metrics['EfficiencyErr'] = float(Bootstrap.GetRatioUncertainty(Bootstrap.GetReplicaCounts(reco_mask, event_weights), Bootstrap.GetReplicaCounts(target_mask, event_weights)))
+
+    return efficiency_metrics
+
+##############################################################################################
+##############################################################################################
+
+def EfficiencyMetricsFromCounts(n_targets, n_reco) :
+    reco_efficiency = 0 if n_targets == 0 else round(float(n_reco) / n_targets, 2)
+
     efficiency_metrics = {}
     efficiency_metrics['NTarget'] = n_targets
     efficiency_metrics['NReco'] = n_reco
@@ -171,6 +233,14 @@ def CalculateEfficiencyMetrics(target_mask, reco_mask) :
 ##############################################################################################
 ##############################################################################################
 
+def MergeEfficiencyMetrics(*all_efficiency_metrics) :
+    n_targets = sum(efficiency_metrics['NTarget'] for efficiency_metrics in all_efficiency_metrics)
+    n_reco = sum(efficiency_metrics['NReco'] for efficiency_metrics in all_efficiency_metrics)
+    return EfficiencyMetricsFromCounts(n_targets, n_reco)
+
+##############################################################################################
+##############################################################################################
+
 def PrintEfficiencyTableEntry(tier, efficiency_metrics, file) :
     print(' ' + str(Definitions.tier_strings[tier]) + str(' '* (10 - len(str(Definitions.tier_strings[tier])))) +
                                             '|' + str(efficiency_metrics['NTarget']) + str(' '* (19 - len(str(efficiency_metrics['NTarget'])))) + \
@@ -0,0 +1,265 @@
+import concurrent.futures
+import copy
+import glob
+import os
+import DerivedCache
+import FigureRendering
+import HistogramEngine
+import HierarchyValidationFunc
+import PFPValidationFunc
+import Profiling
+import QuickLook
+import ResultsStore
+import Selections
+import StreamingLoader
+import ThresholdScan
+import TrackValidationFunc
+
+##############################################################################################
+##############################################################################################
+
+def GetFileNames(inputs) :
+
+    if isinstance(inputs, str) :
+        inputs = [inputs]
+
+    file_names = []
+
+    for pattern in inputs :
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for file_name in matches :
+            if file_name not in file_names :
+                file_names.append(file_name)
+
+    if len(file_names) == 0 :
+        raise FileNotFoundError(f'No input files match {inputs}')
+
+    return file_names
+
+##############################################################################################
+##############################################################################################
+
+def ProcessFile(file_name, accumulators, step_size, entry_ranges=None, cache_dir=None) :
+    with Profiling.Stage('file', file_name=os.path.basename(file_name)) :
+        # From the file's cached columns (built on the first run) instead of its trees
+        if cache_dir is not None :
+            return [DerivedCache.FillFromCache(file_name, accumulator, step_size, cache_dir) for accumulator in accumulators]
+
+        return StreamingLoader.RunStreaming(file_name, accumulators, step_size, entry_ranges=entry_ranges)
+
+##############################################################################################
+##############################################################################################
+
+def ProcessFileInWorker(file_name, accumulators, step_size, profile_settings=None, entry_ranges=None, cache_dir=None) :
+    # The worker's profiling events go back with its accumulators
+    Profiling.StartWorker(profile_settings)
+    return ProcessFile(file_name, accumulators, step_size, entry_ranges, cache_dir), Profiling.TakeEvents()
+
+##############################################################################################
+##############################################################################################
+
+def MergeAccumulators(partials) :
+
+    # Reduce in input file order, so the result doesn't depend on which worker finished first
+    merged = partials[0]
+
+    for partial in partials[1:] :
+        for accumulator, other in zip(merged, partial) :
+            accumulator.Merge(other)
+
+    return merged
+
+##############################################################################################
+##############################################################################################
+
+def ProcessFiles(file_names, accumulators, n_workers=None, step_size=StreamingLoader.default_step_size, quick_look=None, cache_dir=None) :
+
+    n_workers = min(n_workers or os.cpu_count() or 1, max(len(file_names), 1))
+
+    # A quick look's subsample is selected here, so the scales it needs are known once the files are done
+    entry_ranges = [None if quick_look is None else quick_look.GetEntryRanges(file_name, step_size) for file_name in file_names]
+
+    # Each file is filled into its own copy of the (empty) accumulators
+    if n_workers == 1 :
+        return [ProcessFile(file_name, copy.deepcopy(accumulators), step_size, file_entry_ranges, cache_dir) for file_name, file_entry_ranges in zip(file_names, entry_ranges)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor :
+        futures = [executor.submit(ProcessFileInWorker, file_name, copy.deepcopy(accumulators), step_size, Profiling.GetSettings(), file_entry_ranges, cache_dir) \
+                   for file_name, file_entry_ranges in zip(file_names, entry_ranges)]
+        partials = []
+
+        for future in futures :
+            partial, worker_events = future.result()
+            Profiling.AddEvents(worker_events)
+            partials.append(partial)
+
+        return partials
+
+##############################################################################################
+##############################################################################################
+
+def RunValidation(inputs, accumulators, n_workers=None, step_size=StreamingLoader.default_step_size, store_dir=None, quick_look=None, cache_dir=None) :
+
+    # quick_look : a QuickLook.QuickLookSample to fill from a subsample of each file instead, the records and tables written
+    # from them are scaled to the whole files by QuickLook.GetCountScales(quick_look). Its results stand for no file, so the store is neither read nor updated
+    # cache_dir : fill from the files' DerivedCache columns kept here, every accumulator must be a HistogramEngine.FillEngine
+    file_names = GetFileNames(inputs)
+
+    if (quick_look is not None) and (cache_dir is not None) :
+        raise ValueError('The cached columns hold every event, a quick look can\'t be filled from them')
+
+    # Here rather than in the workers, so nothing is read before it fails
+    if cache_dir is not None :
+        for accumulator in accumulators :
+            if not isinstance(accumulator, HistogramEngine.FillEngine) :
+                raise ValueError(f'Only HistogramEngine.FillEngine can be filled from the cache, not {type(accumulator).__name__}')
+
+    if quick_look is not None :
+        return MergeAccumulators(ProcessFiles(file_names, accumulators, n_workers, step_size, quick_look))
+
+    if store_dir is None :
+        return MergeAccumulators(ProcessFiles(file_names, accumulators, n_workers, step_size, cache_dir=cache_dir))
+
+    # Only files that were added or changed since the stored results are processed
+    store = ResultsStore.ResultsStore(store_dir, accumulators)
+    stale_file_names = store.GetStaleFiles(file_names)
+    partials = ProcessFiles(stale_file_names, accumulators, n_workers, step_size, cache_dir=cache_dir)
+
+    return store.Update(file_names, dict(zip(stale_file_names, partials)))
+
+##############################################################################################
+##############################################################################################
+
+def EnableProfiling(trace_file) :
+    # Keeps the settings if profiling is already on, e.g. with allocation tracing
+    if (trace_file is not None) and not Profiling.enabled :
+        Profiling.Enable()
+
+##############################################################################################
+##############################################################################################
+
+def WriteProfile(trace_file) :
+    if trace_file is not None :
+        Profiling.PrintSummary()
+        Profiling.WriteTrace(trace_file)
+
+##############################################################################################
+##############################################################################################
+
+def RunPFPValidation(inputs, efficiency_vars, matched_vars, all_vars, diff_vars, n_workers=None, step_size=StreamingLoader.default_step_size, skip_unchanged=True, store_dir=None,
+                     trace_file=None, n_replicas=0, make_plots=True, quick_look=None, cache_dir=None, plot_dir=PFPValidationFunc.default_plot_dir) :
+
+    # trace_file : where to write a Chrome trace of the run's stages, None to leave profiling as it is
+    # n_replicas : bootstrap replicas for the uncertainties, 0 for the binomial ones only
+    # make_plots : False for the tables and records alone
+    # quick_look : a QuickLook.QuickLookSample to run on a subsample of the events, None for all of them
+    # cache_dir : where to keep the files' derived columns (DerivedCache), so reruns skip the trees, None to stream them
+    # plot_dir : where the tables, records and figures are written
+    EnableProfiling(trace_file)
+
+    engine = HistogramEngine.FillEngine((efficiency_vars + matched_vars + all_vars + diff_vars) if make_plots else [], n_replicas=n_replicas)
+    engine = RunValidation(inputs, [engine], n_workers, step_size, store_dir, quick_look, cache_dir)[0]
+
+    PFPValidationFunc.WriteEfficiencyTables(engine.category_counts, QuickLook.GetCountScales(quick_look), plot_dir)
+
+    if not make_plots :
+        WriteProfile(trace_file)
+        return engine
+
+    # Compute every figure first, then render them all together
+    with Profiling.Stage('figures:build') :
+        figures = PFPValidationFunc.BuildTrackShowerFigures(engine.category_counts, plot_dir)
+
+        for plot_var in efficiency_vars :
+            figures += PFPValidationFunc.BuildRecoEfficiencyFigures(engine.hists[HistogramEngine.GetVarKey(plot_var)], plot_var, plot_dir)
+
+        for plot_vars, only_matched in [(matched_vars, True), (all_vars, False), (diff_vars, True)] :
+            for plot_var in plot_vars :
+                figures += PFPValidationFunc.BuildVariableFigures(engine.hists[HistogramEngine.GetVarKey(plot_var)], plot_var, only_matched, plot_dir)
+
+    FigureRendering.UseBatchBackend()
+    FigureRendering.RenderFigures(figures, n_workers or os.cpu_count() or 1, skip_unchanged)
+
+    WriteProfile(trace_file)
+
+    return engine
+
+##############################################################################################
+##############################################################################################
+
+def RunHierarchyValidation(inputs, n_workers=None, step_size=StreamingLoader.default_step_size, store_dir=None, trace_file=None, n_replicas=0, quick_look=None,
+                           plot_dir=HierarchyValidationFunc.default_plot_dir) :
+
+    EnableProfiling(trace_file)
+
+    accumulators = [HierarchyValidationFunc.HierarchyTableAccumulator(n_replicas), HierarchyValidationFunc.ChainEfficiencyAccumulator(n_replicas)]
+    accumulators = RunValidation(inputs, accumulators, n_workers, step_size, store_dir, quick_look)
+    count_scales = QuickLook.GetCountScales(quick_look)
+    HierarchyValidationFunc.WriteAllHierarchyTableMetrics(accumulators[0], count_scales, plot_dir)
+    HierarchyValidationFunc.WriteChainEfficiencyTables(accumulators[1], count_scales, plot_dir)
+
+    WriteProfile(trace_file)
+
+    return accumulators
+
+##############################################################################################
+##############################################################################################
+
+def RunMichelValidation(inputs, n_workers=None, step_size=StreamingLoader.default_step_size, store_dir=None, trace_file=None, n_replicas=0, make_plots=True,
+                        topology=TrackValidationFunc.michel_topology, quick_look=None, plot_dir=TrackValidationFunc.default_plot_dir) :
+
+    EnableProfiling(trace_file)
+
+    engine = TrackValidationFunc.TrackChildEngine(topology, n_replicas)
+    engine = RunValidation(inputs, [engine], n_workers, step_size, store_dir, quick_look)[0]
+    engine.WriteTables(QuickLook.GetCountScales(quick_look), plot_dir)
+
+    if make_plots :
+        with Profiling.Stage('figures:build') :
+            figures = engine.BuildFigures(plot_dir)
+
+        FigureRendering.UseBatchBackend()
+        FigureRendering.RenderFigures(figures, n_workers or os.cpu_count() or 1)
+
+    WriteProfile(trace_file)
+
+    return engine
+
+##############################################################################################
+##############################################################################################
+
+def RunThresholdScan(inputs, planes=tuple(ThresholdScan.threshold_planes), n_workers=None, step_size=StreamingLoader.default_step_size, store_dir=None, trace_file=None,
+                     make_plots=True, n_bins=ThresholdScan.default_n_bins, quick_look=None, plot_dir=ThresholdScan.default_plot_dir) :
+
+    EnableProfiling(trace_file)
+
+    engine = ThresholdScan.ThresholdScanEngine(planes, n_bins)
+    engine = RunValidation(inputs, [engine], n_workers, step_size, store_dir, quick_look)[0]
+    ThresholdScan.WriteThresholdScanTables(engine, QuickLook.GetCountScales(quick_look), plot_dir)
+
+    if make_plots :
+        with Profiling.Stage('figures:build') :
+            figures = ThresholdScan.BuildThresholdScanFigures(engine, plot_dir)
+
+        FigureRendering.UseBatchBackend()
+        FigureRendering.RenderFigures(figures, n_workers or os.cpu_count() or 1)
+
+    WriteProfile(trace_file)
+
+    return engine
+
+##############################################################################################
+##############################################################################################
+
+def RunCutFlow(inputs, cut_flows=None, n_workers=None, step_size=StreamingLoader.default_step_size, store_dir=None, trace_file=None, quick_look=None,
+               plot_dir=Selections.default_plot_dir) :
+
+    EnableProfiling(trace_file)
+
+    accumulator = Selections.CutFlowAccumulator(cut_flows)
+    accumulator = RunValidation(inputs, [accumulator], n_workers, step_size, store_dir, quick_look)[0]
+    Selections.WriteCutFlowTables(accumulator, QuickLook.GetCountScales(quick_look), plot_dir)
+
+    WriteProfile(trace_file)
+
+    return accumulator
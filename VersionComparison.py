@@ -0,0 +1,361 @@
+import awkward as ak
+import copy
+import numpy as np
+import os
+import uproot
+import Definitions
+import FigureRendering
+import HierarchyValidationFunc
+import HistogramEngine
+import PFPValidationFunc
+import StreamingLoader
+
+# Relative to the working directory, batch runs pass their own (PandoraMetrics.py compare --output)
+default_plot_dir = os.path.join('plots', 'comparison', '')
+
+# Branches that only depend on the simulation, so are the same for two reconstruction versions of one sample
+truth_branches = ['Run', 'Subrun', 'Event', 'MCInt_IsCC', 'MCNu_PDG',
+                  'MCP_TruePDG', 'MCP_NMCHits2D', 'MCP_TrueEnergy', 'MCP_TrueThetaXZ', 'MCP_TrueThetaYZ', 'MCP_Length', 'MCP_Displacement',
+                  'MC_HierarchyTier', 'MC_ParentIndex',
+                  'MCP_HasMichel', 'MCP_HasTargetMichel']
+
+# Read from both files to check that their particles line up
+check_tree_branches = {'PFPTree' : ['MCP_TruePDG', 'MCP_HasMatch']}
+
+##############################################################################################
+##############################################################################################
+
+def MatchEvents(file_a, file_b) :
+
+    # Entries of the events in both files, in the order of file_a
+    event_ids = []
+
+    for file in [file_a, file_b] :
+        ids = file['EventTree'].arrays(StreamingLoader.event_id_branches, library="np")
+        event_id = np.zeros(len(ids['Run']), dtype=[(branch, np.int64) for branch in StreamingLoader.event_id_branches])
+        for branch in StreamingLoader.event_id_branches :
+            event_id[branch] = ids[branch]
+
+        if len(np.unique(event_id)) != len(event_id) :
+            raise ValueError(f'{file.file_path} has repeated Run/Subrun/Event')
+
+        event_ids.append(event_id)
+
+    _, entries_a, entries_b = np.intersect1d(event_ids[0], event_ids[1], assume_unique=True, return_indices=True)
+    order = np.argsort(entries_a)
+
+    return entries_a[order], entries_b[order]
+
+##############################################################################################
+##############################################################################################
+
+class SelectedBranches :
+    # The chosen entries of a LazyTreeBranches that reads the range covering them
+    def __init__(self, branches, positions) :
+        self.branches = branches
+        self.positions = positions
+
+    def __getitem__(self, branch) :
+        array = self.branches[branch]
+        return array if self.positions is None else array[self.positions]
+
+    def __contains__(self, branch) :
+        return branch in self.branches
+
+    def __len__(self) :
+        return len(self.branches) if self.positions is None else len(self.positions)
+
+    def keys(self) :
+        return self.branches.keys()
+
+##############################################################################################
+##############################################################################################
+
+class SharedTruthBranches :
+    # Truth branches come from the reference version, so they're only read once
+    def __init__(self, truth, reco) :
+        self.truth = truth
+        self.reco = reco
+
+    def __getitem__(self, branch) :
+        return self.truth[branch] if branch in truth_branches else self.reco[branch]
+
+    def __contains__(self, branch) :
+        return branch in self.reco
+
+    def __len__(self) :
+        return len(self.reco)
+
+    def keys(self) :
+        return self.reco.keys()
+
+##############################################################################################
+##############################################################################################
+
+def SelectEntries(trees, tree_branches, entries) :
+
+    # Read the range covering the entries, contiguous runs (the usual case, two versions of one sample) need no selection
+    entry_start = int(entries.min())
+    entry_stop = int(entries.max()) + 1
+    is_contiguous = ((entry_stop - entry_start) == len(entries)) and np.all(np.diff(entries) == 1)
+    positions = None if is_contiguous else entries - entry_start
+
+    id_branches = {}
+
+    for tree_name, tree in trees.items() :
+        if all(branch in tree.keys() for branch in StreamingLoader.event_id_branches) :
+            ids = tree.arrays(StreamingLoader.event_id_branches, entry_start=entry_start, entry_stop=entry_stop, library="ak")
+            id_branches[tree_name] = ids if positions is None else ids[positions]
+
+    if len(id_branches) > 1 :
+        StreamingLoader.CheckChunkAlignment(id_branches, entry_start)
+
+    return {tree_name : SelectedBranches(StreamingLoader.LazyTreeBranches(trees[tree_name], branches, entry_start, entry_stop), positions) \
+            for tree_name, branches in tree_branches.items()}
+
+##############################################################################################
+##############################################################################################
+
+def IterateMatchedChunks(file_name_a, file_name_b, tree_branches, step_size=StreamingLoader.default_step_size) :
+
+    with uproot.open(file_name_a) as file_a, uproot.open(file_name_b) as file_b :
+
+        entries_a, entries_b = MatchEvents(file_a, file_b)
+        trees_a = {tree_name : file_a[tree_name] for tree_name in tree_branches}
+        trees_b = {tree_name : file_b[tree_name] for tree_name in tree_branches}
+
+        for match_start in range(0, len(entries_a), step_size) :
+
+            match_stop = min(match_start + step_size, len(entries_a))
+            chunk_a = SelectEntries(trees_a, tree_branches, entries_a[match_start:match_stop])
+            reco_b = SelectEntries(trees_b, tree_branches, entries_b[match_start:match_stop])
+            chunk_b = {tree_name : SharedTruthBranches(chunk_a[tree_name], reco_b[tree_name]) for tree_name in tree_branches}
+
+            # Sharing the truth is only valid if each event has the same particles in both
+            if np.any(ak.to_numpy(ak.num(chunk_a['PFPTree']['MCP_TruePDG'])) != ak.to_numpy(ak.num(reco_b['PFPTree']['MCP_HasMatch']))) :
+                raise ValueError(f'{file_name_a} and {file_name_b} have different MCParticles for the same event')
+
+            yield chunk_a, chunk_b
+
+##############################################################################################
+##############################################################################################
+
+def RunComparison(file_name_a, file_name_b, accumulators, step_size=StreamingLoader.default_step_size) :
+
+    accumulators_a = accumulators
+    accumulators_b = copy.deepcopy(accumulators)
+    tree_branches = StreamingLoader.MergeTreeBranches(StreamingLoader.PlanBranches(accumulators), check_tree_branches)
+
+    for chunk_a, chunk_b in IterateMatchedChunks(file_name_a, file_name_b, tree_branches, step_size) :
+
+        # One set of masks, from the shared truth
+        int_masks = Definitions.GetIntMasks(chunk_a['EventTree'], chunk_a['PFPTree'])
+        pdg_masks = Definitions.GetPDGMasks(chunk_a['PFPTree'])
+        tier_masks = Definitions.GetTierMasks(chunk_a['HierarchyTree'])
+
+        for accumulator_a, accumulator_b in zip(accumulators_a, accumulators_b) :
+            accumulator_a.Fill(chunk_a, int_masks, tier_masks, pdg_masks)
+            accumulator_b.Fill(chunk_b, int_masks, tier_masks, pdg_masks)
+
+    return accumulators_a, accumulators_b
+
+##############################################################################################
+##############################################################################################
+
+def BinomialSignificance(k_a, n_a, k_b, n_b) :
+
+    # (p_a - p_b) / sigma, treating the versions as independent (conservative, as they share the truth)
+    k_a, n_a, k_b, n_b = [np.asarray(x, dtype=float) for x in [k_a, n_a, k_b, n_b]]
+    p_a = np.divide(k_a, n_a, out=np.zeros_like(k_a), where=n_a > 0)
+    p_b = np.divide(k_b, n_b, out=np.zeros_like(k_b), where=n_b > 0)
+    variance = p_a * (1.0 - p_a) / np.maximum(n_a, 1) + p_b * (1.0 - p_b) / np.maximum(n_b, 1)
+
+    return np.divide(p_a - p_b, np.sqrt(variance), out=np.zeros_like(p_a), where=variance > 0)
+
+##############################################################################################
+##############################################################################################
+
+def GetComparisonFileName(figure, prefix, plot_dir=default_plot_dir) :
+    return f'{plot_dir}{prefix}_{os.path.basename(figure["file_name"])}'
+
+##############################################################################################
+##############################################################################################
+
+def BuildOverlayFigures(figures_a, figures_b, labels, plot_dir=default_plot_dir) :
+
+    overlays = []
+
+    for figure_a, figure_b in zip(figures_a, figures_b) :
+
+        overlay = copy.deepcopy(figure_a)
+        overlay['file_name'] = GetComparisonFileName(figure_a, 'Compare', plot_dir)
+
+        for panel, panel_b in zip(overlay['panels'], figure_b['panels']) :
+            series_b = copy.deepcopy(panel_b['series'])
+
+            for series in panel['series'] :
+                series['kwargs']['label'] = f'{series["kwargs"]["label"]}{labels[0]} '
+
+            for series in series_b :
+                series['kwargs']['label'] = f'{series["kwargs"]["label"]}{labels[1]} '
+                if series['type'] == 'hist' :
+                    series['kwargs']['linestyle'] = '--'
+                else :
+                    series['kwargs']['fmt'] = 's--'
+
+            panel['series'] = panel['series'] + series_b
+
+        overlays.append(overlay)
+
+    return overlays
+
+##############################################################################################
+##############################################################################################
+
+def BuildSignificanceFigures(hist_a, hist_b, plot_var, labels, efficiency, has_match=None, plot_dir=default_plot_dir) :
+
+    # Per-bin significance of the difference in efficiency, or in the normalised distribution
+    edges = hist_a.edges
+    bin_centers = 0.5 * (edges[1:] + edges[:-1])
+    var_name = HistogramEngine.GetVarKey(plot_var)
+    figures = []
+
+    for tier in Definitions.tiers :
+
+        panels = []
+
+        for iInt, int_type in enumerate(Definitions.ints) :
+
+            for iPDG in range(len(Definitions.pdgs)) :
+
+                pdg = Definitions.pdgs[iPDG]
+
+                if efficiency :
+                    significance = BinomialSignificance(hist_a.Slice(int_type, pdg, tier, has_match=1), hist_a.Slice(int_type, pdg, tier),
+                                                        hist_b.Slice(int_type, pdg, tier, has_match=1), hist_b.Slice(int_type, pdg, tier))
+                else :
+                    significance = BinomialSignificance(hist_a.Slice(int_type, pdg, tier, has_match=has_match), hist_a.NEntries(int_type, pdg, tier, has_match=has_match),
+                                                        hist_b.Slice(int_type, pdg, tier, has_match=has_match), hist_b.NEntries(int_type, pdg, tier, has_match=has_match))
+
+                panel = PFPValidationFunc.GetGridPanel(iInt, iPDG, tier, plot_var.x_label, f'({labels[0]} - {labels[1]}) / sigma', var_name)
+                panel['series'] = [{'type' : 'errorbar', 'x' : bin_centers, 'y' : significance, 'yerr' : np.zeros(len(significance)),
+                                    'kwargs' : {'fmt' : 'o', 'color' : Definitions.pdg_color[pdg], 'label' : f' {Definitions.pdg_strings[pdg]} '}}]
+                panel['ylim'] = (-5.0, 5.0)
+                panels.append(panel)
+
+        file_name = ('Efficiency' if efficiency else 'Distribution') + f'_{var_name}_{Definitions.tier_strings[tier]}.pdf'
+        figures.append({'renderer' : 'grid', 'file_name' : f'{plot_dir}Significance_{file_name}',
+                        'nrows' : len(Definitions.ints), 'ncols' : len(Definitions.pdgs), 'figsize' : (14, 10),
+                        'tight_layout' : {'pad' : 0}, 'subplots_adjust' : {'left' : 0.08, 'bottom' : 0.08}, 'panels' : panels})
+
+    return figures
+
+##############################################################################################
+##############################################################################################
+
+def BuildTrackShowerDifferenceFigures(category_counts_a, category_counts_b, labels, plot_dir=default_plot_dir) :
+
+    differences = []
+
+    for figure_a, figure_b in zip(PFPValidationFunc.BuildTrackShowerFigures(category_counts_a), PFPValidationFunc.BuildTrackShowerFigures(category_counts_b)) :
+
+        difference = copy.deepcopy(figure_b)
+        difference['file_name'] = GetComparisonFileName(figure_a, 'Difference', plot_dir)
+
+        for panel, panel_a in zip(difference['panels'], figure_a['panels']) :
+            panel['matrix'] = np.round(panel['matrix'] - panel_a['matrix'], 2)
+            panel['title'] = f'{panel["title"]} ({labels[1]} - {labels[0]})'
+            panel['colorbar_label'] = 'Difference'
+
+        differences.append(difference)
+
+    return differences
+
+##############################################################################################
+##############################################################################################
+
+def PrintComparisonTable(title, rows, labels, file) :
+
+    # rows : [(row name, k_a, n_a, k_b, n_b)]
+    print(title, file=file)
+    print('--------------------------------------------------------------', file=file)
+    print('           |' + f' {labels[0]}'[:14].ljust(14) + '|' + f' {labels[1]}'[:14].ljust(14) + '| Significance |', file=file)
+    print('--------------------------------------------------------------', file=file)
+
+    for row_name, k_a, n_a, k_b, n_b in rows :
+        frac_a = round(0.0 if n_a == 0 else float(k_a) / float(n_a), 2)
+        frac_b = round(0.0 if n_b == 0 else float(k_b) / float(n_b), 2)
+        significance = round(float(BinomialSignificance(k_a, n_a, k_b, n_b)), 1)
+
+        print(' ' + str(row_name) + str(' '* (10 - len(str(row_name)))) + \
+                                    '|' + str(frac_a) + str(' '* (14 - len(str(frac_a)))) + \
+                                    '|' + str(frac_b) + str(' '* (14 - len(str(frac_b)))) + \
+                                    '|' + str(significance) + str(' '* (14 - len(str(significance)))) + \
+                                    '|', file=file)
+
+    print('--------------------------------------------------------------', file=file)
+    print('', file=file)
+
+##############################################################################################
+##############################################################################################
+
+def WriteComparisonTables(engines, hierarchy_accumulators, chain_accumulators, labels, plot_dir=default_plot_dir) :
+
+    os.makedirs(plot_dir, exist_ok=True)
+
+    with open(f'{plot_dir}ComparisonTables.txt', "w") as f :
+
+        print(f'A = {labels[0]}, B = {labels[1]}', file=f)
+        print('', file=f)
+
+        for int_type in Definitions.ints :
+
+            category_counts_a, category_counts_b = [engine.category_counts for engine in engines]
+            rows = [(Definitions.tier_strings[tier],
+                     category_counts_a.NEntries(int_type, tier=tier, has_match=1), category_counts_a.NEntries(int_type, tier=tier),
+                     category_counts_b.NEntries(int_type, tier=tier, has_match=1), category_counts_b.NEntries(int_type, tier=tier)) for tier in Definitions.tiers]
+            PrintComparisonTable(f'{Definitions.int_strings[int_type]} - Efficiency', rows, labels, f)
+
+            # Correct parent fraction, of those whose parent was reconstructed
+            table_counts_a, table_counts_b = [accumulator.GetTableCounts(True, False) for accumulator in hierarchy_accumulators]
+            rows = [(Definitions.tier_strings[tier],
+                     table_counts_a[(int_type, -1, tier)][0], table_counts_a[(int_type, -1, tier)][4],
+                     table_counts_b[(int_type, -1, tier)][0], table_counts_b[(int_type, -1, tier)][4]) for tier in Definitions.tiers]
+            PrintComparisonTable(f'{Definitions.int_strings[int_type]} - Correct Parent', rows, labels, f)
+
+            chain_metrics_a, chain_metrics_b = [accumulator.GetEfficiencyMetrics(True, False) for accumulator in chain_accumulators]
+            rows = [(Definitions.tier_strings[tier],
+                     chain_metrics_a[(int_type, -1, tier)]['NReco'], chain_metrics_a[(int_type, -1, tier)]['NTarget'],
+                     chain_metrics_b[(int_type, -1, tier)]['NReco'], chain_metrics_b[(int_type, -1, tier)]['NTarget']) for tier in Definitions.tiers]
+            PrintComparisonTable(f'{Definitions.int_strings[int_type]} - Chain Efficiency (Correct Parents)', rows, labels, f)
+
+##############################################################################################
+##############################################################################################
+
+def CompareVersions(file_name_a, file_name_b, labels, efficiency_vars, matched_vars, all_vars, diff_vars, step_size=StreamingLoader.default_step_size, n_workers=1, skip_unchanged=False,
+                   plot_dir=default_plot_dir) :
+
+    accumulators = [HistogramEngine.FillEngine(efficiency_vars + matched_vars + all_vars + diff_vars),
+                    HierarchyValidationFunc.HierarchyTableAccumulator(),
+                    HierarchyValidationFunc.ChainEfficiencyAccumulator()]
+    accumulators_a, accumulators_b = RunComparison(file_name_a, file_name_b, accumulators, step_size)
+    engines = [accumulators_a[0], accumulators_b[0]]
+
+    WriteComparisonTables(engines, [accumulators_a[1], accumulators_b[1]], [accumulators_a[2], accumulators_b[2]], labels, plot_dir)
+
+    figures = BuildTrackShowerDifferenceFigures(engines[0].category_counts, engines[1].category_counts, labels, plot_dir)
+
+    for plot_var in efficiency_vars :
+        hists = [engine.hists[HistogramEngine.GetVarKey(plot_var)] for engine in engines]
+        figures += BuildOverlayFigures(*[PFPValidationFunc.BuildRecoEfficiencyFigures(hist, plot_var) for hist in hists], labels, plot_dir)
+        figures += BuildSignificanceFigures(hists[0], hists[1], plot_var, labels, True, plot_dir=plot_dir)
+
+    for plot_vars, only_matched in [(matched_vars, True), (all_vars, False), (diff_vars, True)] :
+        for plot_var in plot_vars :
+            hists = [engine.hists[HistogramEngine.GetVarKey(plot_var)] for engine in engines]
+            figures += BuildOverlayFigures(*[PFPValidationFunc.BuildVariableFigures(hist, plot_var, only_matched) for hist in hists], labels, plot_dir)
+            figures += BuildSignificanceFigures(hists[0], hists[1], plot_var, labels, False, 1 if only_matched else None, plot_dir)
+
+    FigureRendering.RenderFigures(figures, n_workers, skip_unchanged)
+
+    return accumulators_a, accumulators_b
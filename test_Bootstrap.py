@@ -0,0 +1,74 @@
+import awkward as ak
+import numpy as np
+import pytest
+import Bootstrap
+import HistogramEngine
+import SyntheticData
+import ValidationFunc
+import ValidationRunner
+
+# The replicas don't depend on how the events are split into chunks or workers, and the spread of a ratio over them
+#   python -m pytest test_Bootstrap.py
+
+n_replicas = 20
+
+##############################################################################################
+##############################################################################################
+
+@pytest.fixture(scope='module')
+def synthetic_files(tmp_path_factory) :
+    output_dir = tmp_path_factory.mktemp('bootstrap')
+    return [SyntheticData.WriteSyntheticFile(str(output_dir / f'Synthetic{seed}.root'), 500, mean_pfps=6, seed=seed, events_per_basket=200) for seed in [21, 22]]
+
+##############################################################################################
+##############################################################################################
+
+def RunEngine(file_names, n_workers, step_size) :
+    return ValidationRunner.RunValidation(file_names, [HistogramEngine.FillEngine([ValidationFunc.purity_var], n_replicas=n_replicas)], n_workers, step_size)[0]
+
+##############################################################################################
+##############################################################################################
+
+def test_event_weights_ignore_chunking() :
+
+    event_branches = ak.Array({'Run' : np.ones(300, dtype=np.int32), 'Subrun' : np.arange(300, dtype=np.int32) // 100, 'Event' : np.arange(300, dtype=np.int32)})
+    event_weights = Bootstrap.GetEventWeights(event_branches, n_replicas)
+    chunk_weights = [Bootstrap.GetEventWeights(event_branches[start:start + 70], n_replicas) for start in range(0, 300, 70)]
+
+    assert np.array_equal(event_weights, np.concatenate(chunk_weights, axis=1))
+
+##############################################################################################
+##############################################################################################
+
+@pytest.mark.parametrize('n_workers, step_size', [(1, 37), (1, 250), (2, 10000), (2, 64)])
+def test_replicas_ignore_chunks_and_workers(synthetic_files, n_workers, step_size) :
+
+    expected = RunEngine(synthetic_files, 1, 10000)
+    engine = RunEngine(synthetic_files, n_workers, step_size)
+
+    assert expected.category_counts.replicas.sum() > 0
+    assert np.array_equal(engine.category_counts.replicas, expected.category_counts.replicas)
+
+    for var_key, hist in expected.hists.items() :
+        assert np.array_equal(engine.hists[var_key].replicas, hist.replicas)
+
+##############################################################################################
+##############################################################################################
+
+def test_ratio_uncertainty_skips_zero_totals() :
+
+    # The replica with nothing in total is left out, rather than counted as a ratio of 0
+    uncertainty = Bootstrap.GetRatioUncertainty([[1], [2], [0], [3]], [[2], [4], [0], [4]])
+
+    assert uncertainty == pytest.approx([np.std([0.5, 0.5, 0.75], ddof=1)])
+
+##############################################################################################
+##############################################################################################
+
+def test_ratio_uncertainty_needs_two_replicas() :
+
+    uncertainty = Bootstrap.GetRatioUncertainty([[0, 0, 1], [0, 3, 2], [0, 0, 1]], [[0, 0, 2], [0, 5, 4], [0, 0, 2]])
+
+    assert np.isnan(uncertainty[0])
+    assert np.isnan(uncertainty[1])
+    assert uncertainty[2] == pytest.approx(0.0)
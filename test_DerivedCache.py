@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import HierarchyValidationFunc
+import HistogramEngine
+import SyntheticData
+import ValidationFunc
+import ValidationRunner
+
+# Filling from the cached columns against streaming the trees
+#   python -m pytest test_DerivedCache.py
+
+plot_vars = [ValidationFunc.completeness_var, ValidationFunc.length_diff_var]
+
+##############################################################################################
+##############################################################################################
+
+@pytest.fixture(scope='module')
+def synthetic_file(tmp_path_factory) :
+    return SyntheticData.WriteSyntheticFile(str(tmp_path_factory.mktemp('cache') / 'Synthetic.root'), 600, mean_pfps=6, seed=31, events_per_basket=250)
+
+##############################################################################################
+##############################################################################################
+
+def test_cache_hit_matches_streaming(synthetic_file, tmp_path) :
+
+    cache_dir = str(tmp_path / 'cache')
+    streamed = ValidationRunner.RunValidation([synthetic_file], [HistogramEngine.FillEngine(plot_vars)], n_workers=1, step_size=200)[0]
+
+    # The first run builds the cache, the second is filled from it alone
+    for i_run in range(2) :
+        cached = ValidationRunner.RunValidation([synthetic_file], [HistogramEngine.FillEngine(plot_vars)], n_workers=1, step_size=200, cache_dir=cache_dir)[0]
+
+        assert np.array_equal(cached.category_counts.counts, streamed.category_counts.counts)
+        for var_key, hist in streamed.hists.items() :
+            assert np.array_equal(cached.hists[var_key].counts, hist.counts)
+
+##############################################################################################
+##############################################################################################
+
+def test_cache_refuses_other_accumulators(synthetic_file, tmp_path) :
+    with pytest.raises(ValueError) :
+        ValidationRunner.RunValidation([synthetic_file], [HierarchyValidationFunc.HierarchyTableAccumulator()], n_workers=1, cache_dir=str(tmp_path / 'cache'))
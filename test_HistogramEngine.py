@@ -0,0 +1,85 @@
+import awkward as ak
+import numpy as np
+import pytest
+import Definitions
+import HistogramEngine
+import ValidationFunc
+
+# The single bincount of FillEngine against one np.histogram per category, as the notebooks used to fill them
+#   python -m pytest test_HistogramEngine.py
+
+plot_var = ValidationFunc.PlotVar('BM_Purity', 'Purity', 'Frac. of MCParticles', [0, 1.0], 10)
+
+##############################################################################################
+##############################################################################################
+
+@pytest.fixture(scope='module')
+def synthetic_arrays() :
+
+    rng = np.random.default_rng(5)
+    counts = rng.poisson(6, 300)
+    n_entries = counts.sum()
+
+    # Values inside and outside the range, on the edges and NaN
+    values = rng.uniform(-0.3, 1.3, n_entries)
+    special = rng.random(n_entries)
+    values[special < 0.05] = np.nan
+    values[(special >= 0.05) & (special < 0.1)] = 1.0
+    values[(special >= 0.1) & (special < 0.15)] = 0.0
+
+    has_match = (rng.random(n_entries) < 0.7).astype(np.int32)
+    is_track = np.where(has_match == 1, rng.random(n_entries) < 0.5, -1).astype(np.int32)
+    is_shower = np.where(has_match == 1, (1 - is_track) * (rng.random(n_entries) < 0.9), -1).astype(np.int32)
+    pfp_branches = {'BM_Purity' : ak.unflatten(values, counts), 'MCP_HasMatch' : ak.unflatten(has_match, counts),
+                    'BM_IsTrack' : ak.unflatten(is_track, counts), 'BM_IsShower' : ak.unflatten(is_shower, counts)}
+
+    # Hand-made masks, one category (or none) per axis for each entry
+    masks = []
+    for categories in [Definitions.ints, Definitions.tiers, Definitions.pdgs] :
+        codes = rng.integers(0, len(categories) + 1, n_entries)
+        masks.append({category : ak.unflatten(codes == index, counts) for index, category in enumerate(categories)})
+
+    return pfp_branches, masks
+
+##############################################################################################
+##############################################################################################
+
+def test_fill_engine_matches_histogram_loops(synthetic_arrays) :
+
+    pfp_branches, (int_masks, tier_masks, pdg_masks) = synthetic_arrays
+    engine = HistogramEngine.FillEngine([plot_var])
+    engine.Fill({'PFPTree' : pfp_branches}, int_masks, tier_masks, pdg_masks)
+    hist = engine.hists[HistogramEngine.GetVarKey(plot_var)]
+
+    for int_type in Definitions.ints :
+        for pdg in Definitions.pdgs :
+            for tier in Definitions.tiers :
+                target_mask = int_masks[int_type] & pdg_masks[pdg] & tier_masks[tier]
+                reco_mask = target_mask & (pfp_branches['MCP_HasMatch'] == 1)
+
+                for has_match, mask in [(None, target_mask), (1, reco_mask)] :
+                    entries = ak.to_numpy(ak.flatten(pfp_branches['BM_Purity'][mask]))
+                    expected, _ = np.histogram(entries, bins=plot_var.n_bins, range=plot_var.range)
+
+                    # Below the range in the underflow, above it and NaN in the overflow
+                    projected = hist.Project(int_type, pdg, tier, has_match)
+                    assert np.array_equal(projected[1:-1], expected)
+                    assert projected[0] == np.sum(entries < plot_var.range[0])
+                    assert projected[-1] == np.sum((entries > plot_var.range[1]) | np.isnan(entries))
+
+                # Track/shower classification of the matched targets
+                classified_mask = target_mask & (pfp_branches['BM_IsTrack'] != -1)
+                assert engine.category_counts.NEntries(int_type, pdg, tier) == ak.sum(target_mask)
+                assert engine.category_counts.NEntries(int_type, pdg, tier, reco_class=1) == ak.sum(pfp_branches['BM_IsTrack'][classified_mask] == 1)
+                assert engine.category_counts.NEntries(int_type, pdg, tier, reco_class=2) == \
+                       ak.sum((pfp_branches['BM_IsShower'][classified_mask] == 1) & (pfp_branches['BM_IsTrack'][classified_mask] != 1))
+
+##############################################################################################
+##############################################################################################
+
+def test_bin_indices_conventions() :
+
+    edges = np.linspace(0.0, 1.0, 5)
+    values = np.array([-0.1, 0.0, 0.2, 0.25, 0.99, 1.0, 1.01, np.nan])
+
+    assert HistogramEngine.GetBinIndices(values, edges).tolist() == [0, 1, 1, 2, 4, 4, 5, 5]
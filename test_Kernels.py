@@ -0,0 +1,29 @@
+import pytest
+import Kernels
+import SyntheticData
+
+# The per-event loops against the NumPy paths, on a small synthetic file
+#   python -m pytest test_Kernels.py
+
+##############################################################################################
+##############################################################################################
+
+@pytest.fixture(scope='module')
+def synthetic_file(tmp_path_factory) :
+    # Deep hierarchies and several baskets, so that links cross basket boundaries and reach past the primaries
+    return SyntheticData.WriteSyntheticFile(str(tmp_path_factory.mktemp('kernels') / 'Synthetic.root'), 2000, mean_pfps=8, max_depth=5, seed=7,
+                                            events_per_basket=700)
+
+##############################################################################################
+##############################################################################################
+
+@pytest.mark.parametrize('kernel_backend', ['python', 'numba'])
+def test_kernels_match_numpy(synthetic_file, kernel_backend) :
+
+    if (kernel_backend == 'numba') and not Kernels.HasNumba() :
+        pytest.skip('Numba is not installed')
+
+    backend_before = Kernels.backend
+    Kernels.CheckKernels([synthetic_file], kernel_backend)
+
+    assert Kernels.backend == backend_before
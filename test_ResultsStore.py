@@ -0,0 +1,58 @@
+import numpy as np
+import os
+import shutil
+import pytest
+import HistogramEngine
+import SyntheticData
+import ValidationRunner
+
+# Incremental updates of the stored results against a fresh run over the same files
+#   python -m pytest test_ResultsStore.py
+
+n_replicas = 20
+
+##############################################################################################
+##############################################################################################
+
+@pytest.fixture(scope='module')
+def synthetic_file(tmp_path_factory) :
+    return SyntheticData.WriteSyntheticFile(str(tmp_path_factory.mktemp('store') / 'Synthetic.root'), 500, mean_pfps=6, seed=3)
+
+##############################################################################################
+##############################################################################################
+
+def RunEngine(file_names, store_dir=None) :
+    return ValidationRunner.RunValidation(file_names, [HistogramEngine.FillEngine(n_replicas=n_replicas)], n_workers=1, store_dir=store_dir)[0]
+
+##############################################################################################
+##############################################################################################
+
+def CheckSameCounts(engine, expected) :
+    assert np.array_equal(engine.category_counts.counts, expected.category_counts.counts)
+    assert np.array_equal(engine.category_counts.replicas, expected.category_counts.replicas)
+
+##############################################################################################
+##############################################################################################
+
+def test_renamed_file_matches_fresh_run(synthetic_file, tmp_path) :
+
+    store_dir = str(tmp_path / 'store')
+    old_name = shutil.copy(synthetic_file, str(tmp_path / 'Old.root'))
+    RunEngine([old_name], store_dir)
+
+    new_name = str(tmp_path / 'New.root')
+    os.rename(old_name, new_name)
+
+    CheckSameCounts(RunEngine([new_name], store_dir), RunEngine([new_name]))
+
+##############################################################################################
+##############################################################################################
+
+def test_removing_an_identical_copy_matches_fresh_run(synthetic_file, tmp_path) :
+
+    store_dir = str(tmp_path / 'store')
+    first = shutil.copy(synthetic_file, str(tmp_path / 'First.root'))
+    second = shutil.copy(synthetic_file, str(tmp_path / 'Second.root'))
+    RunEngine([first, second], store_dir)
+
+    CheckSameCounts(RunEngine([second], store_dir), RunEngine([second]))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import HierarchyValidationFunc
+import HistogramEngine
+import SyntheticData
+import ValidationFunc
+import ValidationRunner
+
+# Pooled runs against serial ones, which have to agree to the last count
+#   python -m pytest test_ValidationRunner.py
+
+n_replicas = 10
+
+##############################################################################################
+##############################################################################################
+
+@pytest.fixture(scope='module')
+def synthetic_files(tmp_path_factory) :
+    output_dir = tmp_path_factory.mktemp('runner')
+    return [SyntheticData.WriteSyntheticFile(str(output_dir / f'Synthetic{seed}.root'), 400, mean_pfps=6, seed=seed, events_per_basket=150) for seed in [11, 12]]
+
+##############################################################################################
+##############################################################################################
+
+def GetAccumulators() :
+    return [HistogramEngine.FillEngine([ValidationFunc.completeness_var], n_replicas=n_replicas), HierarchyValidationFunc.HierarchyTableAccumulator(n_replicas)]
+
+##############################################################################################
+##############################################################################################
+
+def test_pooled_matches_serial(synthetic_files) :
+
+    serial = ValidationRunner.RunValidation(synthetic_files, GetAccumulators(), n_workers=1, step_size=100)
+    pooled = ValidationRunner.RunValidation(synthetic_files, GetAccumulators(), n_workers=2, step_size=100)
+
+    for hist_serial, hist_pooled in [(serial[0].category_counts, pooled[0].category_counts)] + \
+                                    [(serial[0].hists[var_key], pooled[0].hists[var_key]) for var_key in serial[0].hists] + [(serial[1], pooled[1])] :
+        assert hist_serial.counts.sum() > 0
+        assert np.array_equal(hist_serial.counts, hist_pooled.counts)
+        assert np.array_equal(hist_serial.replicas, hist_pooled.replicas)